@@ -0,0 +1,10 @@
+# ---------------------------------------------------------
+# ベンチマーク (合成データで各ルートの応答時間とSQL発行数を測る)
+# ---------------------------------------------------------
+# データ生成:   python -m benchmark.generate --scores 100000 --out bench.csv
+# 計測:         python -m benchmark.harness --sizes 10000 100000 --out results.json
+# 比較:         python -m benchmark.harness --compare before.json after.json
+# 起動時間:     python -m benchmark.startup --rows 10000 --repeat 5
+#
+# 計測は規模ごとに別プロセスで、一時ディレクトリのDB (DATABASE_URL) に対して行う。
+# 手元の shooting.db や uploads/ には触らない。
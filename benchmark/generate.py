@@ -0,0 +1,162 @@
+# ---------------------------------------------------------
+# 合成データの生成 (アップロードと同じ列構成のCSV)
+# ---------------------------------------------------------
+# 同じ seed なら毎回同じデータになる。選手は入部年度ごとに採用し、在籍4年間、
+# 大会 (matches() の custom_order) ごとに自分の種目を撃つ。実力は選手ごとに決まり、
+# 学年が上がるほど少し伸びる。各大会・種目・性別の上位3名を Regular にする
+# (早慶戦は男女混合なので種目ごとに上位3名)。
+import argparse
+import csv
+import random
+from datetime import date, timedelta
+
+HEADER = ['日付', '大会名', '識別', '選手名', '性別', '入部年度', '種目', 'S1', 'S2', 'S3', 'S4', 'S5', 'S6', '合計']
+
+# 大会名と開催日 (月, 日)。年度内の順に並べる
+MATCHES = [
+    ('春季関東大会', 5, 3), ('選抜', 5, 24), ('東京六大学（春）', 6, 14), ('新人BR大会', 7, 5),
+    ('東日本学生', 8, 20), ('秋季関東大会', 9, 13), ('東京六大学（秋）', 10, 11), ('東西六大学', 11, 1),
+    ('全日本', 11, 15), ('新人戦', 12, 6), ('早慶戦', 12, 20),
+]
+
+# 種目: (小数点採点か, 1シリーズの平均, 選手間のばらつき, 1シリーズのばらつき, 1シリーズの上限)
+EVENTS = {
+    'AR60': (True, 99.5, 3.0, 1.8, 109.0),
+    'SB3x20': (True, 91.5, 4.0, 2.5, 109.0),
+    'P60': (True, 99.5, 2.5, 1.8, 109.0),
+    'AP60': (False, 90.0, 3.5, 2.5, 100),
+    'BP': (False, 88.0, 3.5, 2.5, 100),
+}
+GROWTH_PER_YEAR = 0.6  # 学年が1つ上がるごとの1シリーズあたりの伸び
+ATTEND_RATE = 0.8      # 各大会に出場する確率
+REGULARS = 3           # 団体メンバーの人数
+
+SURNAMES = ['佐藤', '鈴木', '高橋', '田中', '伊藤', '渡辺', '山本', '中村', '小林', '加藤', '吉田', '山田',
+            '佐々木', '山口', '松本', '井上', '木村', '林', '斎藤', '清水', '山崎', '森', '池田', '橋本',
+            '阿部', '石川', '山下', '中島', '石井', '小川', '前田', '岡田', '長谷川', '藤田', '後藤', '近藤',
+            '村上', '遠藤', '青木', '坂本', '斉藤', '福田', '太田', '西村', '藤井', '金子', '岡本', '藤原']
+GIVEN_NAMES = {
+    '男': ['翔太', '大輔', '拓也', '健太', '直人', '悠斗', '蓮', '陽翔', '湊', '大翔', '颯太', '樹',
+           '悠真', '陸', '海斗', '匠', '亮', '誠', '和也', '達也', '雄大', '航', '優斗', '慎也'],
+    '女': ['千尋', '茜', '直子', '未来', '菜々子', '結衣', '陽菜', '美咲', '葵', '凛', 'さくら', '楓',
+           '彩花', '真由', '愛', '優花', '美月', '遥', '舞', '彩', '沙希', '杏', '莉子', '奈央'],
+}
+
+
+class _Club:
+    def __init__(self, rng):
+        self.rng = rng
+        self.names = set()
+        self.players = []  # [{'name', 'gender', 'entry_year', 'events': {種目: 実力}}]
+
+    def _name(self, gender):
+        rng = self.rng
+        for _ in range(20):
+            name = f'{rng.choice(SURNAMES)} {rng.choice(GIVEN_NAMES[gender])}'
+            if name not in self.names: break
+        else:
+            base, n = name, 2
+            while name in self.names:
+                name, n = f'{base}{n}', n + 1
+        self.names.add(name)
+        return name
+
+    def recruit(self, entry_year, count):
+        rng = self.rng
+        for _ in range(count):
+            gender = '男' if rng.random() < 0.6 else '女'
+            if rng.random() < 0.75:  # ライフル
+                events = ['AR60'] + [e for e, p in (('SB3x20', 0.6), ('P60', 0.5)) if rng.random() < p]
+            else:                    # ピストル
+                events = ['AP60'] + (['BP'] if rng.random() < 0.6 else [])
+            self.players.append({
+                'name': self._name(gender), 'gender': gender, 'entry_year': entry_year,
+                'events': {e: rng.gauss(0, 1) * EVENTS[e][2] for e in events},
+            })
+
+    def active(self, year):
+        return [p for p in self.players if p['entry_year'] <= year <= p['entry_year'] + 3]
+
+
+def _series(rng, event, skill, grade):
+    decimal, mean, _, noise, cap = EVENTS[event]
+    center = mean + skill + GROWTH_PER_YEAR * grade
+    values = [min(cap, rng.gauss(center, noise)) for _ in range(6)]
+    values = [round(v, 1) for v in values] if decimal else [float(round(v)) for v in values]
+    return values, round(sum(values), 1)
+
+
+def cohort_size(n_scores, seasons):
+    """おおよそ seasons 年度で n_scores 件になる1学年あたりの人数"""
+    events_per_player = 1.0 + 0.75 * (0.6 + 0.5) + 0.25 * 0.6
+    per_player_season = len(MATCHES) * ATTEND_RATE * events_per_player
+    return max(2, round(n_scores / (seasons * 4 * per_player_season)))
+
+
+def generate_rows(n_scores, seed=0, seasons=8, last_year=2025):
+    """HEADER の順の行を日付順に n_scores 件返すジェネレータ。
+    last_year はおおよその最終年度 (件数に届くまで次の年度へ進み、届いたところで打ち切る)"""
+    rng = random.Random(seed)
+    club = _Club(rng)
+    first_year = last_year - seasons + 1
+    per_cohort = cohort_size(n_scores, seasons)
+    for entry_year in range(first_year - 3, first_year):  # 初年度に在籍している上級生
+        club.recruit(entry_year, per_cohort)
+
+    produced, year = 0, first_year
+    while True:
+        club.recruit(year, per_cohort)
+        members = club.active(year)
+        for match_name, month, day in MATCHES:
+            held = date(year if month >= 4 else year + 1, month, day) + timedelta(days=rng.randint(0, 6))
+            mixed = '早慶戦' in match_name
+            entries = []  # (種目, 選手, 実力)
+            for p in members:
+                if rng.random() >= ATTEND_RATE: continue
+                for event, skill in p['events'].items():
+                    entries.append((event, p, skill))
+            # 団体メンバー: 種目×性別 (早慶戦は種目のみ) ごとに実力の上位
+            teams = {}
+            for event, p, skill in entries:
+                teams.setdefault((event, None if mixed else p['gender']), []).append((skill, p['name']))
+            regulars = set()
+            for key, cands in teams.items():
+                for _, name in sorted(cands, reverse=True)[:REGULARS]:
+                    regulars.add((key[0], name))
+
+            for event, p, skill in entries:
+                series, total = _series(rng, event, skill, year - p['entry_year'])
+                category = 'Regular' if (event, p['name']) in regulars else 'Individual'
+                yield [held.strftime('%Y/%m/%d'), match_name, category, p['name'], p['gender'],
+                       p['entry_year'], event] + series + [total]
+                produced += 1
+                if produced >= n_scores: return
+        year += 1
+
+
+def write_csv(path, rows, encoding='cp932'):
+    """rows を CSV に書き出して件数を返す (部の記録と同じく cp932 で書く)"""
+    count = 0
+    with open(path, 'w', encoding=encoding, newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ベンチマーク用の成績CSVを生成する')
+    parser.add_argument('--scores', type=int, default=10000, help='生成する成績の件数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--seasons', type=int, default=8, help='年度数')
+    parser.add_argument('--last-year', type=int, default=2025, help='おおよその最終年度')
+    parser.add_argument('--out', required=True)
+    args = parser.parse_args()
+    count = write_csv(args.out, generate_rows(args.scores, args.seed, args.seasons, args.last_year))
+    print(f'{args.out}: {count}件')
+
+
+if __name__ == '__main__':
+    main()
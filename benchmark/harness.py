@@ -0,0 +1,232 @@
+# ---------------------------------------------------------
+# ベンチマークの計測 (Flask のテストクライアントで各ルートを呼ぶ)
+# ---------------------------------------------------------
+# 規模 (成績の件数) ごとに子プロセスを起動し、一時ディレクトリのDBに合成データを
+# 取り込んでから計測する。main.py は読み込み時にDBへ接続するので、DATABASE_URL を
+# 子プロセスの環境変数で渡す。結果は JSON に保存し、--compare でコミット間を比較する。
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from urllib.parse import quote
+
+from benchmark.generate import generate_rows, write_csv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = [10000, 100000, 1000000]
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def _summary(latencies, queries):
+    ms = [v * 1000 for v in latencies]
+    return {
+        'requests': len(ms),
+        'mean_ms': round(sum(ms) / len(ms), 2),
+        'p50_ms': round(_percentile(ms, 50), 2), 'p90_ms': round(_percentile(ms, 90), 2),
+        'p95_ms': round(_percentile(ms, 95), 2), 'p99_ms': round(_percentile(ms, 99), 2),
+        'max_ms': round(max(ms), 2),
+        'queries_mean': round(sum(queries) / len(queries), 2), 'queries_max': max(queries),
+    }
+
+
+def _targets(main, samples):
+    """ルートごとの計測URL (選手・大会はIDや並び順から等間隔に選ぶ)"""
+    from sqlalchemy import func
+    db, Score, Player = main.db, main.Score, main.Player
+    player_ids = [pid for (pid,) in db.session.query(Player.id).order_by(Player.id)]
+    players = player_ids[::max(1, len(player_ids) // samples)][:samples]
+    match_rows = db.session.query(Score.match_name, func.max(Score.academic_year)) \
+        .group_by(Score.match_name).order_by(func.min(Score.id)).all()
+    match_rows = match_rows[::max(1, len(match_rows) // samples)][:samples]
+    return {
+        '/': ['/'],
+        '/ranking': ['/ranking'],
+        '/player/<id>': [f'/player/{pid}' for pid in players],
+        '/match/<name>/years': [f'/match/{quote(name)}/years' for name, _ in match_rows],
+        '/match/<name>/<year>': [f'/match/{quote(name)}/{year}' for name, year in match_rows],
+    }
+
+
+def measure_size(size, repeat=20, samples=5, upload_rows=1000, seed=0, cache=False):
+    """現在のプロセスで size 件のデータを取り込んで計測する (DATABASE_URL は呼び出し側で設定済みのこと)"""
+    if 'DATABASE_URL' not in os.environ:
+        raise RuntimeError('DATABASE_URL を一時ディレクトリのDBに設定してから呼ぶこと (shooting.db を書き換えないため)')
+    sys.path.insert(0, ROOT)
+    import main
+    from sqlalchemy import event
+
+    app = main.app
+    with app.app_context():
+        main.init_db()
+        workdir = os.path.join(os.path.dirname(main.db.engine.url.database), 'work')
+    os.makedirs(workdir, exist_ok=True)
+    app.config.update(IMPORT_ASYNC=False, CACHE_ENABLED=cache, UPLOAD_FOLDER=workdir)
+
+    # 取り込み: 先頭 size 件を初期データ、残りをアップロードの計測に使う (どちらも同じ部の続きの記録)
+    rows = generate_rows(size + upload_rows * repeat, seed=seed)
+    base_csv = os.path.join(workdir, 'base.csv')
+    write_csv(base_csv, (row for _, row in zip(range(size), rows)))
+    upload_csvs = []
+    for i in range(repeat):
+        path = os.path.join(workdir, f'upload_{i}.csv')
+        write_csv(path, (row for _, row in zip(range(upload_rows), rows)))
+        upload_csvs.append(path)
+
+    with app.app_context():
+        started = time.perf_counter()
+        report = main.run_import(base_csv)
+        load_seconds = time.perf_counter() - started
+        engines = list(main.db.engines.values())
+        targets = _targets(main, samples)
+        players = main.Player.query.count()
+
+    counter = [0]
+    def count_query(*_args, **_kwargs):
+        counter[0] += 1
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', count_query)
+
+    client = app.test_client()
+    def timed(method, url, **kwargs):
+        counter[0] = 0
+        started = time.perf_counter()
+        res = getattr(client, method)(url, **kwargs)
+        elapsed = time.perf_counter() - started
+        if res.status_code >= 400:
+            raise RuntimeError(f'{method.upper()} {url}: {res.status_code}')
+        return elapsed, counter[0]
+
+    results = {}
+    for route, urls in targets.items():
+        for url in urls: timed('get', url)  # 1回目 (順位表などの準備) は計測しない
+        latencies, queries = [], []
+        for _ in range(repeat):
+            for url in urls:
+                elapsed, n = timed('get', url)
+                latencies.append(elapsed)
+                queries.append(n)
+        results[route] = _summary(latencies, queries)
+
+    latencies, queries = [], []
+    for path in upload_csvs:
+        with open(path, 'rb') as f:
+            elapsed, n = timed('post', '/upload', data={'file': (f, os.path.basename(path))},
+                               content_type='multipart/form-data')
+        latencies.append(elapsed)
+        queries.append(n)
+    results['/upload'] = _summary(latencies, queries)
+    results['/upload']['rows'] = upload_rows
+    results['/upload']['rows_per_sec'] = round(upload_rows * len(latencies) / sum(latencies), 1)
+
+    return {'scores': size, 'players': players, 'inserted': report['inserted'] if report else 0,
+            'load_seconds': round(load_seconds, 2), 'routes': results}
+
+
+def _commit():
+    try:
+        head = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+    return head + ('-dirty' if dirty else '') if head else None
+
+
+def run(sizes, repeat=20, samples=5, upload_rows=1000, seed=0, cache=False):
+    """規模ごとに子プロセスで measure_size() を実行し、結果をまとめて返す"""
+    out = {
+        'meta': {
+            'commit': _commit(), 'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version, 'platform': platform.platform(),
+            'repeat': repeat, 'samples': samples, 'upload_rows': upload_rows, 'seed': seed, 'cache': cache,
+            'columnar_snapshot': os.environ.get('COLUMNAR_SNAPSHOT') == '1',
+        },
+        'sizes': {},
+    }
+    for size in sizes:
+        with tempfile.TemporaryDirectory(prefix='bench-') as tmp:
+            result_file = os.path.join(tmp, 'result.json')
+            env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'))
+            cmd = [sys.executable, '-m', 'benchmark.harness', '--single', str(size), '--result-file', result_file,
+                   '--repeat', str(repeat), '--samples', str(samples), '--upload-rows', str(upload_rows), '--seed', str(seed)]
+            if cache: cmd.append('--cache')
+            print(f'{size}件: 計測中...', file=sys.stderr)
+            subprocess.run(cmd, cwd=ROOT, env=env, check=True)
+            with open(result_file, encoding='utf-8') as f:
+                out['sizes'][str(size)] = json.load(f)
+    return out
+
+
+def print_results(results):
+    for size, data in results['sizes'].items():
+        print(f"== {int(size):,}件 (選手 {data['players']:,}名, 取り込み {data['load_seconds']}秒)")
+        print(f"  {'ルート':<23}{'p50':>9}{'p95':>9}{'p99':>9}{'最大':>7}  クエリ数")
+        for route, r in data['routes'].items():
+            print(f"  {route:<26}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['max_ms']:>9.1f}  "
+                  f"{r['queries_mean']:g} (最大 {r['queries_max']})")
+
+
+def compare(before, after, threshold=0.2):
+    """2つの結果を比べて表示する。p50 が threshold 以上遅くなったか、クエリ数が増えたルートの数を返す"""
+    regressions = 0
+    print(f"比較: {before['meta'].get('commit')} → {after['meta'].get('commit')}")
+    for size, new in after['sizes'].items():
+        old = before['sizes'].get(size)
+        if not old: continue
+        print(f'== {int(size):,}件')
+        for route, r in new['routes'].items():
+            o = old['routes'].get(route)
+            if not o: continue
+            ratio = r['p50_ms'] / o['p50_ms'] if o['p50_ms'] else 1.0
+            worse = ratio > 1 + threshold or r['queries_max'] > o['queries_max']
+            regressions += worse
+            print(f"  {'!!' if worse else '  '} {route:<26}p50 {o['p50_ms']:8.1f} → {r['p50_ms']:8.1f}ms ({ratio:5.2f}倍)  "
+                  f"クエリ {o['queries_max']} → {r['queries_max']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='合成データで各ルートの応答時間とSQL発行数を測る')
+    parser.add_argument('--sizes', type=int, nargs='*', default=DEFAULT_SIZES, help='成績の件数 (複数指定可)')
+    parser.add_argument('--repeat', type=int, default=20, help='URLごとの計測回数 (アップロードは回数)')
+    parser.add_argument('--samples', type=int, default=5, help='計測する選手・大会の数')
+    parser.add_argument('--upload-rows', type=int, default=1000, help='1回のアップロードの行数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cache', action='store_true', help='ページキャッシュを有効にして測る (既定は無効)')
+    parser.add_argument('--out', help='結果を保存するJSON')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='2つの結果JSONを比較する')
+    parser.add_argument('--threshold', type=float, default=0.2, help='--compare で遅くなったとみなす割合')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], encoding='utf-8') as f: before = json.load(f)
+        with open(args.compare[1], encoding='utf-8') as f: after = json.load(f)
+        sys.exit(1 if compare(before, after, args.threshold) else 0)
+
+    if args.single:  # 子プロセス
+        result = measure_size(args.single, args.repeat, args.samples, args.upload_rows, args.seed, args.cache)
+        with open(args.result_file, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        return
+
+    results = run(args.sizes, args.repeat, args.samples, args.upload_rows, args.seed, args.cache)
+    print_results(results)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f'保存しました: {args.out}')
+
+
+if __name__ == '__main__':
+    main()
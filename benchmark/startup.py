@@ -0,0 +1,120 @@
+# ---------------------------------------------------------
+# 起動時間の計測 (import にかかる時間と、最初のリクエストが返るまでの時間)
+# ---------------------------------------------------------
+# 一時ディレクトリのDBに合成データを入れ (flask init-db と同じ準備)、毎回新しいプロセスで
+# main を import してテストクライアントで最初の GET を投げる。プロセスの起動から最初の応答までを
+# 親プロセスで、import と各リクエストの時間を子プロセスの中で測る。
+# テンプレートのコンパイル結果 (JINJA_CACHE_DIR) は1回目だけ空にして、以降は保存済みのものを使う。
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark.generate import generate_rows, write_csv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_PATHS = ['/', '/ranking']
+
+
+def prepare(rows, seed=0):
+    """子プロセス: DBを準備して合成データを取り込む (DATABASE_URL は呼び出し側で設定済みのこと)"""
+    sys.path.insert(0, ROOT)
+    import main
+    main.app.config.update(IMPORT_ASYNC=False)
+    with main.app.app_context():
+        main.init_db()
+        csv_path = os.path.join(os.path.dirname(main.db.engine.url.database), 'startup.csv')
+        write_csv(csv_path, (row for _, row in zip(range(rows), generate_rows(rows, seed=seed))))
+        main.run_import(csv_path)
+
+
+def measure(paths):
+    """子プロセス: import と、paths を順に1回ずつ GET する時間 (ミリ秒)"""
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import main
+    out = {'import_ms': (time.perf_counter() - started) * 1000,
+           'heavy_loaded': sorted(m for m in ('pandas', 'numpy') if m in sys.modules)}
+    client = main.app.test_client()
+    out['requests'] = []
+    for path in paths:
+        t = time.perf_counter()
+        res = client.get(path)
+        if res.status_code >= 400:
+            raise RuntimeError(f'GET {path}: {res.status_code}')
+        out['requests'].append({'path': path, 'ms': (time.perf_counter() - t) * 1000})
+    return out
+
+
+def run(rows=10000, repeat=5, paths=None, seed=0):
+    """準備したDBに対して repeat 回 (1回目はテンプレートのキャッシュなし) 子プロセスで計測する"""
+    paths = paths or DEFAULT_PATHS
+    results = []
+    with tempfile.TemporaryDirectory(prefix='startup-') as tmp:
+        jinja_dir = os.path.join(tmp, 'jinja')
+        env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'), JINJA_CACHE_DIR=jinja_dir)
+        print(f'{rows}件のデータを準備中...', file=sys.stderr)
+        subprocess.run([sys.executable, '-m', 'benchmark.startup', '--prepare', str(rows), '--seed', str(seed)],
+                       cwd=ROOT, env=env, check=True)
+        for i in range(repeat):
+            if i == 0: shutil.rmtree(jinja_dir, ignore_errors=True)
+            cmd = [sys.executable, '-m', 'benchmark.startup', '--single', '--paths', *paths]
+            started = time.perf_counter()
+            proc = subprocess.run(cmd, cwd=ROOT, env=env, check=True, capture_output=True, text=True)
+            wall_ms = (time.perf_counter() - started) * 1000
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            result['process_ms'] = wall_ms  # プロセス起動から最後の応答まで (終了処理を含む)
+            result['jinja_cache'] = i > 0
+            results.append(result)
+    return {'rows': rows, 'paths': paths, 'runs': results}
+
+
+def print_results(out):
+    runs = out['runs']
+    def row(label, values):
+        print(f"  {label:<28}{min(values):>9.1f}{statistics.median(values):>9.1f}{max(values):>9.1f}")
+    print(f"== 起動時間 ({out['rows']:,}件, {len(runs)}回。1回目はテンプレートのキャッシュなし)")
+    print(f"  {'':<28}{'最小':>7}{'中央値':>7}{'最大':>8}  (ミリ秒)")
+    row('import main', [r['import_ms'] for r in runs])
+    for i, path in enumerate(out['paths']):
+        row(f'GET {path} (#{i + 1})', [r['requests'][i]['ms'] for r in runs])
+    row('プロセス全体', [r['process_ms'] for r in runs])
+    print(f"  1回目 (キャッシュなし) の最初の応答: {runs[0]['requests'][0]['ms']:.1f}ms")
+    loaded = sorted({m for r in runs for m in r['heavy_loaded']})
+    if loaded:
+        print(f"  注意: import の時点で {', '.join(loaded)} が読み込まれています")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='main の import と最初の応答までの時間を測る')
+    parser.add_argument('--rows', type=int, default=10000, help='取り込んでおく成績の件数')
+    parser.add_argument('--repeat', type=int, default=5, help='プロセスを起動する回数')
+    parser.add_argument('--paths', nargs='*', default=DEFAULT_PATHS, help='起動直後に順に GET するパス')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='結果を保存するJSON')
+    parser.add_argument('--prepare', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.prepare is not None:  # 子プロセス: 準備
+        prepare(args.prepare, args.seed)
+        return
+    if args.single:  # 子プロセス: 計測
+        print(json.dumps(measure(args.paths)))
+        return
+
+    out = run(args.rows, args.repeat, args.paths, args.seed)
+    print_results(out)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(out, f, ensure_ascii=False, indent=2)
+        print(f'保存しました: {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+# ---------------------------------------------------------
+# Score テーブルの列指向スナップショット (NumPy)
+# ---------------------------------------------------------
+# グラフ用の集計を ORM を通さずに配列演算で行うためのもの。
+# DBとのやり取り (差分の読み込み) は main.py の get_score_snapshot() が行い、
+# ここでは配列の保持・保存・集計だけを扱う。
+import json
+import os
+import shutil
+
+import numpy as np
+
+# 列名と型 (文字列の列は整数コードにして持つ)
+COLUMNS = {
+    'id': np.int64,
+    'player_id': np.int32,
+    'event': np.int16,      # 種目コード
+    'gender': np.int8,      # 性別コード
+    'match': np.int32,      # 大会名コード
+    'category': np.int16,   # 識別コード (Regular など)
+    'date': np.int32,       # 日付の序数 (date.toordinal())
+    's1': np.float64, 's2': np.float64, 's3': np.float64,
+    's4': np.float64, 's5': np.float64, 's6': np.float64,
+    'total': np.float64,
+}
+CODED = ['event', 'gender', 'match', 'category']
+
+# date.toordinal() と numpy の datetime64 (1970-01-01 起点) の差
+_EPOCH_ORDINAL = 719163
+
+
+class ScoreSnapshot:
+    """Score の各列を NumPy 配列で保持する。行は id の昇順に並べる。
+    version は取り込み済みのデータバージョン (-1 は未読み込み)。"""
+
+    def __init__(self):
+        self.cols = {name: np.empty(0, dtype=dt) for name, dt in COLUMNS.items()}
+        self.codes = {kind: [] for kind in CODED}
+        self._lookup = {kind: {} for kind in CODED}
+        self.version = -1
+
+    def __len__(self):
+        return len(self.cols['id'])
+
+    # --- コード変換 ---
+    def code(self, kind, value):
+        """文字列のコードを返す。未登録なら -1"""
+        return self._lookup[kind].get(value, -1)
+
+    def encode(self, kind, values):
+        """文字列の列をコードの配列にする (未登録の値は追加する)"""
+        lookup, codes = self._lookup[kind], self.codes[kind]
+        out = np.empty(len(values), dtype=COLUMNS[kind])
+        for i, v in enumerate(values):
+            c = lookup.get(v)
+            if c is None:
+                c = lookup[v] = len(codes)
+                codes.append(v)
+            out[i] = c
+        return out
+
+    def decode(self, kind, codes):
+        table = self.codes[kind]
+        return [table[c] for c in codes]
+
+    # --- 更新 ---
+    def upsert(self, rows):
+        """rows: {列名: 配列} (文字列の列は元の値のまま)。同じ id の行は置き換える。"""
+        if len(rows['id']) == 0: return
+        new = {}
+        for name, dt in COLUMNS.items():
+            values = rows[name]
+            new[name] = self.encode(name, values) if name in CODED else np.asarray(values, dtype=dt)
+
+        ids = self.cols['id']
+        pos = np.searchsorted(ids, new['id'])
+        exists = (pos < len(ids)) & (ids[np.minimum(pos, len(ids) - 1)] == new['id']) if len(ids) else np.zeros(len(pos), dtype=bool)
+
+        cols = {name: np.array(arr) for name, arr in self.cols.items()}  # mmap からの読み込み時は書き込めないのでコピー
+        for name in COLUMNS:
+            cols[name][pos[exists]] = new[name][exists]
+        if (~exists).any():
+            for name in COLUMNS:
+                cols[name] = np.concatenate([cols[name], new[name][~exists]])
+            order = np.argsort(cols['id'], kind='stable')
+            cols = {name: arr[order] for name, arr in cols.items()}
+        self.cols = cols
+
+    def retain(self, ids):
+        """ids に含まれる行だけを残す (削除された行を落とす)"""
+        keep = np.isin(self.cols['id'], np.asarray(ids, dtype=np.int64))
+        if not keep.all():
+            self.cols = {name: arr[keep] for name, arr in self.cols.items()}
+
+    def sync_player_genders(self, genders):
+        """gender 列を選手の性別 {player_id: 性別} に合わせる (性別の変更は Score の row_version に現れないため)。
+        付け直した行数を返す"""
+        if not len(self) or not genders: return 0
+        pids = np.fromiter(genders, dtype=np.int64, count=len(genders))
+        codes = self.encode('gender', list(genders.values()))
+        order = np.argsort(pids)
+        pids, codes = pids[order], codes[order]
+        row_pids = self.cols['player_id']
+        pos = np.minimum(np.searchsorted(pids, row_pids), len(pids) - 1)
+        want = np.where(pids[pos] == row_pids, codes[pos], self.cols['gender']).astype(COLUMNS['gender'])
+        changed = int((want != self.cols['gender']).sum())
+        if changed: self.cols = dict(self.cols, gender=want)
+        return changed
+
+    # --- 保存・読み込み (メモリマップ) ---
+    def save(self, base_dir):
+        """base_dir/v<バージョン>/ に保存する。同じバージョンが既にあれば何もしない。"""
+        target = os.path.join(base_dir, f'v{self.version}')
+        if os.path.exists(target): return
+        os.makedirs(base_dir, exist_ok=True)
+        tmp = os.path.join(base_dir, f'.tmp-{os.getpid()}-v{self.version}')
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name, arr in self.cols.items():
+            np.save(os.path.join(tmp, name + '.npy'), arr)
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version': self.version, 'rows': len(self), 'codes': self.codes}, f, ensure_ascii=False)
+        try:
+            os.rename(tmp, target)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)  # 他のワーカーが先に保存した
+        # 古いバージョンは最新2つだけ残す
+        for old in sorted(_saved_versions(base_dir))[:-2]:
+            shutil.rmtree(os.path.join(base_dir, f'v{old}'), ignore_errors=True)
+
+    @classmethod
+    def load(cls, base_dir):
+        """最新の保存済みスナップショットをメモリマップで開く。なければ None"""
+        versions = sorted(_saved_versions(base_dir))
+        if not versions: return None
+        path = os.path.join(base_dir, f'v{versions[-1]}')
+        try:
+            with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            snap = cls()
+            snap.cols = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in COLUMNS}
+        except (OSError, ValueError):
+            return None
+        if any(len(arr) != meta['rows'] for arr in snap.cols.values()): return None
+        snap.codes = meta['codes']
+        snap._lookup = {kind: {v: i for i, v in enumerate(vals)} for kind, vals in snap.codes.items()}
+        snap.version = meta['version']
+        return snap
+
+    # --- 集計 ---
+    def mask(self, event=None, gender=None, player_id=None, match=None, category=None, date_from=None, date_to=None):
+        """条件に合う行の真偽値配列。文字列の条件はリストも可 (いずれかに一致)"""
+        m = np.ones(len(self), dtype=bool)
+        for kind, value in (('event', event), ('gender', gender), ('match', match), ('category', category)):
+            if value is None: continue
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            m &= np.isin(self.cols[kind], [self.code(kind, v) for v in values])
+        if player_id is not None: m &= self.cols['player_id'] == player_id
+        if date_from is not None: m &= self.cols['date'] >= date_from.toordinal()
+        if date_to is not None: m &= self.cols['date'] <= date_to.toordinal()
+        return m
+
+    def months(self):
+        """各行の年月 (1970年1月からの月数)"""
+        return (self.cols['date'].astype(np.int64) - _EPOCH_ORDINAL).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+    def academic_years(self):
+        """各行の年度 (4月始まり)"""
+        m = self.months()
+        return (m - 3) // 12 + 1970
+
+    def group_by(self, keys, value='total', mask=None):
+        """keys (列名または配列のリスト) ごとに value を集計する。
+        戻り値: {'keys': [キー配列, ...], 'count', 'sum', 'mean', 'max', 'min'}"""
+        key_arrays = [self.cols[k] if isinstance(k, str) else k for k in keys]
+        vals = self.cols[value] if isinstance(value, str) else value
+        if mask is not None:
+            key_arrays = [k[mask] for k in key_arrays]
+            vals = vals[mask]
+        if len(vals) == 0:
+            empty = np.empty(0)
+            return {'keys': [np.empty(0, dtype=k.dtype) for k in key_arrays], 'count': empty, 'sum': empty,
+                    'mean': empty, 'max': empty, 'min': empty}
+        # 各キーを 0..n-1 に詰めてから1つの整数キーにまとめ、ソートして区間ごとに集計する
+        combined = np.zeros(len(vals), dtype=np.int64)
+        uniques = []
+        for k in key_arrays:
+            u, inv = np.unique(k, return_inverse=True)
+            uniques.append(u)
+            combined = combined * len(u) + inv.ravel()
+        order = np.argsort(combined, kind='stable')
+        combined, vals = combined[order], vals[order]
+        starts = np.flatnonzero(np.r_[True, combined[1:] != combined[:-1]])
+        count = np.diff(np.r_[starts, len(vals)])
+        total = np.add.reduceat(vals, starts)
+
+        # まとめたキーを元のキーに戻す
+        keys_out, rest = [], combined[starts]
+        for u in reversed(uniques):
+            keys_out.append(u[rest % len(u)])
+            rest = rest // len(u)
+        return {'keys': keys_out[::-1], 'count': count, 'sum': total, 'mean': total / count,
+                'max': np.maximum.reduceat(vals, starts), 'min': np.minimum.reduceat(vals, starts)}
+
+def _saved_versions(base_dir):
+    if not os.path.isdir(base_dir): return []
+    out = []
+    for name in os.listdir(base_dir):
+        if name.startswith('v') and name[1:].isdigit() and os.path.exists(os.path.join(base_dir, name, 'meta.json')):
+            out.append(int(name[1:]))
+    return out
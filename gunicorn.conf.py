@@ -0,0 +1,16 @@
+# ---------------------------------------------------------
+# gunicorn の設定 (gunicorn main:app で自動的に読み込まれる)
+# ---------------------------------------------------------
+# DBの準備はデプロイ時に flask --app main init-db で済ませておく。
+# --preload のときはフォークの前にマスターで main.warm() を呼び、pandas / numpy の import と
+# テンプレートのコンパイルを1回だけ行う (ワーカーは読み込み済みのものを共有して起動する)。
+import os
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+preload_app = True
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        import main
+        main.warm()
@@ -0,0 +1,99 @@
+# ---------------------------------------------------------
+# 団体メンバー (Regular) の選考 (NumPy)
+# ---------------------------------------------------------
+# 選手ごとの直近の調子を、成績の合計点に新しいものほど重い重み (半減期 half_life 日の指数減衰) を付けた
+# 平均と分散で表し、団体の合計点の期待値や目標点を超える確率が最も高い組み合わせを選ぶ。
+# 団体の合計点は各選手の点数が独立な正規分布に従うとみなす。
+# DBからの読み込みと選手の絞り込み (在籍・性別) は main.py が行い、ここでは配列の計算だけを扱う。
+import math
+from itertools import chain, combinations
+
+import numpy as np
+
+PRIOR_WEIGHT = 2.0  # 記録の少ない選手の分散を種目全体の分散に寄せる強さ (成績何件分か)
+
+
+class FormTable:
+    """種目ごとの選手の調子。配列はどれも選手の並び (player_ids の昇順)。
+    mean: 重み付き平均 / std: 次の1回の点数の標準偏差 (平均の不確かさを含む) /
+    n_eff: 重みを考えた実質の件数 / count: 件数 / last: 最後の成績の日付の序数"""
+
+    def __init__(self, player_ids, mean, std, n_eff, count, last):
+        self.player_ids, self.mean, self.std = player_ids, mean, std
+        self.n_eff, self.count, self.last = n_eff, count, last
+
+    def __len__(self):
+        return len(self.player_ids)
+
+    def take(self, player_ids):
+        """player_ids のうち記録がある選手だけの (位置の配列, 選手idの配列)"""
+        player_ids = np.asarray(player_ids, dtype=np.int64)
+        pos = np.searchsorted(self.player_ids, player_ids)
+        pos = np.minimum(pos, max(len(self) - 1, 0))
+        found = (self.player_ids[pos] == player_ids) if len(self) else np.zeros(len(player_ids), dtype=bool)
+        return pos[found], player_ids[found]
+
+
+def compute_form(player_ids, dates, totals, half_life):
+    """成績 (選手id, 日付の序数, 合計点) の配列から FormTable を作る (選手ごとの集計は bincount で1回ずつ)"""
+    player_ids = np.asarray(player_ids, dtype=np.int64)
+    if len(player_ids) == 0:
+        empty = np.empty(0)
+        return FormTable(np.empty(0, dtype=np.int64), empty, empty, empty, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+    dates = np.asarray(dates, dtype=np.int64)
+    x = np.asarray(totals, dtype=float)
+    ids, inv = np.unique(player_ids, return_inverse=True)
+    # 重みは最新の成績を 1 とする (基準日をずらしても平均と分散は変わらない)
+    w = 0.5 ** ((dates.max() - dates) / half_life)
+    sw = np.bincount(inv, w)
+    mean = np.bincount(inv, w * x) / sw
+    var = np.maximum(np.bincount(inv, w * x * x) / sw - mean * mean, 0.0)
+    n_eff = sw * sw / np.bincount(inv, w * w)
+    # 1件しかない選手の分散は 0 になるので、種目全体の分散を事前分布として混ぜる
+    pooled = float(np.average(var, weights=n_eff)) if n_eff.sum() else 0.0
+    var = (n_eff * var + PRIOR_WEIGHT * pooled) / (n_eff + PRIOR_WEIGHT)
+    std = np.sqrt(var * (1.0 + 1.0 / n_eff))
+    last = np.zeros(len(ids), dtype=np.int64)
+    np.maximum.at(last, inv, dates)
+    return FormTable(ids, mean, std, n_eff, np.bincount(inv, minlength=len(ids)), last)
+
+
+def _norm_sf(z):
+    """標準正規分布の上側確率 P(Z > z)"""
+    return 0.5 * np.frompyfunc(math.erfc, 1, 1)(np.asarray(z, dtype=float) / math.sqrt(2)).astype(float)
+
+
+def select_team(mean, std, size, target=None, objective='expected', alternatives=5, max_combinations=20000):
+    """mean / std (候補の選手ごと) から size 人の組み合わせを選ぶ。
+    objective: 'expected' (合計の期待値が最大) / 'goal' (target を超える確率が最大。target が必要)。
+    候補が多いときは期待値と上振れ (平均 + 2σ) の上位から組み合わせが max_combinations 以下になる人数に絞る。
+    戻り値: 良い順の組み合わせのリスト [{'members': [候補の位置, ...], 'expected', 'std', 'probability'}, ...]
+    (先頭が最適、残りが次点の候補)"""
+    mean, std = np.asarray(mean, dtype=float), np.asarray(std, dtype=float)
+    n = len(mean)
+    if size <= 0 or n < size: return []
+    if objective == 'goal' and target is None: raise ValueError('目標点がありません')
+
+    pool = np.arange(n)
+    m = n
+    while m > size and math.comb(m, size) > max_combinations: m -= 1
+    if m < n:
+        by_mean = np.argsort(-mean, kind='stable')
+        by_upside = np.argsort(-(mean + 2 * std), kind='stable')
+        picked = []
+        for i in np.ravel(np.column_stack([by_mean, by_upside])):
+            if i not in picked: picked.append(i)
+            if len(picked) == m: break
+        pool = np.sort(np.array(picked))
+
+    flat = np.fromiter(chain.from_iterable(combinations(range(len(pool)), size)), dtype=np.int64,
+                       count=math.comb(len(pool), size) * size)
+    combos = pool[flat.reshape(-1, size)]
+    expected = mean[combos].sum(axis=1)
+    team_std = np.sqrt((std[combos] ** 2).sum(axis=1))
+    probability = _norm_sf((target - expected) / np.maximum(team_std, 1e-9)) if target is not None else None
+    key = probability if objective == 'goal' else expected
+    # 同点は期待値 → 候補の並び順で決める
+    order = np.lexsort((np.arange(len(combos)), -expected, -key))[:alternatives + 1]
+    return [{'members': combos[i].tolist(), 'expected': float(expected[i]), 'std': float(team_std[i]),
+             'probability': float(probability[i]) if probability is not None else None} for i in order]
@@ -0,0 +1,126 @@
+# ---------------------------------------------------------
+# 負荷テスト: CSV取り込み中も読み込みが遅くならないかを確認する
+# ---------------------------------------------------------
+# 起動中のサーバー (gunicorn など) に対して実行する。標準ライブラリだけで動く。
+#
+#   flask --app main init-db
+#   gunicorn main:app          (gunicorn.conf.py: 4ワーカー・--preload・フォーク前に main.warm())
+#   python loadtest.py --url http://127.0.0.1:8000 --csv scores.csv
+#
+# 1. 取り込みなしで --seconds 秒間、GETを並列に投げて基準のスループットを測る
+# 2. /upload に CSV を送り、取り込みジョブが終わるまで同じようにGETを投げる
+# 両方の 秒あたりリクエスト数 / 応答時間 (p50, p95, 最大) / エラー数 を表示する。
+# ページのキャッシュが効くと DB を通らないので、DBの読み込みを測りたいときは
+# サーバー側で CACHE_ENABLED = False にするか、--paths に選手ページを多めに入れること。
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+DEFAULT_PATHS = ['/', '/ranking', '/matches', '/player/{n}', '/player/{n}', '/api/charts/player/{n}']
+
+
+def _percentile(values, p):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def read_load(base_url, paths, threads, stop, max_player_id):
+    """stop がセットされるまで GET を投げ続け、(応答時間のリスト, エラー数, 経過秒) を返す"""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    counter = itertools.count()
+
+    def worker():
+        while not stop.is_set():
+            n = next(counter)
+            path = paths[n % len(paths)].format(n=n % max_player_id + 1)
+            t0 = time.perf_counter()
+            try:
+                with urllib.request.urlopen(base_url + path, timeout=60) as res:
+                    res.read()
+                ok = True
+            except urllib.error.HTTPError as e:
+                ok = e.code == 404  # 存在しない選手IDは数えない
+            except OSError:
+                ok = False
+            elapsed = time.perf_counter() - t0
+            with lock:
+                if ok: latencies.append(elapsed)
+                else: errors[0] += 1
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(threads)]
+    for w in workers: w.start()
+    for w in workers: w.join()
+    return latencies, errors[0], time.perf_counter() - started
+
+
+def upload_csv(base_url, csv_path):
+    """CSVを multipart/form-data で送り、取り込みジョブの状態URLを返す"""
+    boundary = uuid.uuid4().hex
+    with open(csv_path, 'rb') as f:
+        content = f.read()
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{os.path.basename(csv_path)}"\r\n'
+            f'Content-Type: text/csv\r\n\r\n').encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+    req = urllib.request.Request(base_url + '/upload', data=body, method='POST', headers={
+        'Content-Type': f'multipart/form-data; boundary={boundary}', 'Accept': 'application/json'})
+    with urllib.request.urlopen(req, timeout=60) as res:
+        return json.load(res)['status_url']
+
+
+def wait_for_job(base_url, status_url, stop, interval=0.5):
+    status = None
+    while True:
+        with urllib.request.urlopen(base_url + status_url, timeout=60) as res:
+            status = json.load(res)
+        if status['status'] in ('done', 'failed'): break
+        time.sleep(interval)
+    stop.set()
+    return status
+
+
+def summarize(label, latencies, errors, seconds):
+    ms = [v * 1000 for v in latencies]
+    print(f'{label}: {len(ms) / seconds:7.1f} req/s  p50 {_percentile(ms, 50):7.1f}ms  '
+          f'p95 {_percentile(ms, 95):7.1f}ms  最大 {max(ms, default=0):7.1f}ms  エラー {errors}件  ({len(ms)}件 / {seconds:.1f}秒)')
+    return len(ms) / seconds if seconds else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CSV取り込み中の読み込みスループットを測る')
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--csv', required=True, help='取り込みに使うCSV (実際にDBへ登録されるので検証用のDBで実行すること)')
+    parser.add_argument('--seconds', type=float, default=10.0, help='基準の計測時間')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--paths', nargs='*', default=DEFAULT_PATHS, help='{n} は選手IDに置き換える')
+    parser.add_argument('--max-player-id', type=int, default=50)
+    args = parser.parse_args()
+    base_url = args.url.rstrip('/')
+
+    stop = threading.Event()
+    timer = threading.Timer(args.seconds, stop.set)
+    timer.start()
+    baseline = summarize('取り込みなし', *read_load(base_url, args.paths, args.threads, stop, args.max_player_id))
+
+    stop = threading.Event()
+    status_url = upload_csv(base_url, args.csv)
+    result = {}
+    waiter = threading.Thread(target=lambda: result.update(wait_for_job(base_url, status_url, stop)))
+    waiter.start()
+    during = summarize('取り込み中  ', *read_load(base_url, args.paths, args.threads, stop, args.max_player_id))
+    waiter.join()
+
+    print(f"取り込み: {result.get('status')} / {result.get('message')}")
+    if baseline:
+        print(f'取り込み中のスループット: 基準の {during / baseline * 100:.0f}%')
+
+
+if __name__ == '__main__':
+    main()
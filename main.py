@@ -1,141 +1,2796 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, Response, g, has_request_context, stream_with_context
+from flask.signals import before_render_template, template_rendered
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func
-from datetime import datetime
-import pandas as pd
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import bindparam, create_engine, event, func, insert, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex, CreateTable
+from datetime import date, datetime
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from types import SimpleNamespace
+import click
+import codecs
+import csv
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
 import os
+import shutil
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+import uuid
 
 app = Flask(__name__)
 app.secret_key = 'secret_key'
 
 # データベース設定
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///shooting.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///shooting.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'uploads'
+app.config['IMPORT_CHUNK_SIZE'] = 5000  # CSVを一度に読み込む最大行数
+app.config['PLAYER_PAGE_SIZE'] = 50     # トップページの選手一覧の1ページあたりの人数
+app.config['SCORE_PAGE_SIZE'] = 50      # 選手ページのスコア履歴の1ページあたりの件数
+app.config['CHART_POINT_BUDGET'] = 120  # 選手ページのグラフ1本あたりの最大点数 (超えたら期間ごとにまとめる)
+# 団体メンバーの選考 (/match/<大会名>/lineup)
+app.config['LINEUP_HALF_LIFE_DAYS'] = 180  # 直近の調子の重みが半分になる日数
+app.config['LINEUP_SIZE'] = 3              # 団体メンバーの人数の既定値
+app.config['LINEUP_ALTERNATIVES'] = 5      # 最適な組み合わせのほかに示す次点の数
+app.config['IMPORT_ASYNC'] = True       # CSVの取り込みをバックグラウンドで行う
+app.config['IMPORT_WORKERS'] = 2        # 取り込み用スレッド数 (DBへの書き込みは1件ずつ)
+# 集計結果キャッシュ (CACHE_REDIS_URL を設定するとワーカー間で共有する)
+app.config['CACHE_ENABLED'] = True
+app.config['CACHE_MAX_ENTRIES'] = 256
+app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL')
+app.config['CACHE_TTL'] = 24 * 60 * 60  # 共有キャッシュの保持秒数
+# グラフ集計を NumPy の列スナップショットで行う (instance/snapshot に保存して再起動時も使う)
+app.config['COLUMNAR_SNAPSHOT'] = os.environ.get('COLUMNAR_SNAPSHOT') == '1'
+# SQLite の同時実行設定 (gunicorn の複数ワーカーから同じDBを使うため)
+app.config['SQLITE_WAL'] = True              # WALモード: 書き込み中も読み込みを止めない
+app.config['SQLITE_BUSY_TIMEOUT'] = 10000    # ロック待ちの最大ミリ秒
+app.config['SQLITE_READONLY_SESSIONS'] = True  # GET/HEAD は読み込み専用の接続を使う
+app.config['EXPORT_BATCH_SIZE'] = 5000  # エクスポートで一度に読み込む行数
+# バックアップ (BACKUP_DIR が None なら instance/backups)
+app.config['BACKUP_DIR'] = os.environ.get('BACKUP_DIR')
+app.config['BACKUP_KEEP'] = 10  # 残すスナップショット (差分) の数
+# 締めた年度のアーカイブ (年度ごとの読み込み専用DBファイル。ARCHIVE_DIR が None なら instance/archive)
+app.config['ARCHIVE_DIR'] = os.environ.get('ARCHIVE_DIR')
+# 静的ファイル (/assets/ のハッシュ付きURL) をブラウザにキャッシュさせる秒数
+app.config['ASSET_MAX_AGE'] = 365 * 24 * 60 * 60
+# テンプレートのコンパイル結果の保存先 (再起動後の初回描画を速くする。None なら instance/jinja_cache)
+app.config['JINJA_CACHE_DIR'] = os.environ.get('JINJA_CACHE_DIR')
+# 計測 (既定はすべて無効。PROFILING=1 / METRICS=1 の環境変数でも有効にできる)
+app.config['PROFILING'] = os.environ.get('PROFILING') == '1'  # リクエストごとの DB / ビュー / テンプレートの時間 (Server-Timing ヘッダとログ)
+app.config['PROFILE_LOG_MS'] = 500      # これより遅いリクエストは内訳をログに出す
+app.config['SLOW_QUERY_MS'] = 100       # これより遅いSQLはパラメータ付きでログに出す
+app.config['PROFILE_ENDPOINTS'] = []    # サンプリングプロファイラをかけるエンドポイント名 (例: ['player_detail'])
+app.config['PROFILE_INTERVAL'] = 0.005  # サンプリング間隔 (秒)。結果は instance/profiles/ に保存
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS') == '1'  # /metrics (Prometheus形式)
+if app.config['SQLITE_READONLY_SESSIONS']:
+    app.config['SQLALCHEMY_BINDS'] = {'readonly': app.config['SQLALCHEMY_DATABASE_URI']}
 
-db = SQLAlchemy(app)
+# ---------------------------------------------------------
+# データベース接続 (読み込み専用 / 書き込み用のセッション)
+# ---------------------------------------------------------
+class RoutingSession(FlaskSQLAlchemySession):
+    """GET/HEAD のリクエスト中は読み込み専用の接続を使う
+    (stream_with_context でレスポンスを返す途中のセッションも含む)"""
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and 'readonly' in self._db.engines and has_request_context() and request.method in ('GET', 'HEAD'):
+            return self._db.engines['readonly']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+class _JinjaBytecodeCache(FileSystemBytecodeCache):
+    """テンプレートのコンパイル結果のファイル。ディレクトリは最初に保存するときに作る (import 時には作らない)"""
+    def dump_bytecode(self, bucket):
+        os.makedirs(self.directory, exist_ok=True)
+        super().dump_bytecode(bucket)
+
+app.jinja_env.bytecode_cache = _JinjaBytecodeCache(app.config['JINJA_CACHE_DIR'] or os.path.join(app.instance_path, 'jinja_cache'))
+
+def _sqlite_connect_listener(readonly):
+    def on_connect(dbapi_conn, _record):
+        if not isinstance(dbapi_conn, sqlite3.Connection): return
+        dbapi_conn.isolation_level = None  # BEGIN は下の on_begin で自分で出す
+        cur = dbapi_conn.cursor()
+        cur.execute(f"PRAGMA busy_timeout = {int(app.config['SQLITE_BUSY_TIMEOUT'])}")
+        if app.config['SQLITE_WAL'] and not readonly:
+            cur.execute('PRAGMA journal_mode = WAL')
+        cur.execute('PRAGMA synchronous = NORMAL')   # WALならコミットごとのfsyncは不要
+        cur.execute('PRAGMA cache_size = -32000')    # 約32MB
+        cur.execute('PRAGMA temp_store = MEMORY')
+        cur.execute('PRAGMA mmap_size = 268435456')  # 256MB
+        if readonly:
+            cur.execute('PRAGMA query_only = ON')
+        cur.close()
+    return on_connect
+
+def _sqlite_begin_listener(readonly):
+    # 書き込み用は最初から書き込みロックを取る (読み込み→書き込みの途中で SQLITE_BUSY になるのを防ぐ)
+    statement = 'BEGIN' if readonly else 'BEGIN IMMEDIATE'
+    def on_begin(conn):
+        conn.exec_driver_sql(statement)
+    return on_begin
+
+with app.app_context():
+    for _key, _engine in db.engines.items():
+        if _engine.dialect.name != 'sqlite': continue
+        event.listen(_engine, 'connect', _sqlite_connect_listener(_key == 'readonly'))
+        event.listen(_engine, 'begin', _sqlite_begin_listener(_key == 'readonly'))
+
+# ---------------------------------------------------------
+# モデル定義
+# ---------------------------------------------------------
+class Player(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False, unique=True)
+    # 検索用: 全角・半角スペースを除いた名前
+    name_key = db.Column(db.String(50), index=True, default=lambda ctx: normalize_name(ctx.get_current_parameters()['name']))
+    gender = db.Column(db.String(10))
+    entry_year = db.Column(db.Integer)
+    scores = db.relationship('Score', backref='player', lazy=True, cascade="all, delete-orphan")
+
+class Score(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    player_id = db.Column(db.Integer, db.ForeignKey('player.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    match_name = db.Column(db.String(100))
+    category = db.Column(db.String(50))
+    event_name = db.Column(db.String(50))
+    s1 = db.Column(db.Float, default=0.0)
+    s2 = db.Column(db.Float, default=0.0)
+    s3 = db.Column(db.Float, default=0.0)
+    s4 = db.Column(db.Float, default=0.0)
+    s5 = db.Column(db.Float, default=0.0)
+    s6 = db.Column(db.Float, default=0.0)
+    total = db.Column(db.Float, default=0.0)
+    # 4月始まりの年度 (dateから自動で設定)
+    academic_year = db.Column(db.Integer, default=lambda ctx: academic_year(ctx.get_current_parameters()['date']))
+    # 最後に登録・更新したときのデータバージョン (列スナップショットの差分読み込み用)
+    row_version = db.Column(db.Integer, default=0)
+    # 重複判定用のキー (選手・日付・大会名・種目・識別から作る。score_content_key() を参照)
+    content_key = db.Column(db.String(40), default=lambda ctx: score_content_key(
+        *(ctx.get_current_parameters().get(c) for c in CONTENT_KEY_COLUMNS)))
+
+    __table_args__ = (
+        db.Index('ix_score_player_event_date', 'player_id', 'event_name', 'date'),
+        db.Index('ix_score_match_date', 'match_name', 'date'),
+        db.Index('ix_score_event_date', 'event_name', 'date'),
+        db.Index('ix_score_date', 'date'),
+        db.Index('ix_score_academic_year', 'academic_year'),
+        db.Index('ix_score_row_version', 'row_version'),
+        db.Index('ux_score_content_key', 'content_key', unique=True),
+    )
+
+# ★追加: 1射ごとの点数 (任意。成績1件につき1行。60射を shots.py の形式で詰めたBLOB)
+# あるときは Score の s1〜s6 と合計はここから計算した値になる
+class ScoreShots(db.Model):
+    score_id = db.Column(db.Integer, db.ForeignKey('score.id'), primary_key=True)
+    shots = db.Column(db.LargeBinary, nullable=False)
+
+# ★追加: チーム目標テーブル
+class TeamGoal(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    event_name = db.Column(db.String(50), nullable=False)
+    gender = db.Column(db.String(10), nullable=False)
+    target_score = db.Column(db.Float, default=0.0)
+    __table_args__ = (db.Index('ux_team_goal_event_gender', 'event_name', 'gender', unique=True),)
+
+# チーム目標の初期値 (起動時に未登録の分だけ作る)
+DEFAULT_TEAM_GOALS = {'AR60': 620.0, 'SB3x20': 570.0, 'P60': 560.0}
+
+# ★追加: 選手×種目×年度ごとの集計テーブル (Scoreから差分更新する)
+class PlayerEventStat(db.Model):
+    player_id = db.Column(db.Integer, db.ForeignKey('player.id'), primary_key=True)
+    event_name = db.Column(db.String(50), primary_key=True)
+    academic_year = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total_sum = db.Column(db.Float, nullable=False, default=0.0)
+    total_max = db.Column(db.Float)
+    total_sum_sq = db.Column(db.Float, nullable=False, default=0.0)
+
+# ★追加: CSV取り込みジョブ (ワーカーが再起動しても続きから実行できるようにDBに記録する)
+class ImportJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    filename = db.Column(db.String(255))
+    filepath = db.Column(db.String(500), nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='queued', index=True)  # queued / running / done / failed
+    worker_pid = db.Column(db.Integer)
+    worker_token = db.Column(db.String(100))  # 実行中のプロセス (worker_token() の値。PIDが再利用されても区別できる)
+    rows_processed = db.Column(db.Integer, default=0)
+    inserted = db.Column(db.Integer, default=0)
+    skipped = db.Column(db.Integer, default=0)
+    rejected = db.Column(db.Integer, default=0)
+    updated = db.Column(db.Integer, default=0)
+    unchanged = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Text)  # 不正な行 [(行番号, 理由), ...] のJSON
+    duplicates = db.Column(db.Text)  # 重複で取り込まなかった行 [(行番号, 残した行の番号, 点数が違うか), ...] のJSON
+    message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+# ★追加: データ更新のたびに増えるカウンタ (キャッシュの無効化に使う。1行だけ)
+class DataVersion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# ★追加: アーカイブ済みの年度 (成績はこの年度だけのDBファイルに移し、ここには一覧を残す)
+class SeasonArchive(db.Model):
+    academic_year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    filename = db.Column(db.String(255), nullable=False)  # ARCHIVE_DIR 内のファイル名
+    scores = db.Column(db.Integer, nullable=False, default=0)
+    first_score_id = db.Column(db.Integer)
+    last_score_id = db.Column(db.Integer)  # 新しく登録する成績の id はこれより後にする
+    events = db.Column(db.Text)            # 種目の一覧 (JSON)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+# ★追加: アーカイブ済みの年度の大会ごとの集計 (大会一覧・年度一覧・選手の絞り込みはファイルを開かずにここから作る)
+class SeasonMatchSummary(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    academic_year = db.Column(db.Integer, nullable=False)
+    match_name = db.Column(db.String(100))
+    first_score_id = db.Column(db.Integer)  # 大会一覧の並び (最初に登録された順) 用
+    start_date = db.Column(db.Date)
+    end_date = db.Column(db.Date)
+    entries = db.Column(db.Text)      # [[種目, [選手id, ...]], ...] (JSON)
+    regulars = db.Column(db.Text)     # [[団体の区分, [選手名, ...]], ...] (新しい記録から順。JSON)
+    team_totals = db.Column(db.Text)  # [[団体の区分, Regularの合計点], ...] (JSON)
+    __table_args__ = (db.Index('ix_season_match_summary_match', 'match_name', 'academic_year'),)
+
+# ---------------------------------------------------------
+# フィルター定義
+# ---------------------------------------------------------
+@app.template_filter('sort_events')
+def sort_events_filter(events):
+    order = ['AR60', 'SB3x20', 'P60', 'AP60', 'BP']
+    def get_rank(e):
+        if e in order: return order.index(e)
+        return 999
+    return sorted(events, key=lambda x: (get_rank(x), x))
+
+# ---------------------------------------------------------
+# 集計テーブル (PlayerEventStat) の更新
+# ---------------------------------------------------------
+def academic_year(d):
+    """4月始まりの年度を返す (2025/3/31 → 2024年度)"""
+    return d.year if d.month >= 4 else d.year - 1
+
+def normalize_name(name):
+    """検索用に全角・半角スペースを取り除く"""
+    return (name or '').replace(' ', '').replace('　', '')
+
+# 同じ成績かどうかを判定する列 (点数が違っても同じ成績の修正とみなす)
+CONTENT_KEY_COLUMNS = ('player_id', 'date', 'match_name', 'event_name', 'category')
+
+def _key_part(value):
+    """キー用に表記ゆれ (全角・半角、空白、大文字・小文字) をならす"""
+    return unicodedata.normalize('NFKC', str(value or '')).replace(' ', '').casefold()
+
+def score_content_key(player_id, date, match_name, event_name, category):
+    """成績1件を識別するキー。同じCSVを再アップロードしても同じ値になる"""
+    raw = '|'.join([str(player_id), date.isoformat() if date else '', _key_part(match_name), _key_part(event_name), _key_part(category)])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def _academic_year_sql(col):
+    """academic_year() のSQL版 (マイグレーションでの一括設定用)"""
+    return db.case(
+        (func.cast(func.strftime('%m', col), db.Integer) >= 4, func.cast(func.strftime('%Y', col), db.Integer)),
+        else_=func.cast(func.strftime('%Y', col), db.Integer) - 1
+    )
+
+def apply_stats_delta(records):
+    """新規登録されたスコアを集計テーブルに加算する (1文でまとめてUPSERT)。"""
+    groups = {}
+    for r in records:
+        key = (r['player_id'], r['event_name'] or '', r['academic_year'])
+        g = groups.setdefault(key, [0, 0.0, None, 0.0])
+        t = r['total'] or 0.0
+        g[0] += 1
+        g[1] += t
+        g[2] = t if g[2] is None else max(g[2], t)
+        g[3] += t * t
+    if not groups: return
+
+    stmt = sqlite_insert(PlayerEventStat)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['player_id', 'event_name', 'academic_year'],
+        set_={
+            'count': PlayerEventStat.count + stmt.excluded['count'],
+            'total_sum': PlayerEventStat.total_sum + stmt.excluded.total_sum,
+            'total_max': func.max(PlayerEventStat.total_max, stmt.excluded.total_max),
+            'total_sum_sq': PlayerEventStat.total_sum_sq + stmt.excluded.total_sum_sq,
+        }
+    )
+    db.session.execute(stmt, [
+        {'player_id': pid, 'event_name': e, 'academic_year': ay,
+         'count': c, 'total_sum': sm, 'total_max': mx, 'total_sum_sq': sq}
+        for (pid, e, ay), (c, sm, mx, sq) in groups.items()
+    ])
+
+def refresh_stats(keys):
+    """指定した (player_id, event_name, academic_year) の集計をScoreから再計算する。
+    最高点は差分では戻せないため、編集・削除時はこちらを使う。"""
+    for pid, event, ay in set(keys):
+        event = event or ''
+        PlayerEventStat.query.filter_by(player_id=pid, event_name=event, academic_year=ay).delete()
+        row = db.session.query(
+            func.count(Score.id), func.sum(Score.total), func.max(Score.total), func.sum(Score.total * Score.total)
+        ).filter(
+            Score.player_id == pid, func.coalesce(Score.event_name, '') == event, Score.academic_year == ay
+        ).one()
+        if row[0]:
+            db.session.add(PlayerEventStat(player_id=pid, event_name=event, academic_year=ay,
+                                           count=row[0], total_sum=row[1] or 0.0, total_max=row[2], total_sum_sq=row[3] or 0.0))
+
+def rebuild_stats():
+    """集計テーブルをScoreから作り直す (不整合の修復用)。
+    アーカイブ済みの年度の行はそのまま残す (ない場合はアーカイブのファイルから戻す)。"""
+    archived = list(archived_years())
+    PlayerEventStat.query.filter(PlayerEventStat.academic_year.notin_(archived)).delete(synchronize_session=False)
+    ay_col = Score.academic_year
+    sel = db.session.query(
+        Score.player_id, func.coalesce(Score.event_name, ''), ay_col,
+        func.count(Score.id), func.coalesce(func.sum(Score.total), 0.0), func.max(Score.total),
+        func.coalesce(func.sum(Score.total * Score.total), 0.0)
+    ).group_by(Score.player_id, func.coalesce(Score.event_name, ''), ay_col)
+    db.session.execute(insert(PlayerEventStat).from_select(
+        ['player_id', 'event_name', 'academic_year', 'count', 'total_sum', 'total_max', 'total_sum_sq'], sel
+    ))
+    columns = [c.name for c in PlayerEventStat.__table__.columns]
+    for year in archived:
+        if db.session.query(PlayerEventStat.player_id).filter_by(academic_year=year).first(): continue
+        try:
+            with archive_session(year) as session:
+                rows = [dict(zip(columns, r)) for r in session.execute(db.select(PlayerEventStat.__table__))]
+        except ArchiveError as e:
+            app.logger.warning('%d年度の集計を戻せません: %s', year, e)
+            continue
+        if rows: db.session.execute(insert(PlayerEventStat), rows)
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """集計テーブル (player_event_stat) を再構築する"""
+    rebuild_stats()
+    bump_data_version()
+    db.session.commit()
+    print(f'player_event_stat: {PlayerEventStat.query.count()} 行を再構築しました')
+
+# ---------------------------------------------------------
+# マイグレーション (PRAGMA user_version でDBのバージョンを管理)
+# ---------------------------------------------------------
+def _column_names(table):
+    return {row[1] for row in db.session.execute(text(f'PRAGMA table_info({table})'))}
+
+def _create_indexes(model):
+    """モデルに定義したインデックスのうち、列が揃っているものを作る
+    (後のマイグレーションで追加する列のインデックスはそのマイグレーションで作られる)"""
+    columns = _column_names(model.__tablename__)
+    for index in model.__table__.indexes:
+        if all(c.name in columns for c in index.columns):
+            index.create(db.session.connection(), checkfirst=True)
+
+def _migration_1_score_indexes():
+    """Score に academic_year 列と検索用インデックスを追加する"""
+    if 'academic_year' not in _column_names('score'):
+        db.session.execute(text('ALTER TABLE score ADD COLUMN academic_year INTEGER'))
+    db.session.execute(Score.__table__.update().where(Score.academic_year.is_(None)).values(academic_year=_academic_year_sql(Score.date)))
+    _create_indexes(Score)
+
+def _migration_2_player_name_key():
+    """Player に検索用の name_key 列を追加する"""
+    if 'name_key' not in _column_names('player'):
+        db.session.execute(text('ALTER TABLE player ADD COLUMN name_key VARCHAR(50)'))
+    db.session.execute(Player.__table__.update().where(Player.name_key.is_(None)).values(
+        name_key=func.replace(func.replace(Player.name, ' ', ''), '　', '')))
+    _create_indexes(Player)
+
+def _migration_3_score_row_version():
+    """Score に row_version 列を追加する (既存の行は 0)"""
+    if 'row_version' not in _column_names('score'):
+        db.session.execute(text('ALTER TABLE score ADD COLUMN row_version INTEGER DEFAULT 0'))
+    db.session.execute(Score.__table__.update().where(Score.row_version.is_(None)).values(row_version=0))
+    _create_indexes(Score)
+
+def _migration_4_team_goal_unique():
+    """TeamGoal の重複 (同じ種目・性別) を最初の1件だけ残して消し、一意インデックスを張る"""
+    db.session.execute(text('DELETE FROM team_goal WHERE id NOT IN '
+                            '(SELECT MIN(id) FROM team_goal GROUP BY event_name, gender)'))
+    _create_indexes(TeamGoal)
+
+def assign_content_keys():
+    """content_key が NULL の成績にキーを付ける。同じキーの成績が既にあるか、NULL の中で重複する場合は
+    最新 (id が最大) の1件だけに付け、残りは NULL のままにする。重複で残った件数を返す。"""
+    db.session.execute(text('CREATE TEMP TABLE IF NOT EXISTS score_key (id INTEGER PRIMARY KEY, key TEXT NOT NULL)'))
+    db.session.execute(text('DELETE FROM temp.score_key'))
+    cols = [getattr(Score, c) for c in CONTENT_KEY_COLUMNS]
+    result = db.session.execute(db.select(Score.id, *cols).where(Score.content_key.is_(None)).execution_options(yield_per=5000))
+    for rows in result.partitions():
+        db.session.execute(text('INSERT INTO temp.score_key (id, key) VALUES (:id, :key)'),
+                           [{'id': r[0], 'key': score_content_key(*r[1:])} for r in rows])
+    db.session.execute(text(
+        'UPDATE score SET content_key = (SELECT key FROM temp.score_key k WHERE k.id = score.id) '
+        'WHERE id IN (SELECT MAX(id) FROM temp.score_key GROUP BY key '
+        '             HAVING key NOT IN (SELECT content_key FROM score WHERE content_key IS NOT NULL))'))
+    db.session.execute(text('DROP TABLE temp.score_key'))
+    return db.session.query(func.count(Score.id)).filter(Score.content_key.is_(None)).scalar()
+
+def _migration_5_score_content_key():
+    """Score に重複判定用の content_key 列と一意インデックスを追加する。
+    既にある重複は消さずにキーなしで残す (flask dedupe-scores で削除する)"""
+    if 'content_key' not in _column_names('score'):
+        db.session.execute(text('ALTER TABLE score ADD COLUMN content_key VARCHAR(40)'))
+    duplicates = assign_content_keys()
+    _create_indexes(Score)
+    if duplicates:
+        app.logger.warning('重複した成績が %d 件あります。flask dedupe-scores で削除してください', duplicates)
+
+def _migration_6_import_job_counts():
+    """ImportJob に更新・変更なしの件数の列を追加する"""
+    columns = _column_names('import_job')
+    for col in ['updated', 'unchanged']:
+        if col not in columns:
+            db.session.execute(text(f'ALTER TABLE import_job ADD COLUMN {col} INTEGER DEFAULT 0'))
+
+def _migration_7_import_job_duplicates():
+    """ImportJob に重複で取り込まなかった行の列を追加する"""
+    if 'duplicates' not in _column_names('import_job'):
+        db.session.execute(text('ALTER TABLE import_job ADD COLUMN duplicates TEXT'))
+
+def _migration_8_import_job_worker_token():
+    """ImportJob に実行中のプロセスの識別子の列を追加する"""
+    if 'worker_token' not in _column_names('import_job'):
+        db.session.execute(text('ALTER TABLE import_job ADD COLUMN worker_token VARCHAR(100)'))
+
+# (バージョン番号, 処理) の順に適用する。追加する場合は末尾に足すこと
+MIGRATIONS = [
+    (1, _migration_1_score_indexes),
+    (2, _migration_2_player_name_key),
+    (3, _migration_3_score_row_version),
+    (4, _migration_4_team_goal_unique),
+    (5, _migration_5_score_content_key),
+    (6, _migration_6_import_job_counts),
+    (7, _migration_7_import_job_duplicates),
+    (8, _migration_8_import_job_worker_token),
+]
+
+def migrate_db():
+    """未適用のマイグレーションを順番に適用する。適用した番号のリストを返す。"""
+    current = db.session.execute(text('PRAGMA user_version')).scalar()
+    applied = []
+    for version, func_ in MIGRATIONS:
+        if version <= current: continue
+        func_()
+        db.session.execute(text(f'PRAGMA user_version = {int(version)}'))
+        db.session.commit()
+        applied.append(version)
+    return applied
+
+def seed_team_goals():
+    """未登録のチーム目標を初期値で作る (起動時に呼ぶ。複数ワーカーが同時に呼んでも重複しない)"""
+    rows = [{'event_name': e, 'gender': g, 'target_score': score}
+            for e, score in DEFAULT_TEAM_GOALS.items() for g in ['男', '女']]
+    result = db.session.execute(sqlite_insert(TeamGoal).values(rows).on_conflict_do_nothing(
+        index_elements=['event_name', 'gender']))
+    if result.rowcount: bump_data_version()
+    db.session.commit()
+
+@app.cli.command('migrate-db')
+def migrate_db_command():
+    """既存の shooting.db を最新のスキーマに更新する"""
+    applied = migrate_db()
+    print(f'適用したマイグレーション: {applied}' if applied else 'スキーマは最新です')
+
+@app.cli.command('dedupe-scores')
+@click.option('--dry-run', is_flag=True, help='削除せずに件数だけ表示する')
+def dedupe_scores_command(dry_run):
+    """同じ成績 (選手・日付・大会名・種目・識別が同じ) の重複を最新の1件だけ残して削除する"""
+    assign_content_keys()
+    dupes = db.session.query(Score.id, Score.player_id, Score.event_name, Score.academic_year) \
+        .filter(Score.content_key.is_(None)).all()
+    if not dupes or dry_run:
+        db.session.commit()
+        print(f'重複した成績: {len(dupes)} 件' if dupes else '重複した成績はありません')
+        return
+    ids = [r[0] for r in dupes]
+    for i in range(0, len(ids), 500):
+        Score.query.filter(Score.id.in_(ids[i:i + 500])).delete(synchronize_session=False)
+    delete_score_shots(ids)
+    refresh_stats([r[1:] for r in dupes])
+    bump_data_version()
+    db.session.commit()
+    invalidate_rank_index()
+    print(f'重複した成績を {len(ids)} 件削除しました')
+
+def _explain_targets():
+    """主要ルートの検索クエリ (EXPLAIN QUERY PLAN の確認用)"""
+    sample = Score.query.first()
+    match = sample.match_name if sample else ''
+    pid = sample.player_id if sample else 0
+    ay = sample.academic_year if sample else 2024
+    return [
+        ('/ (最新日付)', Score.query.order_by(Score.date.desc()).limit(1)),
+        ('/ (月別グラフ)', db.session.query(Score.event_name, func.avg(Score.total)).filter(Score.date >= datetime(ay - 4, 4, 1).date()).group_by(Score.event_name)),
+        ('/player/<id>', Score.query.filter_by(player_id=pid).order_by(Score.date)),
+        ('/match/<name>/years', Score.query.filter_by(match_name=match).order_by(Score.date.desc())),
+        ('/match/<name>/<year>', Score.query.filter(Score.match_name == match, Score.academic_year == ay)),
+        ('/ (種目で絞り込み)', Score.query.filter(Score.event_name == 'AR60', Score.date >= datetime(ay, 4, 1).date())),
+    ]
+
+@app.cli.command('explain-queries')
+def explain_queries_command():
+    """主要ルートのクエリがインデックスを使っているか表示する"""
+    for label, q in _explain_targets():
+        sql = str(q.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        plan = [row[3] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + sql))]
+        # SEARCH: インデックスで絞り込み / INDEX: インデックス順に走査 / SCAN: 全件走査
+        if any(p.startswith('SCAN score') and 'INDEX' not in p for p in plan): verdict = 'SCAN  '
+        elif any(p.startswith('SEARCH score') for p in plan): verdict = 'SEARCH'
+        else: verdict = 'INDEX '
+        print(f'{verdict}  {label}')
+        for p in plan: print(f'          {p}')
+
+# ---------------------------------------------------------
+# データバージョンと集計結果キャッシュ
+# ---------------------------------------------------------
+def current_data_version():
+    v = db.session.query(DataVersion.version).filter_by(id=1).scalar()
+    return v or 0
+
+def bump_data_version():
+    """書き込み処理の中で呼ぶ (同じトランザクションでコミットされる)。新しいバージョンを返す。"""
+    stmt = sqlite_insert(DataVersion).values(id=1, version=1)
+    stmt = stmt.on_conflict_do_update(index_elements=['id'], set_={'version': DataVersion.version + 1})
+    db.session.execute(stmt)
+    return current_data_version()
+
+def _cache_encode(obj):
+    """キャッシュする値 (テンプレート変数) を JSON にできる形にする。
+    tuple・日付・SimpleNamespace・文字列以外がキーの dict は型の印を付けて残す"""
+    if obj is None or isinstance(obj, (bool, int, float, str)): return obj
+    np = sys.modules.get('numpy')  # numpy の値は numpy を読み込んだ後にしか現れない
+    if np is not None and isinstance(obj, np.generic): return obj.item()
+    if isinstance(obj, list): return [_cache_encode(v) for v in obj]
+    if isinstance(obj, tuple): return {'__tuple__': [_cache_encode(v) for v in obj]}
+    if isinstance(obj, datetime): return {'__datetime__': obj.isoformat()}
+    if isinstance(obj, date): return {'__date__': obj.isoformat()}
+    if isinstance(obj, SimpleNamespace): return {'__ns__': _cache_encode(vars(obj))}
+    if isinstance(obj, dict):
+        if all(isinstance(k, str) and not k.startswith('__') for k in obj):
+            return {k: _cache_encode(v) for k, v in obj.items()}
+        return {'__dict__': [[_cache_encode(k), _cache_encode(v)] for k, v in obj.items()]}
+    raise TypeError(f'キャッシュできない型です: {type(obj).__name__}')
+
+def _cache_decode(obj):
+    if isinstance(obj, list): return [_cache_decode(v) for v in obj]
+    if not isinstance(obj, dict): return obj
+    if '__tuple__' in obj: return tuple(_cache_decode(v) for v in obj['__tuple__'])
+    if '__datetime__' in obj: return datetime.fromisoformat(obj['__datetime__'])
+    if '__date__' in obj: return date.fromisoformat(obj['__date__'])
+    if '__ns__' in obj: return SimpleNamespace(**_cache_decode(obj['__ns__']))
+    if '__dict__' in obj: return {_cache_decode(k): _cache_decode(v) for k, v in obj['__dict__']}
+    return {k: _cache_decode(v) for k, v in obj.items()}
+
+class RedisCacheBackend:
+    """複数ワーカーで共有するキャッシュ (redis パッケージが必要)。
+    値は JSON で保存する (共有の Redis に書き込めれば任意のコードを実行できてしまう pickle は使わない)"""
+    def __init__(self, url, ttl):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        raw = self.client.get('wrsc:' + key)
+        if raw is None: return None
+        try:
+            return _cache_decode(json.loads(raw))
+        except (ValueError, TypeError, KeyError) as e:
+            app.logger.warning('shared cache entry ignored: %s', e)
+            return None
+
+    def set(self, key, value):
+        try:
+            raw = json.dumps(_cache_encode(value), ensure_ascii=False, separators=(',', ':'))
+        except TypeError as e:
+            app.logger.warning('shared cache skipped: %s', e)  # このワーカーのキャッシュには入る
+            return
+        self.client.set('wrsc:' + key, raw, ex=self.ttl)
+
+class ResultCache:
+    """集計結果のLRUキャッシュ。キーにデータバージョンを含めるので、
+    書き込み後は古いエントリが参照されなくなり、そのうち追い出される。"""
+    def __init__(self, max_entries=256, backend=None):
+        self.max_entries = max_entries
+        self.backend = backend
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+    def get_or_compute(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        value = self.backend.get(key) if self.backend else None
+        if value is not None:
+            with self.lock: self.shared_hits += 1
+        else:
+            value = compute()
+            with self.lock: self.misses += 1
+            if self.backend: self.backend.set(key, value)
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock: self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {'hits': self.hits, 'shared_hits': self.shared_hits, 'misses': self.misses,
+                    'hit_rate': round((self.hits + self.shared_hits) / lookups, 3) if lookups else None,
+                    'entries': len(self.entries), 'max_entries': self.max_entries,
+                    'backend': type(self.backend).__name__ if self.backend else None}
+
+result_cache = ResultCache(
+    app.config['CACHE_MAX_ENTRIES'],
+    RedisCacheBackend(app.config['CACHE_REDIS_URL'], app.config['CACHE_TTL']) if app.config['CACHE_REDIS_URL'] else None
+)
+
+def cached_view(template):
+    """ビューが返したテンプレート変数をキャッシュして描画するデコレータ。
+    キー: エンドポイント + URL引数 + クエリ文字列 + データバージョン + 今日の年度
+    (ランキングなどは今日の年度で絞るので、書き込みがなくても4月1日には別のキーにする)"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if not app.config['CACHE_ENABLED']:
+                return render_template(template, **view(**kwargs))
+            key = repr((request.endpoint, sorted(kwargs.items()), sorted(request.args.items(multi=True)), current_data_version(),
+                        academic_year(date.today())))
+            return render_template(template, **result_cache.get_or_compute(key, lambda: view(**kwargs)))
+        return wrapper
+    return decorator
+
+def _plain_score(s):
+    """キャッシュに入れられるようにScoreをORMから切り離した値にする (s.player.name 等でそのまま参照できる)"""
+    return SimpleNamespace(
+        id=s.id, player_id=s.player_id, date=s.date, match_name=s.match_name,
+        category=s.category, event_name=s.event_name,
+        s1=s.s1, s2=s.s2, s3=s.s3, s4=s.s4, s5=s.s5, s6=s.s6, total=s.total,
+        player=SimpleNamespace(id=s.player.id, name=s.player.name, gender=s.player.gender),
+    )
+
+# ---------------------------------------------------------
+# 列スナップショット (COLUMNAR_SNAPSHOT = True のときにグラフ集計で使う)
+# ---------------------------------------------------------
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+def _snapshot_dir():
+    return os.path.join(app.instance_path, 'snapshot')
+
+def get_score_snapshot():
+    """最新のデータバージョンまで反映したスナップショットを返す。
+    前回から変わった行 (row_version が新しい行) だけを読み込み、削除は件数の差で検出する。
+    ディスクへの保存は flask snapshot で行う (リクエストの途中で全列を書き出して他の読み手を待たせないため)"""
+    from columnar import ScoreSnapshot
+    global _snapshot
+    version = current_data_version()
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = ScoreSnapshot.load(_snapshot_dir()) or ScoreSnapshot()
+        snap = _snapshot
+        if snap.version == version: return snap
+        if snap.version > version:
+            # DBが巻き戻された (復元など) ので最初から読み直す
+            snap = _snapshot = ScoreSnapshot()
+
+        rows = db.session.query(
+            Score.id, Score.player_id, Score.event_name, Player.gender, Score.match_name, Score.category, Score.date,
+            Score.s1, Score.s2, Score.s3, Score.s4, Score.s5, Score.s6, Score.total
+        ).join(Player).filter(Score.row_version > snap.version).all()
+        if rows:
+            cols = list(zip(*rows))
+            snap.upsert({
+                'id': cols[0], 'player_id': cols[1], 'event': cols[2], 'gender': cols[3], 'match': cols[4],
+                'category': cols[5], 'date': [d.toordinal() for d in cols[6]],
+                's1': cols[7], 's2': cols[8], 's3': cols[9], 's4': cols[10], 's5': cols[11], 's6': cols[12],
+                'total': cols[13],
+            })
+        if db.session.query(func.count(Score.id)).scalar() != len(snap):
+            snap.retain([i for (i,) in db.session.query(Score.id)])
+        snap.sync_player_genders(dict(db.session.query(Player.id, Player.gender)))
+        snap.version = version
+        return snap
+
+@app.cli.command('snapshot')
+def snapshot_command():
+    """列スナップショットを最新にして保存する (ワーカー起動前の準備用。cron などで定期的に実行してもよい)"""
+    snap = get_score_snapshot()
+    snap.save(_snapshot_dir())
+    print(f'snapshot v{snap.version}: {len(snap)} 行')
+
+# ---------------------------------------------------------
+# 順位インデックス (種目×性別ごとのソート済み配列を二分探索する)
+# ---------------------------------------------------------
+class RankIndex:
+    """選手ごとのベスト/平均を種目・性別ごとに昇順で保持し、順位を二分探索で求める。
+    gender=None のキーには男女を合わせた配列を入れる。"""
+    def __init__(self, rows):
+        # rows: [(種目, 性別, ベスト, 平均), ...] (1選手1種目につき1行)
+        self.values = {'best': {}, 'avg': {}}
+        for event, gender, best, avg in rows:
+            for metric, val in (('best', best), ('avg', avg)):
+                if val is None: continue
+                val = round(val, 1)
+                self.values[metric].setdefault((event, gender), []).append(val)
+                self.values[metric].setdefault((event, None), []).append(val)
+        for arrays in self.values.values():
+            for arr in arrays.values(): arr.sort()
+
+    def lookup(self, event, metric, value, gender=None):
+        """順位情報を返す。同点は同順位 (例: 1, 2, 2, 4)。
+        {'rank': 順位, 'tie_low': 同点の最上位, 'tie_high': 同点の最下位, 'ties': 同点人数,
+         'total': 人数, 'percentile': 自分より低い選手の割合(%)}"""
+        arr = self.values[metric].get((event, gender))
+        if not arr or value is None: return None
+        value = round(value, 1)
+        lo, hi = bisect_left(arr, value), bisect_right(arr, value)
+        total = len(arr)
+        rank = total - hi + 1
+        return {'rank': rank, 'tie_low': rank, 'tie_high': total - lo, 'ties': hi - lo,
+                'total': total, 'percentile': round(100.0 * lo / total, 1)}
+
+    def rank(self, event, metric, value, gender=None):
+        info = self.lookup(event, metric, value, gender)
+        return info['rank'] if info else None
+
+_rank_indexes = {}  # {(開始年度 (None=全期間), データバージョン): RankIndex}
+
+def get_rank_index(start_year=None):
+    """指定年度以降の成績から作った順位インデックスを返す (スコア更新までキャッシュ)。"""
+    version = current_data_version()
+    idx = _rank_indexes.get((start_year, version))
+    if idx is None:
+        S = PlayerEventStat
+        q = db.session.query(
+            S.event_name, Player.gender, func.max(S.total_max), func.sum(S.total_sum) / func.sum(S.count)
+        ).join(Player)
+        if start_year: q = q.filter(S.academic_year >= start_year)
+        idx = RankIndex(q.group_by(S.player_id, S.event_name).all())
+        # 他のワーカーが更新した場合も古いバージョンは使われなくなる
+        for k in [k for k in _rank_indexes if k[1] != version]: _rank_indexes.pop(k, None)
+        _rank_indexes[(start_year, version)] = idx
+    return idx
+
+def invalidate_rank_index():
+    _rank_indexes.clear()
+
+# ---------------------------------------------------------
+# 1射ごとの点数 (score_shots テーブル。変換と集計は shots.py)
+# ---------------------------------------------------------
+def save_score_shots(items):
+    """[(score_id, BLOB), ...] を登録・上書きする (1文でまとめて実行)"""
+    if not items: return
+    stmt = sqlite_insert(ScoreShots.__table__)
+    stmt = stmt.on_conflict_do_update(index_elements=['score_id'], set_={'shots': stmt.excluded.shots})
+    db.session.execute(stmt, [{'score_id': sid, 'shots': blob} for sid, blob in items])
+
+def delete_score_shots(score_ids):
+    ids = sorted(score_ids)
+    for i in range(0, len(ids), 500):
+        db.session.execute(ScoreShots.__table__.delete().where(ScoreShots.__table__.c.score_id.in_(ids[i:i + 500])))
+
+def player_shot_analysis(player_id):
+    """選手の明細がある成績を種目ごとにまとめて集計する (アーカイブ済みの年度も含む)。{種目: shots.summarize() の結果}"""
+    import numpy as np
+    import shots
+    rows = []
+    for session in score_sessions(player_years(player_id)):
+        rows += session.query(Score.event_name, ScoreShots.shots).join(ScoreShots, ScoreShots.score_id == Score.id) \
+            .filter(Score.player_id == player_id).order_by(Score.id).all()
+    if not rows: return {}
+    events = np.array([e or '' for e, _ in rows], dtype=object)
+    packed = shots.unpack([blob for _, blob in rows])
+    return {e: shots.summarize(packed[events == e]) for e in sort_events_filter(set(events))}
+
+# ---------------------------------------------------------
+# CSVの形式 (文字コードとヘッダーの判別)
+# ---------------------------------------------------------
+SERIES_COLS = [f'S{i}' for i in range(1, 7)]
+# 取り込み処理が扱う列名 (各形式の列はこの名前に読み替える)
+# 明細: 1射ごとの点数 (60射を空白区切り。shots.parse_shots() の形式)
+CANONICAL_COLUMNS = ['日付', '大会名', '識別', '選手名', '性別', '入部年度', '種目'] + SERIES_COLS + ['合計', '明細']
+OPTIONAL_COLUMNS = {'識別', '性別', '入部年度', '合計', '明細'}  # なくても取り込める列
+TEXT_COLUMNS = {'日付', '選手名', '大会名', '識別', '種目', '性別', '明細'}
+SNIFF_BYTES = 64 * 1024  # 文字コードとヘッダーの判別に読む先頭のバイト数
+
+class CsvFormatError(Exception):
+    """CSVの文字コードやヘッダーが対応していない (ファイル全体を取り込まない)"""
+
+# 対応しているヘッダーの形式。{'name': 形式名, 'columns': {CSVの列名: 取り込み用の列名},
+# 'values': {取り込み用の列名: {CSVの値: 取り込み用の値}}}。先に登録したものから順に照合する
+CSV_LAYOUTS = []
+
+def register_csv_layout(name, columns, values=None):
+    """CSVのヘッダー形式を登録する。columns に含まれない列は読み込まない"""
+    unknown = set(columns.values()) - set(CANONICAL_COLUMNS)
+    if unknown: raise ValueError(f'未知の列: {sorted(unknown)}')
+    CSV_LAYOUTS.append({'name': name, 'columns': dict(columns), 'values': values or {}})
+
+register_csv_layout('標準', {c: c for c in CANONICAL_COLUMNS})
+register_csv_layout('大会シート', {
+    '日付': '日付', '氏名': '選手名', '大会名': '大会名', '種目': '種目', '区分': '識別',
+    **{c: c for c in SERIES_COLS}, '合計点': '合計', '性別': '性別', '入部年度': '入部年度', '明細': '明細',
+}, values={'性別': {'Male': '男', 'Female': '女'}, '識別': {'Indiv': 'Individual'}})
+
+def _sniff_encoding(prefix):
+    """先頭のバイト列から文字コードを判別する (BOM → UTF-8 → cp932 の順)。
+    ASCII だけなら cp932 とみなす。判別できなければ None"""
+    if prefix.startswith(codecs.BOM_UTF8): return 'utf-8-sig'
+    if prefix.isascii(): return 'cp932'
+    for encoding in ['utf-8', 'cp932']:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(prefix, final=False)  # 末尾で切れた文字は許す
+            return encoding
+        except UnicodeDecodeError:
+            pass
+    return None
+
+def _match_layout(header):
+    """ヘッダーの列名に合う形式を返す。必須の列が揃う形式がなければ None"""
+    present = set(header)
+    for layout in CSV_LAYOUTS:
+        required = {src for src, col in layout['columns'].items() if col not in OPTIONAL_COLUMNS}
+        if required <= present: return layout
+    return None
+
+def sniff_csv(filepath):
+    """先頭だけを読んで文字コードとヘッダーの形式を判別する。
+    戻り値: (文字コード, 形式)。対応していなければ CsvFormatError"""
+    with open(filepath, 'rb') as f:
+        prefix = f.read(SNIFF_BYTES)
+    encoding = _sniff_encoding(prefix)
+    if encoding is None:
+        raise CsvFormatError('CSVの文字コードを判別できませんでした (cp932 / UTF-8 に対応)')
+    text_ = codecs.getincrementaldecoder(encoding)(errors='replace').decode(prefix, final=False)
+    if '\n' not in text_ and len(prefix) == SNIFF_BYTES:
+        raise CsvFormatError('CSVのヘッダー行が長すぎます')
+    header = [c.strip() for c in next(csv.reader(io.StringIO(text_)), [])]
+    layout = _match_layout(header)
+    if layout is None:
+        known = ' / '.join(f"{l['name']} ({','.join(l['columns'])})" for l in CSV_LAYOUTS)
+        raise CsvFormatError(f"対応していないCSVの形式です。ヘッダー: {','.join(header)} | 対応している形式: {known}")
+    return encoding, layout
+
+def _apply_layout(df, layout):
+    """チャンクの列名と値を取り込み用に読み替える"""
+    df = df.rename(columns=lambda c: layout['columns'].get(str(c).strip(), str(c).strip()))
+    for col, mapping in layout['values'].items():
+        if col in df.columns:
+            df[col] = df[col].str.strip().replace(mapping)
+    return df
+
+# ---------------------------------------------------------
+# CSVインポート処理
+# ---------------------------------------------------------
+
+def _normalize_chunk(df):
+    """CSVの1チャンクを列単位で正規化する。
+    戻り値: (取り込み可能な行のDataFrame, 空行数, [(行番号, 理由), ...])"""
+    import numpy as np  # 取り込みのときだけ読み込む (起動を速くするため)
+    import pandas as pd
+    import shots
+    df = df.rename(columns=lambda c: str(c).strip())
+    line_no = df.index + 2  # ヘッダー行の分 +1, 1始まりで +1
+    rejected = []
+
+    # 完全な空行はスキップ扱い
+    blank = df.isna().all(axis=1)
+    skipped = int(blank.sum())
+
+    if '選手名' not in df.columns:
+        reason = '選手名の列がありません'
+        rejected.extend((int(n), reason) for n in line_no[~blank])
+        return df.iloc[0:0], skipped, rejected
+
+    out = pd.DataFrame(index=df.index)
+    out['name'] = df['選手名'].astype('string').str.strip()
+    out['gender'] = df['性別'] if '性別' in df.columns else ''
+    years = pd.to_numeric(df['入部年度'], errors='coerce') if '入部年度' in df.columns else pd.Series(2024, index=df.index)
+    out['entry_year'] = years.astype('Int64')
+
+    # 日付 (YYYY/MM/DD)
+    dates = pd.to_datetime(df['日付'].astype('string').str.strip(), format='%Y/%m/%d', errors='coerce') if '日付' in df.columns else pd.Series(pd.NaT, index=df.index)
+    out['date'] = dates.dt.date
+    out['academic_year'] = (dates.dt.year - (dates.dt.month < 4)).astype('Int64')
+
+    out['match_name'] = df['大会名'] if '大会名' in df.columns else ''
+    out['category'] = df['識別'] if '識別' in df.columns else ''
+    out['event_name'] = df['種目'] if '種目' in df.columns else ''
+
+    # S1〜S6 (空欄は0点、数値以外は不正)
+    bad_series = pd.Series(False, index=df.index)
+    for i, col in enumerate(SERIES_COLS, start=1):
+        if col in df.columns:
+            raw = df[col]
+            num = pd.to_numeric(raw, errors='coerce')
+            bad_series |= num.isna() & raw.notna()
+            out[f's{i}'] = num.fillna(0.0).astype(float)
+        else:
+            out[f's{i}'] = 0.0
+
+    # 合計 (合計 → S1〜S6の和 の順で採用)
+    total = pd.to_numeric(df['合計'], errors='coerce') if '合計' in df.columns else pd.Series(float('nan'), index=df.index)
+    series_sum = out[[f's{i}' for i in range(1, 7)]].sum(axis=1)
+    out['total'] = total.where(total.notna() & (total != 0), series_sum).astype(float)
+
+    # 明細 (60射) があれば S1〜S6 と合計は明細から計算する。入力された値 (0以外) と合わなければ不正
+    out['shots'] = None
+    bad_shots = pd.Series(False, index=df.index)
+    mismatch = pd.Series(False, index=df.index)
+    if '明細' in df.columns:
+        raw = df['明細'].astype('string').str.strip()
+        parsed = {}
+        for idx, value in raw[raw.notna() & (raw != '')].items():
+            try:
+                parsed[idx] = shots.parse_shots(value)
+            except ValueError:
+                bad_shots[idx] = True
+        if parsed:
+            idx = list(parsed)
+            packed = np.stack(list(parsed.values()))
+            derived = shots.series_totals(packed)
+            derived_total = derived.sum(axis=1).round(1)
+            given = out.loc[idx, [f's{i}' for i in range(1, 7)]].to_numpy()
+            given_total = total.loc[idx].fillna(0).to_numpy()
+            mismatch.loc[idx] = ((given != 0) & (np.abs(given - derived) > 0.05)).any(axis=1) \
+                | ((given_total != 0) & (np.abs(given_total - derived_total) > 0.05))
+            out.loc[idx, [f's{i}' for i in range(1, 7)]] = derived
+            out.loc[idx, 'total'] = derived_total
+            out.loc[idx, 'shots'] = pd.Series([shots.pack(p) for p in packed], index=idx, dtype=object)
+
+    checks = [
+        (out['name'].isna() | (out['name'] == ''), '選手名が空です'),
+        (out['date'].isna(), '日付の形式が不正です (YYYY/MM/DD)'),
+        (bad_series, 'S1〜S6に数値以外が含まれています'),
+        (bad_shots, '明細の形式が不正です (60射の点数を空白区切り。内10点は 10.5* または X)'),
+        (mismatch, 'S1〜S6・合計が明細から計算した値と一致しません'),
+    ]
+    invalid = pd.Series(False, index=df.index)
+    for mask, reason in checks:
+        mask = mask.fillna(True).astype(bool) & ~blank & ~invalid
+        rejected.extend((int(n), reason) for n in line_no[mask])
+        invalid |= mask
+
+    valid = out[~blank & ~invalid]
+    # NaN は NULL として保存する
+    valid = valid.astype(object).where(valid.notna(), None)
+    return valid, skipped, rejected
+
+def _upsert_players(df, player_ids):
+    """未登録の選手を1文でまとめて登録し、name → id の対応表を更新する。"""
+    names = [n for n in df['name'].unique() if n not in player_ids]
+    if not names: return
+    # 同じ選手が複数行ある場合は最初の行の性別・入部年度を採用
+    first = df.drop_duplicates('name').set_index('name')
+    for i in range(0, len(names), 500):
+        batch = names[i:i + 500]
+        db.session.execute(
+            sqlite_insert(Player).on_conflict_do_nothing(index_elements=['name']),
+            [{'name': n, 'name_key': normalize_name(n), 'gender': first.at[n, 'gender'], 'entry_year': first.at[n, 'entry_year']} for n in batch]
+        )
+        rows = db.session.query(Player.name, Player.id).filter(Player.name.in_(batch)).all()
+        player_ids.update(dict(rows))
+
+# 既存の成績と比べる列 (すべて同じなら「変更なし」)
+COMPARED_COLS = ['match_name', 'category', 'event_name', 's1', 's2', 's3', 's4', 's5', 's6', 'total']
+
+# 同じファイル内の重複 (選手・日付・大会名・種目・識別が同じ) は最初の行だけを取り込む。
+# 点数まで同じなら同じ成績の重複、点数が違えば別の成績を取り込めなかったことになるので理由を分ける
+DUPLICATE_ROW_REASON = 'ファイル内の前の行と同じ成績です (選手・日付・大会名・種目・識別が同じ)'
+CONFLICT_ROW_REASON = ('{first}と選手・日付・大会名・種目・識別が同じで点数が違うため取り込んでいません '
+                       '(同じ日に同じ種目の成績が2件ある場合は識別を分けてください)')
+
+def _reject_duplicate(report, line, first_line, differs):
+    """重複した行を rejected と duplicates の両方に記録する (first_line は前のチャンクの行なら None)"""
+    report['duplicates'].append((line, first_line, differs))
+    first = f'{first_line}行目' if first_line else 'ファイル内の前の行'
+    report['rejected'].append((line, CONFLICT_ROW_REASON.format(first=first) if differs else DUPLICATE_ROW_REASON))
+
+# アーカイブ済みの年度の成績は変更できない
+ARCHIVED_ROW_REASON = 'アーカイブ済みの年度の成績は登録・変更できません'
+
+def _existing_scores(keys, session=None):
+    """content_key → (row_version, 比較する列の値..., 明細のBLOB) の対応表 (500件ずつまとめて引く)"""
+    session = session or db.session
+    found = {}
+    cols = [Score.row_version] + [getattr(Score, c) for c in COMPARED_COLS] + [ScoreShots.shots]
+    for i in range(0, len(keys), 500):
+        rows = session.query(Score.content_key, *cols).outerjoin(ScoreShots, ScoreShots.score_id == Score.id) \
+            .filter(Score.content_key.in_(keys[i:i + 500])).all()
+        found.update((r[0], tuple(r[1:])) for r in rows)
+    return found
+
+def _score_ids(keys):
+    """content_key → id の対応表"""
+    found = {}
+    for i in range(0, len(keys), 500):
+        found.update(db.session.query(Score.content_key, Score.id).filter(Score.content_key.in_(keys[i:i + 500])).all())
+    return found
+
+def _check_archived_rows(df, report):
+    """アーカイブ済みの年度の行: アーカイブと同じ内容なら「変更なし」、それ以外はエラーにする"""
+    names = list(df['name'].unique())
+    player_ids = {}
+    for i in range(0, len(names), 500):
+        player_ids.update(db.session.query(Player.name, Player.id).filter(Player.name.in_(names[i:i + 500])).all())
+    by_year = {}  # {年度: [(content_key, 行, 行番号, 明細のBLOB), ...]}
+    archives = archived_years()
+    for rec, name, line, blob in zip(df[['date', 'academic_year'] + COMPARED_COLS].to_dict('records'),
+                                     df['name'], df.index + 2, df['shots']):
+        pid = player_ids.get(name)
+        key = score_content_key(pid, rec['date'], rec['match_name'], rec['event_name'], rec['category']) if pid else None
+        by_year.setdefault(rec['academic_year'], []).append((key, rec, int(line), blob))
+    for year, rows in by_year.items():
+        existing = {}
+        if year in archives:
+            with archive_session(year) as session:
+                existing = _existing_scores([key for key, *_ in rows if key], session)
+        for key, rec, line, blob in rows:
+            old = existing.get(key)
+            if old is not None and old[1:-1] == tuple(rec[c] for c in COMPARED_COLS) and (blob is None or blob == old[-1]):
+                report['unchanged'] += 1
+            else:
+                report['rejected'].append((line, ARCHIVED_ROW_REASON))
+
+def _assign_score_ids(records):
+    """アーカイブへ移した成績より後の id を振る。SQLite は今ある最大の id の次を使うので、
+    最大の id の成績をアーカイブへ移した後は同じ id がまた使われてしまう"""
+    floor = max((a.last_score_id or 0 for a in archived_years().values()), default=0)
+    if not records or not floor: return
+    if (db.session.query(func.max(Score.id)).scalar() or 0) >= floor: return
+    for sid, rec in enumerate(records, start=floor + 1):
+        rec['id'] = sid
+
+def _upsert_scores(records):
+    """content_key の一意インデックスで、新しい成績は登録し既存の成績は上書きする (1文でまとめて実行)"""
+    stmt = sqlite_insert(Score.__table__)  # ORM の一括処理を通さずに executemany で実行する
+    stmt = stmt.on_conflict_do_update(index_elements=['content_key'],
+                                      set_={c: stmt.excluded[c] for c in COMPARED_COLS + ['row_version']})
+    db.session.execute(stmt, records)
+
+def import_row_count(report):
+    return report['inserted'] + report['updated'] + report['unchanged'] + report['skipped'] + len(report['rejected'])
+
+def import_scores_csv(filepath, encoding, layout, row_version=0, progress=None):
+    """CSVを先頭から1回だけ読み、チャンク単位で1トランザクションに一括登録する。
+    encoding, layout は sniff_csv() で判別したもの。
+    既に登録済みの成績 (content_key が同じ) は点数などが違えば上書きし、同じなら何もしない。
+    progress を渡すとチャンクごとに途中経過 (report) を渡して呼ぶ。
+    戻り値: {'inserted': 件数, 'updated': 件数, 'unchanged': 件数, 'skipped': 件数, 'rejected': [(行番号, 理由), ...],
+            'duplicates': [(行番号, 残した行の番号または None, 点数が違うか), ...] (rejected にも含む)}"""
+    import pandas as pd
+    report = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'rejected': [], 'duplicates': []}
+    player_ids = {}
+    refresh_keys = set()  # 上書きした成績の集計キー (最高点が変わりうるので最後に再計算する)
+    score_cols = ['date', 'academic_year', 'match_name', 'category', 'event_name', 's1', 's2', 's3', 's4', 's5', 's6', 'total']
+    archived_through = max(archived_years(), default=None)  # この年度までの成績はアーカイブのファイルにある
+
+    dtype = {src: str for src, col in layout['columns'].items() if col in TEXT_COLUMNS}
+    # 文字コードの変換はファイルを読みながら行う (全体をメモリに読み込まない)
+    with open(filepath, encoding=encoding, newline='') as f:
+        reader = pd.read_csv(f, chunksize=app.config['IMPORT_CHUNK_SIZE'], dtype=dtype, skip_blank_lines=False,
+                             usecols=lambda c: c.strip() in layout['columns'])
+        for chunk in reader:
+            valid, skipped, rejected = _normalize_chunk(_apply_layout(chunk, layout))
+            report['skipped'] += skipped
+            report['rejected'].extend(rejected)
+            if archived_through is not None and not valid.empty:
+                closed = (valid['academic_year'] <= archived_through).to_numpy(dtype=bool)
+                if closed.any():
+                    _check_archived_rows(valid[closed], report)
+                    valid = valid[~closed]
+            if valid.empty:
+                if progress: progress(report)
+                continue
+
+            _upsert_players(valid, player_ids)
+            records = valid[score_cols].to_dict('records')
+            unique = {}  # content_key → 行
+            for rec, name, line, blob in zip(records, valid['name'], valid.index + 2, valid['shots']):
+                rec['player_id'] = player_ids[name]
+                rec['row_version'] = row_version
+                rec['content_key'] = score_content_key(*(rec[c] for c in CONTENT_KEY_COLUMNS))
+                first = unique.get(rec['content_key'])
+                if first is not None:
+                    differs = tuple(first[0][c] for c in COMPARED_COLS) != tuple(rec[c] for c in COMPARED_COLS) \
+                        or (blob is not None and blob != first[2])
+                    _reject_duplicate(report, int(line), first[1], differs)
+                else:
+                    unique[rec['content_key']] = (rec, int(line), blob)
+
+            existing = _existing_scores(list(unique))
+            new, changed = [], []
+            shot_changes = {}  # {content_key: 明細のBLOB または None (削除)}
+            for key, (rec, line, blob) in unique.items():
+                old = existing.get(key)
+                if old is None:
+                    new.append(rec)
+                elif old[0] == row_version:  # 前のチャンクで登録した行と同じ成績
+                    differs = old[1:-1] != tuple(rec[c] for c in COMPARED_COLS) or (blob is not None and blob != old[-1])
+                    _reject_duplicate(report, line, None, differs)
+                    continue
+                elif old[1:-1] != tuple(rec[c] for c in COMPARED_COLS) or (blob is not None and blob != old[-1]):
+                    changed.append(rec)
+                    refresh_keys.add((rec['player_id'], rec['event_name'], rec['academic_year']))
+                else:
+                    report['unchanged'] += 1
+                    continue
+                # 明細のない行で点数が変わった場合、古い明細は合わなくなるので消す
+                if blob is not None or (old is not None and old[-1] is not None):
+                    shot_changes[key] = blob
+            _assign_score_ids(new)
+            for batch in (new, changed):
+                if batch: _upsert_scores(batch)
+            if shot_changes:
+                ids = _score_ids(list(shot_changes))
+                save_score_shots([(ids[k], blob) for k, blob in shot_changes.items() if blob is not None])
+                delete_score_shots([ids[k] for k, blob in shot_changes.items() if blob is None])
+            apply_stats_delta(new)
+            report['inserted'] += len(new)
+            report['updated'] += len(changed)
+            if progress: progress(report)
+    refresh_stats(refresh_keys)
+    return report
+
+def run_import(filepath, progress=None):
+    """文字コードと形式を判別してCSVを取り込み、コミットまで行う。
+    対応していない形式や、途中で文字コードの合わない箇所があれば何も登録せずに CsvFormatError"""
+    started = time.perf_counter()
+    encoding, layout = sniff_csv(filepath)
+    try:
+        report = import_scores_csv(filepath, encoding, layout, row_version=bump_data_version(), progress=progress)
+    except UnicodeDecodeError as e:
+        db.session.rollback()
+        raise CsvFormatError(f'CSVの途中に {encoding} として読めない箇所があります') from e
+    if report['inserted'] or report['updated']:
+        db.session.commit()
+        invalidate_rank_index()
+    else:
+        db.session.rollback()  # 変更がなければデータバージョンも上げない (キャッシュを残す)
+    record_import_metrics(report, time.perf_counter() - started)
+    return report
+
+def import_report_message(report, max_lines=50):
+    """取り込み結果の要約 (' | ' 区切り)。重複で取り込まなかった行は黙って捨てたように見えないよう行番号を並べる"""
+    msg = f"登録 {report['inserted']}件 / 更新 {report['updated']}件 / 変更なし {report['unchanged']}件 / スキップ {report['skipped']}件 / エラー {len(report['rejected'])}件"
+    duplicate_lines = {line for line, *_ in report.get('duplicates', [])}
+    errors = [(line, reason) for line, reason in report['rejected'] if line not in duplicate_lines]
+    for line, reason in errors[:5]:
+        msg += f" | {line}行目: {reason}"
+    if len(errors) > 5: msg += f" | 他 {len(errors) - 5}件"
+    conflicts = [(line, first) for line, first, differs in report.get('duplicates', []) if differs]
+    if conflicts:
+        listed = ', '.join(f'{line}行目' + (f' ({first}行目と同じキー)' if first else '') for line, first in conflicts[:max_lines])
+        more = f' 他 {len(conflicts) - max_lines}件' if len(conflicts) > max_lines else ''
+        msg += (f" | 点数が違うのに選手・日付・大会名・種目・識別が前の行と同じため取り込まなかった行 {len(conflicts)}件: "
+                f"{listed}{more}")
+    same = len(duplicate_lines) - len(conflicts)
+    if same: msg += f" | ファイル内で同じ成績が重なっていた行 {same}件 (最初の行だけ取り込みました)"
+    return msg
+
+# ---------------------------------------------------------
+# バックグラウンド取り込みジョブ
+# ---------------------------------------------------------
+_import_pool = None  # 最初に使うときに作る (gunicorn --preload でフォーク前のマスターにスレッドを作らない)
+_import_pool_lock = threading.Lock()
+_import_writer_lock = threading.Lock()  # SQLiteへの書き込みは1ジョブずつ
+_import_progress = {}  # {ジョブID: 途中経過} (実行中のワーカー内だけで持つ)
+
+def import_pool():
+    global _import_pool
+    with _import_pool_lock:
+        if _import_pool is None:
+            _import_pool = ThreadPoolExecutor(max_workers=app.config['IMPORT_WORKERS'], thread_name_prefix='import')
+        return _import_pool
+
+def submit_import_job(job_id):
+    import_pool().submit(_run_import_job, job_id)
+
+def _run_import_job(job_id):
+    with app.app_context():
+        # 他のワーカーが先に取った場合は何もしない
+        claimed = ImportJob.query.filter_by(id=job_id, status='queued').update(
+            {'status': 'running', 'worker_pid': os.getpid(), 'worker_token': worker_token(), 'started_at': datetime.now()})
+        db.session.commit()
+        if not claimed: return
+
+        def progress(report):
+            _import_progress[job_id] = {
+                'rows_processed': import_row_count(report), 'inserted': report['inserted'],
+                'updated': report['updated'], 'unchanged': report['unchanged'],
+                'skipped': report['skipped'], 'rejected': len(report['rejected']),
+            }
+
+        try:
+            with _import_writer_lock:
+                report = run_import(db.session.get(ImportJob, job_id).filepath, progress)
+            job = db.session.get(ImportJob, job_id)
+            job.status = 'done'
+            job.rows_processed = import_row_count(report)
+            job.inserted, job.updated, job.unchanged = report['inserted'], report['updated'], report['unchanged']
+            job.skipped, job.rejected = report['skipped'], len(report['rejected'])
+            job.errors = json.dumps(report['rejected'], ensure_ascii=False)
+            job.duplicates = json.dumps(report['duplicates'])
+            job.message = import_report_message(report)
+        except CsvFormatError as e:
+            db.session.rollback()
+            job = db.session.get(ImportJob, job_id)
+            job.status, job.message = 'failed', str(e)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception('import job %s failed', job_id)
+            job = db.session.get(ImportJob, job_id)
+            job.status, job.message = 'failed', f'取り込みに失敗しました: {e}'
+        job.finished_at = datetime.now()
+        db.session.commit()
+        _remove_upload(job.filepath)  # 完了・失敗したジョブのファイルは再実行しないので消す
+        _import_progress.pop(job_id, None)
+        app.logger.info('import job %s %s: %s', job_id, job.status, job.message)
+
+def _remove_upload(filepath):
+    try:
+        os.remove(filepath)
+    except OSError as e:
+        app.logger.warning('upload cleanup failed: %s', e)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except (OSError, TypeError):
+        return False
+    return True
+
+def _process_start_time(pid):
+    """プロセスの起動時刻 (/proc/<pid>/stat の starttime)。/proc がない環境では None"""
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            return int(f.read().rsplit(b')', 1)[1].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+_worker_token = (None, None)  # (PID, 識別子)。フォークした子プロセスでは PID が変わるので作り直す
+
+def worker_token():
+    """このプロセスの識別子 (ホスト名:PID:起動時刻)。コンテナの再起動で同じPIDになっても前のプロセスと区別できる
+    (起動時刻が取れない環境ではランダムな値)"""
+    global _worker_token
+    pid = os.getpid()
+    if _worker_token[0] != pid:
+        _worker_token = (pid, f'{socket.gethostname()}:{pid}:{_process_start_time(pid) or uuid.uuid4().hex}')
+    return _worker_token[1]
+
+def _job_worker_alive(job):
+    """実行中のジョブを取ったプロセスがまだ動いているか。
+    別のホストのプロセスは確かめられないので動いているとみなす"""
+    if not job.worker_token:  # 識別子を記録する前のジョブ
+        return job.worker_pid != os.getpid() and _pid_alive(job.worker_pid)
+    if job.worker_token == worker_token(): return True
+    parts = job.worker_token.rsplit(':', 2)
+    if len(parts) != 3: return False
+    host, pid, started = parts
+    if host != socket.gethostname(): return True
+    if not pid.isdigit() or int(pid) == os.getpid() or not _pid_alive(int(pid)): return False
+    current = _process_start_time(int(pid))
+    return current is None or str(current) == started  # 起動時刻が違えばPIDを再利用した別のプロセス
+
+def recover_import_jobs():
+    """起動時: 止まったワーカーの実行中ジョブを待ち状態に戻し、待ち状態のジョブを再投入する。
+    取り込みは1トランザクションなので、途中で止まったジョブは最初からやり直せばよい。"""
+    for job in ImportJob.query.filter_by(status='running').all():
+        if not _job_worker_alive(job):
+            job.status = 'queued'
+    db.session.commit()
+    for (job_id,) in db.session.query(ImportJob.id).filter_by(status='queued').order_by(ImportJob.created_at):
+        submit_import_job(job_id)
+
+# ---------------------------------------------------------
+# 選手一覧 (トップページ)
+# ---------------------------------------------------------
+def _player_cursor(row):
+    return f"{row['entry_year'] if row['entry_year'] is not None else ''}|{row['name']}"
+
+def _parse_player_cursor(cursor):
+    year, _, name = cursor.partition('|')
+    return (int(year) if year.lstrip('-').isdigit() else -1), name
+
+def query_player_list(q_name='', q_year='', q_gender='', q_match='', q_event='', after='', before=''):
+    """選手一覧を1回の集計クエリで取得する (キーセット方式のページ送り)。
+    戻り値: (選手のリスト, 条件に合う総人数, 次ページのカーソル, 前ページのカーソル)"""
+    S = PlayerEventStat
+    page_size = app.config['PLAYER_PAGE_SIZE']
+    year_key = func.coalesce(Player.entry_year, -1)  # 入部年度なしは最後に並べる
+
+    # 出場種目と記録数は集計テーブルから求める (Scoreを選手ごとに読み込まない)
+    agg = db.session.query(
+        S.player_id.label('player_id'),
+        func.group_concat(func.nullif(S.event_name, '').distinct()).label('events'),
+        func.sum(S.count).label('score_count')
+    ).group_by(S.player_id).subquery()
+
+    q = db.session.query(Player.id, Player.name, Player.gender, Player.entry_year, agg.c.events, agg.c.score_count) \
+        .outerjoin(agg, agg.c.player_id == Player.id)
+    if q_year: q = q.filter(Player.entry_year == int(q_year))
+    if q_gender: q = q.filter(Player.gender == q_gender)
+    if q_name: q = q.filter(Player.name_key.contains(normalize_name(q_name), autoescape=True))
+    if q_match or q_event:
+        sub = db.session.query(Score.player_id)
+        if q_match: sub = sub.filter(Score.match_name == q_match)
+        if q_event: sub = sub.filter(Score.event_name == q_event)
+        archived = summary_player_ids(q_match, q_event)  # アーカイブ済みの年度は大会ごとの集計から
+        q = q.filter(db.or_(Player.id.in_(sub), Player.id.in_(sorted(archived))) if archived else Player.id.in_(sub))
+
+    total = q.order_by(None).count()
+
+    if before:
+        y, n = _parse_player_cursor(before)
+        q = q.filter(db.or_(year_key > y, db.and_(year_key == y, Player.name < n)))
+        rows = q.order_by(year_key, Player.name.desc()).limit(page_size + 1).all()
+        has_more = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_prev, has_next = has_more, True
+    else:
+        if after:
+            y, n = _parse_player_cursor(after)
+            q = q.filter(db.or_(year_key < y, db.and_(year_key == y, Player.name > n)))
+        rows = q.order_by(year_key.desc(), Player.name).limit(page_size + 1).all()
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_prev = bool(after)
+
+    players = [{
+        'id': pid, 'name': name, 'gender': gender, 'entry_year': entry_year,
+        'events': sort_events_filter(events.split(',')) if events else [],
+        'score_count': count or 0
+    } for pid, name, gender, entry_year, events, count in rows]
+    next_cursor = _player_cursor(players[-1]) if players and has_next else None
+    prev_cursor = _player_cursor(players[0]) if players and has_prev else None
+    return players, total, next_cursor, prev_cursor
+
+# ---------------------------------------------------------
+# 選手ページのスコア履歴 (キーセット方式のページ送り)
+# ---------------------------------------------------------
+def _score_cursor(score):
+    return f'{score.date.isoformat()}|{score.id}'
+
+def _parse_score_cursor(cursor):
+    d, _, sid = cursor.partition('|')
+    try:
+        return datetime.strptime(d, '%Y-%m-%d').date(), int(sid)
+    except ValueError:
+        return None
+
+def player_years(player_id):
+    """選手の成績がある年度 (集計テーブルから。アーカイブのファイルを開く年度を絞るのに使う)"""
+    return {ay for (ay,) in db.session.query(PlayerEventStat.academic_year).filter(PlayerEventStat.player_id == player_id).distinct()}
+
+def query_player_scores(player_id, q_match='', q_event='', after='', before=''):
+    """選手のスコアを日付順に1ページ分だけ取得する (アーカイブ済みの年度はファイルごとに読んで並べる)。
+    戻り値: (スコアのリスト, 条件に合う総件数, 次ページのカーソル, 前ページのカーソル)"""
+    page_size = app.config['SCORE_PAGE_SIZE']
+    before_key = _parse_score_cursor(before) if before else None
+    after_key = _parse_score_cursor(after) if after else None
+    total, rows = 0, []
+    for session in score_sessions(player_years(player_id)):
+        q = session.query(Score).filter(Score.player_id == player_id)
+        if q_match: q = q.filter(Score.match_name == q_match)
+        if q_event: q = q.filter(Score.event_name == q_event)
+        total += q.order_by(None).count()
+        if before_key:
+            d, sid = before_key
+            q = q.filter(db.or_(Score.date < d, db.and_(Score.date == d, Score.id < sid)))
+            rows += q.order_by(Score.date.desc(), Score.id.desc()).limit(page_size + 1).all()
+        else:
+            if after_key:
+                d, sid = after_key
+                q = q.filter(db.or_(Score.date > d, db.and_(Score.date == d, Score.id > sid)))
+            rows += q.order_by(Score.date, Score.id).limit(page_size + 1).all()
+
+    rows.sort(key=lambda s: (s.date, s.id), reverse=bool(before_key))
+    rows = rows[:page_size + 1]
+    if before_key:
+        has_more = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_prev, has_next = has_more, True
+    else:
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_prev = bool(after_key)
+
+    next_cursor = _score_cursor(rows[-1]) if rows and has_next else None
+    prev_cursor = _score_cursor(rows[0]) if rows and has_prev else None
+    return rows, total, next_cursor, prev_cursor
+
+# ---------------------------------------------------------
+# グラフ用データ (JSON API から返す)
+# ---------------------------------------------------------
+def monthly_chart_data():
+    """トップページ: 種目・性別ごとの月別平均 (最新から4年間)"""
+    target_events = ['AR60', 'SB3x20', 'P60']
+    chart_data = {e: {'labels':[], 'male':[], 'female':[]} for e in target_events}
+    
+    snap = get_score_snapshot() if app.config['COLUMNAR_SNAPSHOT'] else None
+
+    # 最新の日付を取得して期間を決める
+    if snap is not None:
+        latest_date = datetime.fromordinal(int(snap.cols['date'].max())).date() if len(snap) else None
+    else:
+        last_score = Score.query.order_by(Score.date.desc()).first()
+        latest_date = last_score.date if last_score else None
+    if latest_date is None:  # すべてアーカイブ済み
+        latest_date = db.session.query(func.max(SeasonMatchSummary.end_date)).scalar()
+    if latest_date:
+        try:
+            # 4年前を計算 (うるう年対応)
+            start_date = latest_date.replace(year=latest_date.year - 4)
+        except ValueError:
+            start_date = latest_date.replace(year=latest_date.year - 4, day=28)
+    else:
+        # データがない場合のダミー日付
+        start_date = datetime(2000, 1, 1).date()
+
+    # フィルタリング付きでデータ取得 (アーカイブ済みの年度は期間にかかるものだけ。年度が違えば月も重ならない)
+    monthly = []
+    archived = {y for y in archived_years() if datetime(y + 1, 3, 31).date() >= start_date}
+    for session in score_sessions(archived):
+        if snap is not None and session is db.session:
+            g = snap.group_by(['event', 'gender', snap.months()], mask=snap.mask(date_from=start_date))
+            events, genders, months_ = g['keys']
+            monthly += [(e, gd, f"{1970 + m // 12}/{m % 12 + 1:02d}", avg) for e, gd, m, avg in
+                        zip(snap.decode('event', events), snap.decode('gender', genders), months_.tolist(), g['mean'].tolist())]
+            continue
+        monthly += session.query(
+            Score.event_name, 
+            Player.gender, 
+            func.strftime('%Y/%m', Score.date).label('m'), 
+            func.avg(Score.total)
+        ).join(Player).filter(
+            Score.date >= start_date  # ★ここで期間を制限
+        ).group_by(
+            Score.event_name, Player.gender, 'm'
+        ).order_by('m').all()
+
+    temp = {e:{} for e in target_events}
+    months = set()
+    for e, g, m, avg in monthly:
+        if e in target_events and g in ['男','女']:
+            if m not in temp[e]: temp[e][m] = {'男':None,'女':None}
+            temp[e][m][g] = round(avg,1)
+            months.add(m)
+    sorted_months = sorted(list(months))
+    
+    for e in target_events:
+        chart_data[e]['labels'] = sorted_months
+        for m in sorted_months:
+            val = temp[e].get(m, {})
+            chart_data[e]['male'].append(val.get('男'))
+            chart_data[e]['female'].append(val.get('女'))
+
+    return chart_data
+
+def downsample_series(dates, count, sums, mins, maxs, budget):
+    """日付順の系列を budget 点以下にまとめる。連続する区間ごとに件数・合計・最小・最大を集計し、
+    区間の最初の日付を代表にする (引数・戻り値は NumPy 配列)"""
+    import numpy as np
+    n = len(dates)
+    if n <= budget: return dates, count, sums, mins, maxs
+    starts = np.arange(budget) * n // budget
+    return (dates[starts], np.add.reduceat(count, starts), np.add.reduceat(sums, starts),
+            np.minimum.reduceat(mins, starts), np.maximum.reduceat(maxs, starts))
+
+def player_chart_data(player):
+    """選手詳細: 種目ごとのスコア推移と、性別に応じたチーム目標。
+    同じ日の記録は平均・最小・最大・件数にまとめ、CHART_POINT_BUDGET 点を超える分は期間ごとにまとめる"""
+    import numpy as np
+    # アーカイブ済みの年度から古い順に読むので、種目ごとの並びも日付順になる
+    rows = []
+    for session in score_sessions(player_years(player.id)):
+        if app.config['COLUMNAR_SNAPSHOT'] and session is db.session:
+            snap = get_score_snapshot()
+            agg = snap.group_by(['event', 'date'], mask=snap.mask(player_id=player.id))
+            rows += zip(snap.decode('event', agg['keys'][0]), agg['keys'][1].tolist(),
+                        agg['count'].tolist(), agg['sum'].tolist(), agg['min'].tolist(), agg['max'].tolist())
+            continue
+        agg = session.query(
+            Score.event_name, Score.date, func.count(Score.id), func.sum(Score.total), func.min(Score.total), func.max(Score.total)
+        ).filter(Score.player_id == player.id).group_by(Score.event_name, Score.date).order_by(Score.event_name, Score.date).all()
+        rows += [(e, d.toordinal(), c, sm, mn, mx) for e, d, c, sm, mn, mx in agg]
+
+    by_event = {}
+    for e, *values in rows:
+        by_event.setdefault(e or '', []).append(values)
+
+    event_colors = {
+        'AR60':   'rgba(218, 165, 32, 1)',
+        'SB3x20': 'rgba(0, 100, 0, 1)',
+        'P60':    'rgba(184, 0, 163, 1)',
+        'AP60':   'rgba(13, 0, 255, 1)',
+        'BP':     'rgba(108, 92, 231, 1)'
+    }
+    fallback_colors = ['rgba(54, 162, 235, 1)', 'rgba(255, 99, 132, 1)', 'rgba(75, 192, 192, 1)']
+
+    # 種目の並びはページ上のタブと同じ順にする
+    graph_datasets = []
+    for i, event_name in enumerate(sort_events_filter(by_event.keys())):
+        cols = np.array(by_event[event_name], dtype=float).T  # 日付順 (日付, 件数, 合計, 最小, 最大)
+        dates, count, sums, mins, maxs = downsample_series(*cols, app.config['CHART_POINT_BUDGET'])
+        color = event_colors.get(event_name, fallback_colors[i % len(fallback_colors)])
+        graph_datasets.append({
+            'label': event_name,
+            'labels': [datetime.fromordinal(int(d)).strftime('%Y/%m/%d') for d in dates],
+            'data': np.round(sums / count, 2).tolist(),
+            'min': mins.tolist(), 'max': maxs.tolist(), 'count': count.astype(int).tolist(),
+            'borderColor': color, 'backgroundColor': color.replace('1)', '0.1)'),
+        })
+
+    goals_query = TeamGoal.query.filter_by(gender=player.gender).all()
+    player_goals = {g.event_name: g.target_score for g in goals_query}
+    return {'datasets': graph_datasets, 'goals': player_goals, 'gender': player.gender}
+
+def match_years_chart_data(match_name):
+    """大会の年度一覧: Regularの団体合計点の年度推移"""
+    is_sokeisen = '早慶戦' in match_name
+    # 年度×種目(×性別) ごとの合計を集計する (早慶戦は男女混合)
+    if app.config['COLUMNAR_SNAPSHOT']:
+        snap = get_score_snapshot()
+        g = snap.group_by([snap.academic_years(), 'event'] + ([] if is_sokeisen else ['gender']),
+                          mask=snap.mask(match=match_name, category='Regular'))
+        columns = [g['keys'][0].tolist(), snap.decode('event', g['keys'][1])]
+        if not is_sokeisen: columns.append(snap.decode('gender', g['keys'][2]))
+        totals = zip(*columns, g['sum'].tolist())
+    else:
+        group = [Score.academic_year, Score.event_name] + ([] if is_sokeisen else [Player.gender])
+        totals = db.session.query(*group, func.sum(Score.total)).join(Player) \
+            .filter(Score.match_name == match_name, Score.category == 'Regular').group_by(*group).all()
+
+    # { 2024: {'AR60 男': 1850.5, ...}, 2023: ... }
+    history_data = {}
+    for ay, event_name, *gender, total in totals:
+        history_data.setdefault(ay, {})[team_key(match_name, event_name, gender[0] if gender else None)] = round(total, 1)
+    # アーカイブ済みの年度は大会ごとの集計から
+    for ay, team_totals in db.session.query(SeasonMatchSummary.academic_year, SeasonMatchSummary.team_totals) \
+            .filter(SeasonMatchSummary.match_name == match_name):
+        for key, total in json.loads(team_totals):
+            history_data.setdefault(ay, {})[key] = round(total, 1)
+
+    # --- グラフ用データセットの作成 ---
+    # 年度の昇順 (グラフは左から右へ時系列)
+    sorted_years_graph = sorted(history_data.keys())
+    
+    # 全てのキー(種目+性別)を抽出
+    all_keys = set()
+    for y in history_data:
+        for k in history_data[y]:
+            all_keys.add(k)
+    sorted_keys = sorted(list(all_keys)) # AR60 女, AR60 男... の順
+    
+    chart_datasets = []
+    
+    for key in sorted_keys:
+        # データ配列作成 (該当年になければ null)
+        data_list = []
+        for y in sorted_years_graph:
+            data_list.append(history_data[y].get(key, None))
+        
+        # 色設定
+        color = '#636e72'
+        if 'AR60' in key: color = 'rgba(218, 165, 32, 1)' # Gold
+        elif 'SB3x20' in key: color = 'rgba(0, 100, 0, 1)' # DarkGreen
+        elif 'P60' in key: color = 'rgba(184, 0, 163, 1)' # Purple
+        
+        # 線種設定 (女子は点線)
+        border_dash = []
+        if '女' in key:
+            border_dash = [5, 5] # 5px線, 5px空白 の繰り返し
+            
+        chart_datasets.append({
+            'label': key,
+            'data': data_list,
+            'borderColor': color,
+            'backgroundColor': color, # 点の色
+            'borderDash': border_dash, # ★ここで点線を指定
+            'fill': False,
+            'tension': 0, # 直線
+            'spanGaps': True
+        })
+
+    return {'labels': sorted_years_graph, 'datasets': chart_datasets}
+
+def json_chart_response(compute):
+    """グラフ用JSONを返す。ETagはデータバージョンから作るので、
+    データが変わっていなければ集計せずに 304 を返す。gzip対応。"""
+    version = current_data_version()
+    use_gzip = request.accept_encodings['gzip'] > 0
+    etag = f"v{version}-{hashlib.sha1(request.full_path.encode('utf-8')).hexdigest()[:12]}" + ('-gz' if use_gzip else '')
+
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        data = result_cache.get_or_compute(repr(('json', request.full_path, version)), compute)
+        body = json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+        resp = Response(body, mimetype='application/json')
+        if use_gzip and len(body) > 512:
+            resp.set_data(gzip.compress(body, compresslevel=6))
+            resp.headers['Content-Encoding'] = 'gzip'
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'  # 毎回ETagで確認する
+    resp.vary.add('Accept-Encoding')
+    return resp
+
+# ---------------------------------------------------------
+# 団体メンバーの選考 (調子の計算と組み合わせの選択は lineup.py)
+# ---------------------------------------------------------
+_lineup_forms = {}  # {(種目, 年度, データバージョン): lineup.FormTable}
+
+def team_events(match_name):
+    """団体戦の種目 (大会結果ページの団体戦と同じ)"""
+    return ['AR60', 'SB3x20', 'P60'] if '早慶戦' in match_name else ['AR60', 'SB3x20']
+
+def get_lineup_form(event_name, year):
+    """year 年度の選考に使う選手ごとの調子。在籍期間 (4年度) の成績から作り、スコア更新までキャッシュする
+    (アーカイブ済みの年度はこの期間にかかるファイルだけを読む)"""
+    import lineup
+    import numpy as np
+    version = current_data_version()
+    form = _lineup_forms.get((event_name, year, version))
+    if form is None:
+        start, end = datetime(year - 3, 4, 1).date(), datetime(year + 1, 3, 31).date()
+        parts = []  # [(選手id, 日付の序数, 合計), ...]
+        for session in score_sessions(set(range(year - 3, year + 1))):
+            if app.config['COLUMNAR_SNAPSHOT'] and session is db.session:
+                snap = get_score_snapshot()
+                m = snap.mask(event=event_name, date_from=start, date_to=end) & ~np.isnan(snap.cols['total'])
+                parts.append((snap.cols['player_id'][m], snap.cols['date'][m], snap.cols['total'][m]))
+                continue
+            rows = session.query(Score.player_id, Score.date, Score.total).filter(
+                Score.event_name == event_name, Score.date >= start, Score.date <= end, Score.total.isnot(None)).all()
+            if rows:
+                pids, dates, totals = zip(*rows)
+                parts.append((pids, [d.toordinal() for d in dates], totals))
+        cols = [np.concatenate([np.asarray(p[i]) for p in parts]) if parts else [] for i in range(3)]
+        form = lineup.compute_form(*cols, app.config['LINEUP_HALF_LIFE_DAYS'])
+        for k in [k for k in _lineup_forms if k[2] != version]: _lineup_forms.pop(k, None)
+        _lineup_forms[(event_name, year, version)] = form
+    return form
+
+def select_lineup(match_name, event_name, gender='男', year=None, size=None, objective='expected', target=None, exclude=()):
+    """大会・種目・性別 (早慶戦は男女混合) の団体メンバーを、その年度に在籍している選手から選ぶ。
+    objective: 'expected' (合計点の期待値が最大) / 'goal' (目標点を超える確率が最大)。
+    target を省くと チーム目標 (TeamGoal) を使う。不正な条件は ValueError
+    戻り値: {'candidates': [選手, ...] (調子の良い順), 'teams': [組み合わせ, ...] (先頭が最適), 'target', ...}"""
+    import lineup
+    import numpy as np
+    mixed = '早慶戦' in match_name
+    year = year or academic_year(datetime.now().date())
+    size = size or app.config['LINEUP_SIZE']
+    if event_name not in team_events(match_name): raise ValueError(f'{match_name} の団体戦に {event_name} はありません')
+    if not mixed and gender not in ('男', '女'): raise ValueError('性別は 男 か 女 を指定してください')
+    if objective not in ('expected', 'goal'): raise ValueError('objective は expected か goal です')
+    if not 1 <= size <= 10: raise ValueError('人数は 1〜10 で指定してください')
+    if target is None and not mixed:
+        target = db.session.query(TeamGoal.target_score).filter_by(event_name=event_name, gender=gender).scalar()
+    if objective == 'goal' and target is None: raise ValueError('目標点を指定してください')
+
+    q = db.session.query(Player.id, Player.name, Player.gender, Player.entry_year) \
+        .filter(db.or_(Player.entry_year.is_(None), Player.entry_year.between(year - 3, year)))
+    if not mixed: q = q.filter(Player.gender == gender)
+    players = {r[0]: r for r in q}
+    excluded = [{'id': pid, 'name': players.pop(pid)[1]} for pid in sorted(exclude) if pid in players]
+    form = get_lineup_form(event_name, year)
+    pos, ids = form.take(sorted(players))
+    order = np.argsort(-form.mean[pos], kind='stable')  # 調子の良い順
+    pos, ids = pos[order], ids[order]
+    candidates = [{
+        'id': pid, 'name': players[pid][1], 'gender': players[pid][2], 'entry_year': players[pid][3],
+        'mean': round(float(form.mean[p]), 1), 'std': round(float(form.std[p]), 1),
+        'count': int(form.count[p]), 'n_eff': round(float(form.n_eff[p]), 1),
+        'last': datetime.fromordinal(int(form.last[p])).date().isoformat(),
+    } for pid, p in zip(ids.tolist(), pos.tolist())]
+
+    teams = []
+    for team in lineup.select_team(form.mean[pos], form.std[pos], size, target, objective, app.config['LINEUP_ALTERNATIVES']):
+        teams.append({'members': [candidates[i] for i in team['members']],
+                      'expected': round(team['expected'], 1), 'std': round(team['std'], 1),
+                      'probability': round(team['probability'], 3) if team['probability'] is not None else None})
+    return {'match_name': match_name, 'event_name': event_name, 'gender': None if mixed else gender, 'mixed': mixed,
+            'year': year, 'size': size, 'objective': objective, 'target': target, 'excluded': excluded,
+            'half_life': app.config['LINEUP_HALF_LIFE_DAYS'], 'candidates': candidates, 'teams': teams}
+
+# ---------------------------------------------------------
+# 成績の一括編集・削除 (1トランザクションで適用し、集計やキャッシュの更新は1回だけ行う)
+# ---------------------------------------------------------
+SERIES_FIELDS = [f's{i}' for i in range(1, 7)]
+SERIES_MAX = 110.0  # 1シリーズの上限 (小数点採点で 10.9 × 10 = 109.0)
+
+class ScoreBatchError(Exception):
+    """一括編集の内容に誤りがある (1件も書き込んでいない)。errors は [(対象, 理由), ...]"""
+    def __init__(self, errors):
+        super().__init__(f'{len(errors)}件のエラー')
+        self.errors = errors
+
+def _parse_score_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def apply_score_batch(edits=(), deletes=()):
+    """成績の編集 ([{'id', 's1'〜's6', 'shots'}, ...]) と削除 ([id, ...]) をまとめて適用する。
+    shots (60射の明細) を指定すると S1〜S6 は明細から計算し、空文字なら明細を消す。
+    指定しない場合、点数が変わった成績の明細は合わなくなるので消す。
+    合計は S1〜S6 から計算し直す。先にすべて検証し、誤りがあれば何も書き込まずに ScoreBatchError。
+    戻り値: {'updated': 件数, 'unchanged': 件数, 'deleted': 件数}"""
+    import shots
+    errors, parsed, delete_ids = [], {}, set()
+    new_shots = {}  # {id: 明細のBLOB (b'' は削除)}
+    for n, item in enumerate(edits, start=1):
+        sid = _parse_score_id(item.get('id') if isinstance(item, dict) else None)
+        if sid is None:
+            errors.append((f'編集{n}件目', 'id がありません'))
+            continue
+        if sid in parsed:
+            errors.append((f'id={sid}', '同じ成績が複数回指定されています'))
+            continue
+        raw_shots = item.get('shots')
+        if raw_shots is not None:
+            if not isinstance(raw_shots, (str, list)):
+                errors.append((f'id={sid}', '明細は文字列かリストで指定してください'))
+                continue
+            if not raw_shots or (isinstance(raw_shots, str) and not raw_shots.strip()):
+                new_shots[sid] = b''
+            else:
+                try:
+                    packed = shots.parse_shots(raw_shots)
+                except ValueError as e:
+                    errors.append((f'id={sid}', f'明細: {e}'))
+                    continue
+                new_shots[sid] = shots.pack(packed)
+                parsed[sid] = dict(zip(SERIES_FIELDS, shots.series_totals(packed)[0].tolist()))
+                continue
+        values = {}
+        for field in SERIES_FIELDS:
+            raw = item.get(field, 0)
+            try:
+                v = float(raw if raw not in (None, '') else 0)
+            except (TypeError, ValueError):
+                errors.append((f'id={sid}', f'{field.upper()} が数値ではありません'))
+                break
+            if not 0 <= v <= SERIES_MAX:
+                errors.append((f'id={sid}', f'{field.upper()} は 0〜{SERIES_MAX:g} の範囲で指定してください'))
+                break
+            values[field] = v
+        else:
+            parsed[sid] = values
+    for raw in deletes:
+        sid = _parse_score_id(raw)
+        if sid is None: errors.append((f'削除 {raw!r}', 'id が整数ではありません'))
+        else: delete_ids.add(sid)
+    for sid in sorted(delete_ids & parsed.keys()):
+        errors.append((f'id={sid}', '編集と削除の両方に指定されています'))
+
+    # 対象の成績を500件ずつまとめて読み込む
+    ids = sorted(parsed.keys() | delete_ids)
+    current = {}
+    for i in range(0, len(ids), 500):
+        rows = db.session.query(Score.id, Score.player_id, Score.event_name, Score.academic_year, *[getattr(Score, f) for f in SERIES_FIELDS]) \
+            .filter(Score.id.in_(ids[i:i + 500])).all()
+        current.update((r[0], r) for r in rows)
+    missing = [sid for sid in ids if sid not in current]
+    archived = archived_score_ids(missing) if missing else set()
+    errors.extend((f'id={sid}', 'アーカイブ済みの年度の成績は編集・削除できません' if sid in archived else '成績が見つかりません')
+                  for sid in missing)
+    if errors: raise ScoreBatchError(errors)
+
+    edit_ids = sorted(parsed)
+    current_shots = {}
+    for i in range(0, len(edit_ids), 500):
+        current_shots.update(db.session.query(ScoreShots.score_id, ScoreShots.shots)
+                             .filter(ScoreShots.score_id.in_(edit_ids[i:i + 500])).all())
+    changed, shot_changes = {}, {}  # shot_changes: {id: 明細のBLOB または None (削除)}
+    for sid, v in parsed.items():
+        series_changed = tuple(current[sid][4:]) != tuple(v[f] for f in SERIES_FIELDS)
+        old = current_shots.get(sid)
+        new = new_shots.get(sid, None if series_changed else old) or None
+        if series_changed or new != old:
+            changed[sid] = v
+            if new != old: shot_changes[sid] = new
+    result = {'updated': len(changed), 'unchanged': len(parsed) - len(changed), 'deleted': len(delete_ids)}
+    if not changed and not delete_ids: return result
+
+    version = bump_data_version()
+    if changed:
+        stmt = Score.__table__.update().where(Score.__table__.c.id == bindparam('score_id')) \
+            .values(total=bindparam('new_total'), row_version=version, **{f: bindparam(f'new_{f}') for f in SERIES_FIELDS})
+        db.session.execute(stmt, [
+            {'score_id': sid, 'new_total': round(sum(v.values()), 1), **{f'new_{f}': v[f] for f in SERIES_FIELDS}}
+            for sid, v in changed.items()])
+    delete_list = sorted(delete_ids)
+    for i in range(0, len(delete_list), 500):
+        db.session.execute(Score.__table__.delete().where(Score.__table__.c.id.in_(delete_list[i:i + 500])))
+    save_score_shots([(sid, blob) for sid, blob in shot_changes.items() if blob is not None])
+    delete_score_shots([sid for sid, blob in shot_changes.items() if blob is None] + delete_list)
+    refresh_stats([current[sid][1:4] for sid in list(changed) + delete_list])
+    db.session.commit()
+    invalidate_rank_index()
+    return result
+
+def score_batch_message(result):
+    return f"更新 {result['updated']}件 / 変更なし {result['unchanged']}件 / 削除 {result['deleted']}件"
+
+# ---------------------------------------------------------
+# エクスポート (アップロードと同じ列構成で、絞り込んだ成績を少しずつ出力する)
+# ---------------------------------------------------------
+EXPORT_COLUMNS = ['日付', '大会名', '識別', '選手名', '性別', '入部年度', '種目'] + SERIES_COLS + ['合計', '明細']
+EXPORT_FORMATS = {  # 形式: (拡張子, MIMEタイプ)
+    'csv': ('csv', 'text/csv'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('arrows', 'application/vnd.apache.arrow.stream'),
+}
+
+def _parse_export_date(value):
+    for fmt in ('%Y-%m-%d', '%Y/%m/%d'):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f'日付の形式が不正です: {value} (YYYY-MM-DD)')
+
+def export_statement(args):
+    """絞り込み条件 (player_id, event (複数可), match, date_from, date_to) から SELECT を作る。不正な条件は ValueError"""
+    stmt = db.select(Score.date, Score.match_name, Score.category, Player.name, Player.gender, Player.entry_year,
+                     Score.event_name, Score.s1, Score.s2, Score.s3, Score.s4, Score.s5, Score.s6, Score.total,
+                     ScoreShots.shots) \
+        .join(Player, Score.player_id == Player.id).outerjoin(ScoreShots, ScoreShots.score_id == Score.id)
+    if args.get('player_id'):
+        try:
+            stmt = stmt.where(Score.player_id == int(args['player_id']))
+        except ValueError:
+            raise ValueError(f"player_id が不正です: {args['player_id']}")
+    events = [e for e in args.getlist('event') if e]
+    if events: stmt = stmt.where(Score.event_name.in_(events))
+    if args.get('match'): stmt = stmt.where(Score.match_name == args['match'])
+    if args.get('date_from'): stmt = stmt.where(Score.date >= _parse_export_date(args['date_from']))
+    if args.get('date_to'): stmt = stmt.where(Score.date <= _parse_export_date(args['date_to']))
+    return stmt.order_by(Score.date, Score.id)
+
+def _export_batches(stmt):
+    """サーバー側カーソルから EXPORT_BATCH_SIZE 行ずつ取り出す (アーカイブ済みの年度のファイルから古い順に)"""
+    for session in score_sessions():
+        result = session.execute(stmt.execution_options(yield_per=app.config['EXPORT_BATCH_SIZE']))
+        try:
+            for rows in result.partitions():
+                yield rows
+        finally:
+            result.close()
+
+def export_csv(stmt, encoding):
+    """CSVをバッチごとにエンコードして返すジェネレータ (アップロードでそのまま取り込める形式)"""
+    import shots
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\r\n')
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in _export_batches(stmt):
+        for r in rows:
+            writer.writerow([r[0].strftime('%Y/%m/%d')] + list(r[1:-1]) + [shots.format_shots(r[-1], ' ') if r[-1] else ''])
+        yield buf.getvalue().encode(encoding, errors='replace')  # cp932 で表せない文字は ? になる
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell(): yield buf.getvalue().encode(encoding, errors='replace')
+
+class _StreamSink(io.RawIOBase):
+    """pyarrow の書き込み先。書かれたバイト列を溜めておき、drain() で取り出す"""
+    def __init__(self):
+        super().__init__()
+        self._chunks, self._pos = [], 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self):
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+def export_arrow(stmt, fmt):
+    """Parquet (バッチごとに1行グループ) または Arrow IPC ストリームを返すジェネレータ。pyarrow が必要"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import shots
+    schema = pa.schema(
+        [('日付', pa.date32())] + [(c, pa.string()) for c in ['大会名', '識別', '選手名', '性別']]
+        + [('入部年度', pa.int32()), ('種目', pa.string())] + [(c, pa.float64()) for c in SERIES_COLS + ['合計']]
+        + [('明細', pa.string())])
+    sink = _StreamSink()
+    writer = pq.ParquetWriter(sink, schema) if fmt == 'parquet' else pa.ipc.new_stream(sink, schema)
+    for rows in _export_batches(stmt):
+        columns = list(zip(*rows))
+        columns[-1] = [shots.format_shots(blob, ' ') if blob else None for blob in columns[-1]]
+        writer.write_batch(pa.record_batch([pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+# ---------------------------------------------------------
+# バックアップ / 復元 (SQLite のオンラインバックアップAPI)
+# ---------------------------------------------------------
+# スナップショット: instance/backups/snapshot-<日時>-v<データバージョン>.db.gz (+ 同名の .json にメタ情報)
+# 差分: incremental-<日時>-v<バージョン>.db.gz。基準のスナップショットより後に変わった score の行 (と明細) と、
+#       player / team_goal / アーカイブの一覧と集計の全行、現在の score の id 一覧 (削除の検出用) を入れたSQLiteファイル。
+#       (アーカイブ済みの年度の成績は ARCHIVE_DIR のファイルにあり、バックアップには含まない)
+ARCHIVE_INDEX_TABLES = ('season_archive', 'season_match_summary')
+BACKUP_REQUIRED_COLUMNS = {  # 復元できるDBに最低限必要な列 (足りない列はマイグレーションで追加する)
+    'player': {'id', 'name', 'gender', 'entry_year'},
+    'score': {'id', 'player_id', 'date', 'match_name', 'category', 'event_name',
+              's1', 's2', 's3', 's4', 's5', 's6', 'total'},
+    'team_goal': {'id', 'event_name', 'gender', 'target_score'},
+}
+
+class BackupError(Exception):
+    pass
+
+def _backup_dir():
+    path = app.config['BACKUP_DIR'] or os.path.join(app.instance_path, 'backups')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _db_file():
+    return db.engines[None].url.database
+
+def _sqlite_connect(path):
+    conn = sqlite3.connect(path, timeout=app.config['SQLITE_BUSY_TIMEOUT'] / 1000)
+    conn.isolation_level = None
+    return conn
+
+def _gzip_file(src, dest):
+    """src を少しずつ読みながら gzip で dest に書く (一時ファイルを経由して置き換える)"""
+    tmp = dest + '.tmp'
+    with open(src, 'rb') as f_in, gzip.open(tmp, 'wb', compresslevel=6) as f_out:
+        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+    os.replace(tmp, dest)
+
+def _gunzip_to(src, dest):
+    """gzip なら展開し、そうでなければそのままコピーする"""
+    with open(src, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+    opener = gzip.open if compressed else open
+    with opener(src, 'rb') as f_in, open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+
+def list_backups():
+    """保存済みのバックアップのメタ情報 (新しい順)"""
+    out = []
+    for name in os.listdir(_backup_dir()):
+        if not name.endswith('.json'): continue
+        try:
+            with open(os.path.join(_backup_dir(), name), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if os.path.exists(os.path.join(_backup_dir(), meta['file'])): out.append(meta)
+    return sorted(out, key=lambda m: m['created_at'], reverse=True)
+
+def _find_backup(name):
+    for meta in list_backups():
+        if name in (meta['name'], meta['file']): return meta
+    raise BackupError(f'バックアップが見つかりません: {name}')
+
+def _rotate_backups(kind):
+    for meta in [m for m in list_backups() if m['kind'] == kind][app.config['BACKUP_KEEP']:]:
+        for path in (meta['file'], meta['name'] + '.json'):
+            try:
+                os.remove(os.path.join(_backup_dir(), path))
+            except OSError:
+                pass
+
+def _write_backup(kind, tmp_db, extra):
+    """一時DBファイルを圧縮して保存し、メタ情報を返す"""
+    conn = _sqlite_connect(tmp_db)
+    try:
+        version = conn.execute('SELECT version FROM data_version WHERE id = 1').fetchone()
+        scores = conn.execute('SELECT COUNT(*) FROM score').fetchone()[0]
+    finally:
+        conn.close()
+    version = version[0] if version else 0
+    now = datetime.now()
+    name = f"{kind}-{now.strftime('%Y%m%d-%H%M%S-%f')}-v{version}"
+    meta = dict(name=name, file=name + '.db.gz', kind=kind, created_at=now.isoformat(),
+                data_version=version, scores=scores, **extra)
+    _gzip_file(tmp_db, os.path.join(_backup_dir(), meta['file']))
+    meta['size'] = os.path.getsize(os.path.join(_backup_dir(), meta['file']))
+    with open(os.path.join(_backup_dir(), name + '.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    _rotate_backups(kind)
+    return meta
+
+def create_snapshot():
+    """DB全体の一貫したスナップショットを作る。WALモードではコピー中も読み書きを止めない
+    (pages=-1 で1回の読み込みトランザクションの中でコピーする)。"""
+    tmp = os.path.join(_backup_dir(), f'.tmp-{uuid.uuid4().hex}.db')
+    src, dest = _sqlite_connect(_db_file()), _sqlite_connect(tmp)
+    try:
+        src.backup(dest, pages=-1)
+        user_version = dest.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        src.close()
+        dest.close()
+    try:
+        return _write_backup('snapshot', tmp, {'user_version': user_version})
+    finally:
+        os.remove(tmp)
+
+def latest_snapshot():
+    """現在のデータバージョンのスナップショットがあればそれを、なければ新しく作って返す"""
+    snapshots = [m for m in list_backups() if m['kind'] == 'snapshot']
+    if snapshots and snapshots[0]['data_version'] == current_data_version():
+        return snapshots[0]
+    return create_snapshot()
+
+def create_incremental(base_name):
+    """base のスナップショットより後に登録・修正された成績だけを書き出す"""
+    base = _find_backup(base_name)
+    if base['kind'] != 'snapshot': raise BackupError('差分の基準にはスナップショットを指定してください')
+    tmp = os.path.join(_backup_dir(), f'.tmp-{uuid.uuid4().hex}.db')
+    conn = _sqlite_connect(_db_file())
+    try:
+        conn.execute('ATTACH DATABASE ? AS inc', (tmp,))
+        conn.execute('BEGIN')  # 以下は同じ時点のデータを読む
+        conn.execute('CREATE TABLE inc.score AS SELECT * FROM main.score WHERE row_version > ?', (base['data_version'],))
+        conn.execute('CREATE TABLE inc.score_shots AS SELECT * FROM main.score_shots WHERE score_id IN (SELECT id FROM inc.score)')
+        for table in ('player', 'team_goal', 'data_version') + ARCHIVE_INDEX_TABLES:
+            conn.execute(f'CREATE TABLE inc.{table} AS SELECT * FROM main.{table}')
+        conn.execute('CREATE TABLE inc.live_score_id AS SELECT id FROM main.score')
+        conn.execute('CREATE TABLE inc.backup_meta (key TEXT PRIMARY KEY, value TEXT)')
+        conn.executemany('INSERT INTO inc.backup_meta VALUES (?, ?)', [
+            ('kind', 'incremental'), ('base', base['name']), ('base_data_version', str(base['data_version']))])
+        changed = conn.execute('SELECT COUNT(*) FROM inc.score').fetchone()[0]
+        conn.execute('COMMIT')
+        conn.execute('DETACH DATABASE inc')
+    finally:
+        conn.close()
+    try:
+        return _write_backup('incremental', tmp, {'base': base['name'], 'changed_scores': changed})
+    finally:
+        os.remove(tmp)
+
+def _apply_incremental(inc_path, work_path):
+    """差分ファイルを基準のスナップショットに当てた完全なDBを work_path に作る"""
+    conn = _sqlite_connect(inc_path)
+    try:
+        base_name = dict(conn.execute('SELECT key, value FROM backup_meta'))['base']
+    finally:
+        conn.close()
+    _gunzip_to(os.path.join(_backup_dir(), _find_backup(base_name)['file']), work_path)
+    conn = _sqlite_connect(work_path)
+    try:
+        conn.execute('ATTACH DATABASE ? AS inc', (inc_path,))
+        def has_table(db_name, table):
+            return conn.execute(f"SELECT 1 FROM {db_name}.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+        tables = ['player', 'team_goal', 'data_version']
+        for model in (SeasonArchive, SeasonMatchSummary):  # アーカイブの機能を追加する前のバックアップにはない
+            table = model.__tablename__
+            if not has_table('inc', table): continue
+            if not has_table('main', table):
+                conn.execute(str(CreateTable(model.__table__).compile(dialect=db.engines[None].dialect)))
+            tables.append(table)
+        columns = {}
+        for table in ['score'] + tables:
+            base_cols = [row[1] for row in conn.execute(f'PRAGMA main.table_info({table})')]
+            inc_cols = [row[1] for row in conn.execute(f'PRAGMA inc.table_info({table})')]
+            if set(base_cols) != set(inc_cols):
+                raise BackupError(f'基準のスナップショットと {table} テーブルの列が違うため差分を適用できません')
+            columns[table] = ', '.join(inc_cols)
+        has_shots = {db_name: has_table(db_name, 'score_shots') for db_name in ('main', 'inc')}
+        conn.execute('BEGIN')
+        conn.execute('DELETE FROM score WHERE id NOT IN (SELECT id FROM inc.live_score_id)')
+        for table in tables:
+            conn.execute(f'DELETE FROM main.{table}')
+            conn.execute(f'INSERT INTO main.{table} ({columns[table]}) SELECT {columns[table]} FROM inc.{table}')
+        conn.execute(f"INSERT OR REPLACE INTO main.score ({columns['score']}) SELECT {columns['score']} FROM inc.score")
+        if has_shots['inc'] and not has_shots['main']:  # 明細を追加する前のスナップショットが基準
+            conn.execute(str(CreateTable(ScoreShots.__table__).compile(dialect=db.engines[None].dialect)))
+            has_shots['main'] = True
+        if has_shots['main']:  # 変わった成績の明細は差分の内容に置き換える (差分に明細がなければ消す)
+            conn.execute('DELETE FROM main.score_shots WHERE score_id NOT IN (SELECT id FROM inc.live_score_id) '
+                         'OR score_id IN (SELECT id FROM inc.score)')
+            if has_shots['inc']:
+                conn.execute('INSERT INTO main.score_shots (score_id, shots) SELECT score_id, shots FROM inc.score_shots')
+        conn.execute('COMMIT')
+        conn.execute('DETACH DATABASE inc')
+    finally:
+        conn.close()
+
+def _validate_backup_db(path):
+    """復元できるDBか確認する。問題があれば BackupError"""
+    try:
+        conn = _sqlite_connect(path)
+        try:
+            if conn.execute('PRAGMA quick_check').fetchone()[0] != 'ok':
+                raise BackupError('DBファイルが壊れています (quick_check)')
+            user_version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for table, required in BACKUP_REQUIRED_COLUMNS.items():
+                columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+                if not columns: raise BackupError(f'{table} テーブルがありません')
+                if required - columns: raise BackupError(f"{table} テーブルに列がありません: {', '.join(sorted(required - columns))}")
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        raise BackupError(f'SQLiteのDBファイルではありません: {e}')
+    if user_version > MIGRATIONS[-1][0]:
+        raise BackupError(f'このアプリより新しいスキーマのDBです (user_version={user_version})')
+
+def restore_backup(path, label=None):
+    """バックアップ (スナップショット / 差分 / 素の shooting.db、gzip可) から復元する。
+    現在のDBは先にスナップショットを取っておく。差し替えはバックアップAPIで現在のDBへ
+    書き込むので、他のワーカーの接続からも1回のコミットで切り替わって見える。"""
+    work = os.path.join(_backup_dir(), f'.restore-{uuid.uuid4().hex}.db')
+    inc = work + '.inc'
+    try:
+        _gunzip_to(path, work)
+        try:
+            conn = _sqlite_connect(work)
+            is_incremental = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'backup_meta'").fetchone() is not None
+            conn.close()
+        except sqlite3.DatabaseError as e:
+            raise BackupError(f'SQLiteのDBファイルではありません: {e}')
+        if is_incremental:
+            os.replace(work, inc)
+            _apply_incremental(inc, work)
+        _validate_backup_db(work)
+
+        with _import_writer_lock:
+            safety = create_snapshot()
+            # キャッシュや列スナップショットが古いデータを返さないよう、バージョンは今より先に進める
+            next_version = current_data_version() + 1
+            db.session.remove()
+            conn = _sqlite_connect(work)
+            try:
+                conn.execute('CREATE TABLE IF NOT EXISTS data_version (id INTEGER PRIMARY KEY, version INTEGER NOT NULL)')
+                conn.execute('INSERT OR REPLACE INTO data_version (id, version) VALUES (1, ?)', (next_version,))
+                live = _sqlite_connect(_db_file())
+                try:
+                    conn.backup(live, pages=-1)
+                finally:
+                    live.close()
+            finally:
+                conn.close()
+
+            # 復元したDBを今のスキーマに合わせ、集計を作り直す
+            db.create_all()
+            migrate_db()
+            version = bump_data_version()
+            db.session.execute(Score.__table__.update().values(row_version=version))
+            ImportJob.query.filter(ImportJob.status.in_(['queued', 'running'])).update(
+                {'status': 'failed', 'message': 'バックアップから復元したため中止しました'}, synchronize_session=False)
+            rebuild_stats()
+            db.session.commit()
+            invalidate_rank_index()
+        return {'restored_from': label or os.path.basename(path), 'incremental': is_incremental,
+                'scores': Score.query.count(), 'data_version': version, 'safety_snapshot': safety['name']}
+    finally:
+        for p in (work, inc):
+            if os.path.exists(p): os.remove(p)
+
+@app.cli.command('backup')
+def backup_command():
+    """スナップショットを作成する (cron などから定期実行する想定)"""
+    meta = create_snapshot()
+    print(f"{meta['file']} ({meta['scores']}件, {meta['size'] / 1024 / 1024:.1f}MB)")
+
+# ---------------------------------------------------------
+# 締めた年度のアーカイブ (年度ごとの読み込み専用DBファイル)
+# ---------------------------------------------------------
+# flask archive-seasons 2021 で 2021年度までの成績を ARCHIVE_DIR/season-<年度>-<日時>.db へ移し、
+# shooting.db からは消す。選手×種目×年度の集計 (player_event_stat) と大会ごとの集計 (season_match_summary)
+# は shooting.db に残すので、順位表・ダッシュボード・大会一覧はファイルを開かない。
+# 選手ページ・大会結果・グラフ・エクスポートは必要な年度のファイルを別の接続で開いて読む
+# (ATTACH はトランザクションの中でできず、同時に付けられる数にも上限があるため)。
+# アーカイブ済みの年度より古い成績は shooting.db に残さない (アーカイブは古い年度から順に行い、
+# 取り込みでもその年度の成績は受け付けない) ので、年度ごとに分けて読んだ結果は日付順に並べるだけでよい。
+# ファイルは作った後は変更しない。バックアップ (shooting.db) とは別に保管すること。
+ARCHIVE_TABLES = [Player, Score, ScoreShots, PlayerEventStat]  # アーカイブのファイルに入れるテーブル
+
+class ArchiveError(Exception):
+    pass
+
+def _archive_dir():
+    path = app.config['ARCHIVE_DIR'] or os.path.join(app.instance_path, 'archive')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def team_key(match_name, event_name, gender):
+    """団体の区分 (例: AR60 男。早慶戦は男女混合なので種目だけ)"""
+    return event_name if '早慶戦' in (match_name or '') else f'{event_name} {gender}'
+
+_archive_index = {}    # {データバージョン: {年度: アーカイブの情報}}
+_archive_engines = {}  # {ファイル名: Engine}
+_archive_lock = threading.Lock()
+
+def archived_years():
+    """アーカイブ済みの年度 → SimpleNamespace(filename, scores, first_score_id, last_score_id, events)"""
+    version = current_data_version()
+    index = _archive_index.get(version)
+    if index is None:
+        index = {a.academic_year: SimpleNamespace(filename=a.filename, scores=a.scores, first_score_id=a.first_score_id,
+                                                  last_score_id=a.last_score_id, events=json.loads(a.events or '[]'))
+                 for a in SeasonArchive.query.order_by(SeasonArchive.academic_year)}
+        _archive_index.clear()
+        _archive_index[version] = index
+    return index
+
+def _archive_engine(filename):
+    """アーカイブのファイルを読み込み専用 (immutable: ロックもしない) で開くエンジン"""
+    with _archive_lock:
+        engine = _archive_engines.get(filename)
+        if engine is None:
+            path = os.path.join(_archive_dir(), filename)
+            if not os.path.exists(path): raise ArchiveError(f'アーカイブのファイルがありません: {path}')
+            # ファイルのURLにする ('sqlite://' + creator だとメモリDB用の SingletonThreadPool になり、
+            # スレッドが増えると他のスレッドが使っている接続を閉じてしまう)
+            engine = create_engine(f'sqlite:///file:{path}?mode=ro&immutable=1&uri=true')
+            if app.config['PROFILING'] or app.config['METRICS_ENABLED']:
+                event.listen(engine, 'before_cursor_execute', _on_before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', _on_after_cursor_execute)
+            _archive_engines[filename] = engine
+        return engine
+
+@contextmanager
+def archive_session(year):
+    """アーカイブ済みの年度のファイルを読むセッション (モデルはそのまま使える)"""
+    info = archived_years().get(year)
+    if info is None: raise ArchiveError(f'{year}年度はアーカイブされていません')
+    session = Session(_archive_engine(info.filename))
+    try:
+        yield session
+    finally:
+        session.close()
+
+def score_sessions(years=None):
+    """成績を読むセッションを古い順に返す (アーカイブ済みの年度ごと、最後に shooting.db)。
+    years を渡すとその年度のアーカイブだけを開く"""
+    for year in archived_years():
+        if years is not None and year not in years: continue
+        with archive_session(year) as session:
+            yield session
+    yield db.session
+
+def archived_score_ids(ids):
+    """ids のうちアーカイブ済みの年度の成績の id"""
+    found = set()
+    for year, info in archived_years().items():
+        candidates = [i for i in ids if info.first_score_id <= i <= info.last_score_id]
+        if not candidates: continue
+        with archive_session(year) as session:
+            for i in range(0, len(candidates), 500):
+                found.update(sid for (sid,) in session.query(Score.id).filter(Score.id.in_(candidates[i:i + 500])))
+    return found
+
+def summary_player_ids(match_name='', event_name=''):
+    """アーカイブ済みの年度にその大会・種目へ出場した選手の id"""
+    q = db.session.query(SeasonMatchSummary.entries)
+    if match_name: q = q.filter(SeasonMatchSummary.match_name == match_name)
+    ids = set()
+    for (entries,) in q:
+        for event_, pids in json.loads(entries):
+            if not event_name or event_ == event_name: ids.update(pids)
+    return ids
+
+def match_names():
+    """大会名の一覧 (最初に登録された順。アーカイブ済みの年度は大会ごとの集計から)"""
+    first = dict(db.session.query(Score.match_name, func.min(Score.id)).group_by(Score.match_name).all())
+    for name, sid in db.session.query(SeasonMatchSummary.match_name, func.min(SeasonMatchSummary.first_score_id)) \
+            .group_by(SeasonMatchSummary.match_name):
+        first[name] = min(sid, first.get(name, sid))
+    return sorted(first, key=first.get)
+
+def season_match_summaries(session, year):
+    """年度の成績から大会ごとの集計 (SeasonMatchSummary の列の dict) を作る"""
+    in_year = Score.academic_year == year
+    out = {}
+    for name, first_id, start, end in session.query(Score.match_name, func.min(Score.id), func.min(Score.date), func.max(Score.date)) \
+            .filter(in_year).group_by(Score.match_name):
+        out[name] = {'academic_year': year, 'match_name': name, 'first_score_id': first_id, 'start_date': start,
+                     'end_date': end, 'entries': {}, 'regulars': {}, 'team_totals': {}}
+    for name, event_, pid in session.query(Score.match_name, Score.event_name, Score.player_id).filter(in_year) \
+            .distinct().order_by(Score.match_name, Score.event_name, Score.player_id):
+        out[name]['entries'].setdefault(event_, []).append(pid)
+    regular = (in_year, Score.category == 'Regular')
+    for name, event_, gender, player_name in session.query(Score.match_name, Score.event_name, Player.gender, Player.name) \
+            .join(Player).filter(*regular).order_by(Score.date.desc(), Score.id):
+        names = out[name]['regulars'].setdefault(team_key(name, event_, gender), [])
+        if player_name not in names: names.append(player_name)
+    for name, event_, gender, total in session.query(Score.match_name, Score.event_name, Player.gender, func.sum(Score.total)) \
+            .join(Player).filter(*regular).group_by(Score.match_name, Score.event_name, Player.gender):
+        totals = out[name]['team_totals']
+        key = team_key(name, event_, gender)
+        totals[key] = totals.get(key, 0.0) + total
+    for row in out.values():
+        for col in ('entries', 'regulars', 'team_totals'):
+            row[col] = json.dumps(list(row[col].items()), ensure_ascii=False)
+    return list(out.values())
+
+def _write_archive_file(year, path):
+    """year 年度の成績 (と明細・選手・集計) を path に書き出す。書き出した時点の (件数, 最大の row_version) を返す"""
+    tmp = path + '.tmp'
+    if os.path.exists(tmp): os.remove(tmp)
+    dialect = db.engines[None].dialect
+    conn = _sqlite_connect(tmp)
+    try:
+        for model in ARCHIVE_TABLES:
+            conn.execute(str(CreateTable(model.__table__).compile(dialect=dialect)))
+            for index in model.__table__.indexes:
+                conn.execute(str(CreateIndex(index).compile(dialect=dialect)))
+        conn.execute(f'PRAGMA user_version = {int(MIGRATIONS[-1][0])}')
+    finally:
+        conn.close()
+
+    conn = _sqlite_connect(_db_file())
+    try:
+        conn.execute('ATTACH DATABASE ? AS arc', (tmp,))
+        conn.execute('BEGIN')  # 以下は同じ時点のデータを読む
+        cols = {m: ', '.join(c.name for c in m.__table__.columns) for m in ARCHIVE_TABLES}
+        conn.execute(f'INSERT INTO arc.score ({cols[Score]}) SELECT {cols[Score]} FROM main.score WHERE academic_year = ? ORDER BY id', (year,))
+        conn.execute(f'INSERT INTO arc.score_shots ({cols[ScoreShots]}) SELECT {cols[ScoreShots]} FROM main.score_shots '
+                     'WHERE score_id IN (SELECT id FROM arc.score)')
+        conn.execute(f'INSERT INTO arc.player ({cols[Player]}) SELECT {cols[Player]} FROM main.player '
+                     'WHERE id IN (SELECT player_id FROM arc.score)')
+        conn.execute(f'INSERT INTO arc.player_event_stat ({cols[PlayerEventStat]}) SELECT {cols[PlayerEventStat]} '
+                     'FROM main.player_event_stat WHERE academic_year = ?', (year,))
+        copied = conn.execute('SELECT COUNT(*), MAX(row_version) FROM arc.score').fetchone()
+        conn.execute('COMMIT')
+        conn.execute('DETACH DATABASE arc')
+    finally:
+        conn.close()
+
+    conn = _sqlite_connect(tmp)
+    try:
+        conn.execute('ANALYZE')
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+    os.replace(tmp, path)
+    os.chmod(path, 0o444)
+    return copied
+
+def archive_season(year):
+    """year 年度の成績をアーカイブのファイルへ移し、shooting.db からは消す。
+    ファイルは書き込みを止めずに作り、消す直前にその年度の成績が変わっていないことを確かめる。
+    戻り値: {'academic_year', 'filename', 'scores'}。アーカイブできない場合は ArchiveError"""
+    if year >= academic_year(datetime.now().date()):
+        raise ArchiveError(f'{year}年度はまだ終わっていません')
+    in_year = Score.academic_year == year
+    if db.session.get(SeasonArchive, year): raise ArchiveError(f'{year}年度は既にアーカイブ済みです')
+    oldest = db.session.query(func.min(Score.academic_year)).scalar()
+    db.session.rollback()  # ファイルを作る間は書き込みのロックを持たない
+    if oldest is None or oldest > year: raise ArchiveError(f'{year}年度の成績がありません')
+    if oldest < year: raise ArchiveError(f'{oldest}年度の成績が残っています。古い年度から順にアーカイブしてください')
+
+    filename = f"season-{year}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.db"
+    path = os.path.join(_archive_dir(), filename)
+    count, max_version = _write_archive_file(year, path)
+    try:
+        with _import_writer_lock:
+            current = db.session.query(func.count(Score.id), func.max(Score.row_version)).filter(in_year).one()
+            if tuple(current) != (count, max_version) or db.session.get(SeasonArchive, year):
+                raise ArchiveError(f'アーカイブ中に{year}年度の成績が変わりました。もう一度実行してください')
+            first_id, last_id = db.session.query(func.min(Score.id), func.max(Score.id)).filter(in_year).one()
+            events = [e for (e,) in db.session.query(Score.event_name).filter(in_year).distinct().order_by(Score.event_name)]
+            db.session.add(SeasonArchive(academic_year=year, filename=filename, scores=count, first_score_id=first_id,
+                                         last_score_id=last_id, events=json.dumps(events, ensure_ascii=False)))
+            db.session.execute(insert(SeasonMatchSummary), season_match_summaries(db.session, year))
+            db.session.execute(ScoreShots.__table__.delete().where(
+                ScoreShots.__table__.c.score_id.in_(db.select(Score.id).where(in_year))))
+            db.session.execute(Score.__table__.delete().where(Score.__table__.c.academic_year == year))
+            bump_data_version()
+            db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        os.chmod(path, 0o644)
+        os.remove(path)
+        raise
+    invalidate_rank_index()
+    return {'academic_year': year, 'filename': filename, 'scores': count}
+
+@app.cli.command('archive-seasons')
+@click.argument('through', type=int)
+@click.option('--vacuum', is_flag=True, help='移した後に shooting.db を VACUUM して空き領域を返す')
+def archive_seasons_command(through, vacuum):
+    """THROUGH 年度までの締めた年度の成績を年度ごとのファイルへ移す (古い年度から順に)"""
+    years = [y for (y,) in db.session.query(Score.academic_year).filter(Score.academic_year <= through)
+             .distinct().order_by(Score.academic_year)]
+    db.session.rollback()
+    if not years:
+        print('アーカイブする年度はありません')
+        return
+    for year in years:
+        try:
+            meta = archive_season(year)
+        except ArchiveError as e:
+            print(f'{year}年度: {e}')
+            return
+        print(f"{year}年度: {meta['scores']}件 → {meta['filename']}")
+    if vacuum:
+        db.session.remove()
+        conn = _sqlite_connect(_db_file())
+        try:
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+
 # ---------------------------------------------------------
-# モデル定義
+# 静的ファイル (内容のハッシュ付きURL・事前圧縮・長期キャッシュ)
 # ---------------------------------------------------------
-class Player(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(50), nullable=False, unique=True)
-    gender = db.Column(db.String(10))
-    entry_year = db.Column(db.Integer)
-    scores = db.relationship('Score', backref='player', lazy=True, cascade="all, delete-orphan")
+# テンプレートでは asset_url('js/script.js') → /assets/js/script.<ハッシュ>.js のように参照する。
+# 内容が変わればURLも変わるので、ブラウザには1年間 (immutable) キャッシュさせてよい。
+# gzip / brotli の圧縮版は instance/assets/ に作っておき、Accept-Encoding に応じて返す
+# (brotli は brotli パッケージがあるときだけ)。デバッグ時はファイルの更新を検知して作り直す。
+ASSET_COMPRESS_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.map')
+ASSET_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))  # 優先する順
 
-class Score(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    player_id = db.Column(db.Integer, db.ForeignKey('player.id'), nullable=False)
-    date = db.Column(db.Date, nullable=False)
-    match_name = db.Column(db.String(100))
-    category = db.Column(db.String(50))
-    event_name = db.Column(db.String(50))
-    s1 = db.Column(db.Float, default=0.0)
-    s2 = db.Column(db.Float, default=0.0)
-    s3 = db.Column(db.Float, default=0.0)
-    s4 = db.Column(db.Float, default=0.0)
-    s5 = db.Column(db.Float, default=0.0)
-    s6 = db.Column(db.Float, default=0.0)
-    total = db.Column(db.Float, default=0.0)
+_assets = {'signature': None, 'urls': {}, 'files': {}}  # urls: {元のパス: ハッシュ付きのパス}, files: その逆
+_assets_lock = threading.Lock()
 
-# ★追加: チーム目標テーブル
-class TeamGoal(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    event_name = db.Column(db.String(50), nullable=False)
-    gender = db.Column(db.String(10), nullable=False)
-    target_score = db.Column(db.Float, default=0.0)
+def _asset_dir():
+    return os.path.join(app.instance_path, 'assets')
+
+def _static_files():
+    """static/ 以下のファイルの (相対パス, 更新時刻, サイズ) の一覧"""
+    out = []
+    for root, dirs, files in os.walk(app.static_folder):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in sorted(files):
+            if name.startswith('.'): continue
+            st = os.stat(os.path.join(root, name))
+            out.append((os.path.relpath(os.path.join(root, name), app.static_folder).replace(os.sep, '/'), st.st_mtime_ns, st.st_size))
+    return out
+
+def _compress_asset(src, fingerprinted):
+    """圧縮版を作る (内容のハッシュがファイル名に入っているので、既にあれば作り直さない)"""
+    if not src.endswith(ASSET_COMPRESS_EXTENSIONS): return
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    with open(src, 'rb') as f:
+        raw = f.read()
+    for encoding, suffix in ASSET_ENCODINGS:
+        path = os.path.join(_asset_dir(), fingerprinted + suffix)
+        if os.path.exists(path): continue
+        if encoding == 'br':
+            if brotli is None: continue
+            data = brotli.compress(raw, quality=11)
+        else:
+            data = gzip.compress(raw, compresslevel=9, mtime=0)
+        if len(data) >= len(raw): continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)  # 他のワーカーと同時に作っても壊れない
+
+def load_assets(force=False):
+    """ハッシュ付きURLの対応表を作る。本番では最初の1回だけ、デバッグ時はファイルが変わるたびに作り直す"""
+    if _assets['signature'] is not None and not (force or app.debug): return _assets
+    signature = _static_files()
+    if signature == _assets['signature']: return _assets
+    with _assets_lock:
+        if signature == _assets['signature']: return _assets
+        urls = {}
+        for rel, _, _ in signature:
+            src = os.path.join(app.static_folder, rel)
+            with open(src, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:12]
+            base, ext = os.path.splitext(rel)
+            urls[rel] = f'{base}.{digest}{ext}'
+            _compress_asset(src, urls[rel])
+        _assets.update(signature=signature, urls=urls, files={v: k for k, v in urls.items()})
+    return _assets
+
+@app.template_global()
+def asset_url(filename):
+    """静的ファイルのハッシュ付きURL (static/ にないファイルは通常の /static/ のURL)"""
+    fingerprinted = load_assets()['urls'].get(filename)
+    if fingerprinted is None:
+        return url_for('static', filename=filename)
+    return url_for('asset', filename=fingerprinted)
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    rel = load_assets()['files'].get(filename)
+    if rel is None:
+        return 'Not Found', 404
+    mimetype = mimetypes.guess_type(rel)[0] or 'application/octet-stream'
+    path, encoding = os.path.join(app.static_folder, rel), None
+    for enc, suffix in ASSET_ENCODINGS:
+        candidate = os.path.join(_asset_dir(), filename + suffix)
+        if request.accept_encodings[enc] and os.path.exists(candidate):
+            path, encoding = candidate, enc
+            break
+    response = send_file(path, mimetype=mimetype, conditional=True, max_age=app.config['ASSET_MAX_AGE'])
+    if encoding: response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """ハッシュ付きURLの対応表と圧縮版を作り、使われなくなった圧縮版を消す (デプロイ時に実行する想定)"""
+    assets = load_assets(force=True)
+    keep = {fp + suffix for fp in assets['files'] for _, suffix in ASSET_ENCODINGS}
+    removed = 0
+    for root, _, files in os.walk(_asset_dir()):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.relpath(path, _asset_dir()).replace(os.sep, '/') not in keep:
+                os.remove(path)
+                removed += 1
+    for rel, fp in assets['urls'].items():
+        variants = [enc for enc, suffix in ASSET_ENCODINGS if os.path.exists(os.path.join(_asset_dir(), fp + suffix))]
+        print(f"{rel} -> {fp}{' (' + ', '.join(variants) + ')' if variants else ''}")
+    if removed: print(f'古い圧縮版を {removed} 件削除しました')
 
 # ---------------------------------------------------------
-# フィルター定義
+# 計測 (リクエストごとの内訳・遅いクエリ・サンプリングプロファイラ・/metrics)
 # ---------------------------------------------------------
-@app.template_filter('sort_events')
-def sort_events_filter(events):
-    order = ['AR60', 'SB3x20', 'P60', 'AP60', 'BP']
-    def get_rank(e):
-        if e in order: return order.index(e)
-        return 999
-    return sorted(events, key=lambda x: (get_rank(x), x))
+# PROFILING / METRICS_ENABLED が両方 False のときは SQLAlchemy やテンプレートのフックを登録しない。
+# メトリクスはワーカープロセスごとに持つ (gunicorn の複数ワーカーではワーカー単位の値になる)。
+class Metrics:
+    """Prometheus のテキスト形式で出力する最小限のレジストリ (カウンタ / ゲージ / ヒストグラム)"""
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._types, self._help = {}, {}
+        self._values = {}      # {(名前, ラベル): 値}
+        self._histograms = {}  # {(名前, ラベル): {'buckets': バケットごとの件数, 'sum', 'count'}}
+
+    def _declare(self, name, kind, help_text):
+        self._types.setdefault(name, kind)
+        self._help.setdefault(name, help_text)
+
+    def inc(self, name, help_text, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, 'counter', help_text)
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, help_text, value, **labels):
+        with self._lock:
+            self._declare(name, 'gauge', help_text)
+            self._values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, help_text, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, 'histogram', help_text)
+            h = self._histograms.setdefault(key, {'buckets': [0] * (len(self.BUCKETS) + 1), 'sum': 0.0, 'count': 0})
+            h['buckets'][bisect_left(self.BUCKETS, value)] += 1  # 最後の要素は +Inf のみに入る値
+            h['sum'] += value
+            h['count'] += 1
+
+    def render(self):
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items: return ''
+            return '{' + ','.join(f'{k}={json.dumps(str(v), ensure_ascii=False)}' for k, v in items) + '}'
+        lines = []
+        with self._lock:
+            for name in sorted(self._types):
+                lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} {self._types[name]}')
+                for (n, labels), value in sorted(self._values.items()):
+                    if n == name: lines.append(f'{name}{fmt(labels)} {value:g}')
+                for (n, labels), h in sorted(self._histograms.items()):
+                    if n != name: continue
+                    cumulative = 0
+                    for bound, count in zip(self.BUCKETS, h['buckets']):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{fmt(labels, [("le", f"{bound:g}")])} {cumulative}')
+                    lines.append(f'{name}_bucket{fmt(labels, [("le", "+Inf")])} {h["count"]}')
+                    lines.append(f'{name}_sum{fmt(labels)} {h["sum"]:g}')
+                    lines.append(f'{name}_count{fmt(labels)} {h["count"]}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+class SamplingProfiler:
+    """別スレッドから対象スレッドのスタックを一定間隔で記録する。
+    結果は折りたたみ形式 (関数;関数;... 回数) で、flamegraph.pl や speedscope で読める。"""
+    def __init__(self, thread_id, interval):
+        self.thread_id, self.interval = thread_id, interval
+        self.samples = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='sampling-profiler')
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            self.samples[key] = self.samples.get(key, 0) + 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.samples.items(), key=lambda x: -x[1]):
+                f.write(f'{stack} {count}\n')
+
+def _on_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def _on_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    timing = g.get('_timing') if has_request_context() else None
+    if timing is not None:
+        timing['db'] += elapsed
+        timing['queries'] += 1
+    if elapsed * 1000 >= app.config['SLOW_QUERY_MS']:
+        params = repr(parameters)
+        if len(params) > 500: params = params[:500] + '...'
+        app.logger.warning('slow query %.1fms%s: %s | params=%s', elapsed * 1000, ' (executemany)' if executemany else '',
+                           ' '.join(statement.split()), params)
+
+def _on_before_render(sender, template, context, **extra):
+    timing = g.get('_timing')
+    if timing is not None: timing['template_start'] = time.perf_counter()
+
+def _on_template_rendered(sender, template, context, **extra):
+    timing = g.get('_timing')
+    if timing is not None and 'template_start' in timing:
+        timing['template'] += time.perf_counter() - timing.pop('template_start')
+
+def init_instrumentation():
+    """設定が有効なときだけ SQL とテンプレートのフックを登録する (起動時に1回呼ぶ)"""
+    if not (app.config['PROFILING'] or app.config['METRICS_ENABLED']): return
+    for engine in db.engines.values():
+        event.listen(engine, 'before_cursor_execute', _on_before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _on_after_cursor_execute)
+    before_render_template.connect(_on_before_render, app)
+    template_rendered.connect(_on_template_rendered, app)
+
+@app.before_request
+def _start_request_timing():
+    if not (app.config['PROFILING'] or app.config['METRICS_ENABLED']): return
+    g._timing = {'start': time.perf_counter(), 'db': 0.0, 'queries': 0, 'template': 0.0}
+    if request.endpoint in app.config['PROFILE_ENDPOINTS']:
+        g._profiler = SamplingProfiler(threading.get_ident(), app.config['PROFILE_INTERVAL']).start()
+
+@app.after_request
+def _finish_request_timing(response):
+    timing = g.get('_timing')
+    if timing is None: return response
+    info = {'route': request.url_rule.rule if request.url_rule else 'unmatched', 'method': request.method,
+            'status': response.status_code, 'path': request.full_path.rstrip('?'), 'endpoint': request.endpoint}
+    profiler = g.pop('_profiler', None)
+    if response.is_streamed:
+        # エクスポートなどは本文を送る間に SQL を実行するので、送り終わってから記録する
+        # (g._timing は残しておき、stream_with_context の中の SQL もフックで足す。Server-Timing は付けられない)
+        response.call_on_close(lambda: _record_request_timing(timing, info, profiler))
+        return response
+    g.pop('_timing')
+    _record_request_timing(timing, info, profiler, response)
+    return response
+
+def _record_request_timing(timing, info, profiler, response=None):
+    """リクエストの処理時間・SQL・テンプレートの時間をメトリクスとログに記録する (response があれば Server-Timing も付ける)"""
+    total = time.perf_counter() - timing['start']
+    view = max(0.0, total - timing['db'] - timing['template'])
+    route, method = info['route'], info['method']
+
+    if app.config['METRICS_ENABLED']:
+        metrics.inc('wrsc_http_requests_total', 'リクエスト数', route=route, method=method, status=info['status'])
+        metrics.observe('wrsc_http_request_duration_seconds', 'リクエストの処理時間', total, route=route, method=method)
+        metrics.observe('wrsc_http_request_db_seconds', 'リクエスト中のSQL実行時間', timing['db'], route=route, method=method)
+        metrics.inc('wrsc_db_queries_total', 'リクエスト中に実行したSQLの数', timing['queries'], route=route)
+
+    if app.config['PROFILING']:
+        if response is not None:
+            response.headers['Server-Timing'] = (
+                f"db;dur={timing['db'] * 1000:.1f};desc=\"{timing['queries']} queries\", "
+                f"view;dur={view * 1000:.1f}, template;dur={timing['template'] * 1000:.1f}, total;dur={total * 1000:.1f}")
+        if total * 1000 >= app.config['PROFILE_LOG_MS']:
+            app.logger.info('%s %s %.1fms (db %.1fms / %d queries, view %.1fms, template %.1fms)',
+                            method, info['path'], total * 1000, timing['db'] * 1000,
+                            timing['queries'], view * 1000, timing['template'] * 1000)
+
+    if profiler is not None:
+        profiler.stop()
+        path = os.path.join(app.instance_path, 'profiles',
+                            f"{info['endpoint']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{int(total * 1000)}ms.folded")
+        profiler.save(path)
+        app.logger.info('profile saved: %s (%d samples)', path, sum(profiler.samples.values()))
+
+def record_import_metrics(report, seconds):
+    """CSV取り込みの件数と処理時間を記録する"""
+    if not app.config['METRICS_ENABLED'] or report is None: return
+    rows = import_row_count(report)
+    for result in ('inserted', 'updated', 'unchanged', 'skipped', 'rejected'):
+        count = len(report[result]) if result == 'rejected' else report[result]
+        metrics.inc('wrsc_import_rows_total', 'CSV取り込みで処理した行数', count, result=result)
+    metrics.inc('wrsc_import_seconds_total', 'CSV取り込みにかかった時間の合計', seconds)
+    metrics.observe('wrsc_import_duration_seconds', 'CSV取り込み1回の処理時間', seconds)
+    if seconds > 0:
+        metrics.set('wrsc_import_last_rows_per_second', '直近のCSV取り込みの1秒あたりの行数', rows / seconds)
 
 # ---------------------------------------------------------
 # ルーティング
 # ---------------------------------------------------------
 
 @app.route('/')
+@cached_view('index.html')
 def index():
     target_events = ['AR60', 'SB3x20', 'P60']
     
-    # チーム目標取得 (前回までのコードと同じ)
-    team_goals = {}
-    for event in target_events:
-        team_goals[event] = {}
-        for gender in ['男', '女']:
-            goal = TeamGoal.query.filter_by(event_name=event, gender=gender).first()
-            if not goal:
-                default_score = 600.0
-                if event == 'AR60': default_score = 620.0
-                elif event == 'SB3x20': default_score = 570.0
-                elif event == 'P60': default_score = 560.0
-                goal = TeamGoal(event_name=event, gender=gender, target_score=default_score)
-                db.session.add(goal)
-                db.session.commit()
-            team_goals[event][gender] = goal.target_score
+    # チーム目標取得 (初期値の登録は起動時に seed_team_goals() で行う)
+    goals = {(g.event_name, g.gender): g.target_score for g in TeamGoal.query.filter(TeamGoal.event_name.in_(target_events))}
+    team_goals = {e: {g: goals.get((e, g), DEFAULT_TEAM_GOALS[e]) for g in ['男', '女']} for e in target_events}
 
     # 1. ダッシュボード集計 (全期間の平均・最高)
     # ※ここは期間制限しない方が「歴代最高」などが分かって良いかと思いますが、
     # もしここも4年間にしたい場合は filter を追加してください。今回は全期間のままにします。
     dashboard_data = {e: {'男': {'avg':0,'max':0}, '女': {'avg':0,'max':0}} for e in target_events}
-    stats_query = db.session.query(Score.event_name, Player.gender, func.avg(Score.total), func.max(Score.total)).join(Player).group_by(Score.event_name, Player.gender).all()
+    S = PlayerEventStat
+    stats_query = db.session.query(
+        S.event_name, Player.gender, func.sum(S.total_sum) / func.sum(S.count), func.max(S.total_max)
+    ).join(Player).group_by(S.event_name, Player.gender).all()
     for e, g, avg, mx in stats_query:
         if e in dashboard_data and g in ['男','女']:
             dashboard_data[e][g] = {'avg': round(avg,1), 'max': round(mx,1)}
 
-    # --- 2. グラフ用データ (★修正: 最新から4年間に限定) ---
-    chart_data = {e: {'labels':[], 'male':[], 'female':[]} for e in target_events}
-    
-    # 最新の日付を取得して期間を決める
-    last_score = Score.query.order_by(Score.date.desc()).first()
-    if last_score:
-        latest_date = last_score.date
-        try:
-            # 4年前を計算 (うるう年対応)
-            start_date = latest_date.replace(year=latest_date.year - 4)
-        except ValueError:
-            start_date = latest_date.replace(year=latest_date.year - 4, day=28)
-    else:
-        # データがない場合のダミー日付
-        start_date = datetime(2000, 1, 1).date()
-
-    # フィルタリング付きでデータ取得
-    monthly = db.session.query(
-        Score.event_name, 
-        Player.gender, 
-        func.strftime('%Y/%m', Score.date).label('m'), 
-        func.avg(Score.total)
-    ).join(Player).filter(
-        Score.date >= start_date  # ★ここで期間を制限
-    ).group_by(
-        Score.event_name, Player.gender, 'm'
-    ).order_by('m').all()
-
-    temp = {e:{} for e in target_events}
-    months = set()
-    for e, g, m, avg in monthly:
-        if e in target_events and g in ['男','女']:
-            if m not in temp[e]: temp[e][m] = {'男':None,'女':None}
-            temp[e][m][g] = round(avg,1)
-            months.add(m)
-    sorted_months = sorted(list(months))
-    
-    for e in target_events:
-        chart_data[e]['labels'] = sorted_months
-        for m in sorted_months:
-            val = temp[e].get(m, {})
-            chart_data[e]['male'].append(val.get('男'))
-            chart_data[e]['female'].append(val.get('女'))
-
     # 3. 選手一覧 (検索・絞り込み)
     q_name = request.args.get('name', '')
     q_year = request.args.get('year', '')
@@ -143,37 +2798,31 @@ def index():
     q_match = request.args.get('match', '')
     q_event = request.args.get('event', '')
 
-    query = Player.query
-    if q_year: query = query.filter(Player.entry_year == int(q_year))
-    if q_gender: query = query.filter(Player.gender == q_gender)
-    if q_match or q_event:
-        query = query.join(Score)
-        if q_match: query = query.filter(Score.match_name == q_match)
-        if q_event: query = query.filter(Score.event_name == q_event)
-    
-    players = query.distinct().order_by(Player.entry_year.desc(), Player.name).all()
-
-    if q_name:
-        clean = q_name.replace(' ','').replace('　','')
-        filtered = []
-        for p in players:
-            if clean in p.name.replace(' ','').replace('　',''): filtered.append(p)
-        players = filtered
+    players, total_players, next_cursor, prev_cursor = query_player_list(
+        q_name, q_year, q_gender, q_match, q_event,
+        after=request.args.get('after', ''), before=request.args.get('before', ''))
 
     years = [y[0] for y in db.session.query(Player.entry_year).distinct().filter(Player.entry_year!=None).order_by(Player.entry_year.desc()).all()]
-    # matchesクエリ修正: 大会名のリストを正しく取得
-    # (前回 main.py を修正した際に、matches変数の作り方も変えたため、ここも合わせます)
-    matches_res = db.session.query(Score.match_name).distinct().all()
-    unique_matches = [m[0] for m in matches_res]
+    # 大会名のリスト (最初に登録された順。アーカイブ済みの年度の大会も含む)
+    unique_matches = match_names()
     # 必要ならここでソートしても良いですが、indexページのプルダウン順序なので一旦このままで
 
-    events_list = [e[0] for e in db.session.query(Score.event_name).distinct().order_by(Score.event_name).all()]
-    recent = Score.query.order_by(Score.date.desc()).limit(10).all()
+    events = {e for (e,) in db.session.query(Score.event_name).distinct()}
+    for info in archived_years().values(): events.update(info.events)
+    events_list = sorted(events, key=lambda e: (e is not None, e or ''))  # SQL の ORDER BY と同じく NULL が先頭
+    recent = [_plain_score(s) for s in
+              Score.query.options(db.joinedload(Score.player)).order_by(Score.date.desc(), Score.id).limit(10)]
+    for year in sorted(archived_years(), reverse=True):  # 足りない分はアーカイブ済みの年度から新しい順に
+        if len(recent) >= 10: break
+        with archive_session(year) as session:
+            recent += [_plain_score(s) for s in session.query(Score).options(db.joinedload(Score.player))
+                       .order_by(Score.date.desc(), Score.id).limit(10 - len(recent))]
 
-    return render_template('index.html', players=players, recent_scores=recent,
-                           unique_years=years, unique_matches=unique_matches, unique_events=events_list,
-                           dashboard_data=dashboard_data, chart_data=chart_data, team_goals=team_goals,
-                           q_name=q_name, q_year=q_year, q_gender=q_gender, q_match=q_match, q_event=q_event)
+    return dict(players=players, recent_scores=recent,
+                total_players=total_players, next_cursor=next_cursor, prev_cursor=prev_cursor,
+                unique_years=years, unique_matches=unique_matches, unique_events=events_list,
+                dashboard_data=dashboard_data, team_goals=team_goals,
+                q_name=q_name, q_year=q_year, q_gender=q_gender, q_match=q_match, q_event=q_event)
 
 @app.route('/update_goals', methods=['POST'])
 def update_goals():
@@ -187,6 +2836,7 @@ def update_goals():
                 goal = TeamGoal.query.filter_by(event_name=event, gender=gender).first()
                 if goal:
                     goal.target_score = float(val)
+    bump_data_version()
     db.session.commit()
     return redirect(url_for('index'))
 
@@ -196,180 +2846,192 @@ def upload_csv():
     file = request.files['file']
     if file.filename == '': return redirect(url_for('index'))
     if file:
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
+        job_id = uuid.uuid4().hex
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], f'{job_id}_{os.path.basename(file.filename)}')
         file.save(filepath)
-        try: df = pd.read_csv(filepath, encoding='cp932')
-        except: df = pd.read_csv(filepath, encoding='utf-8')
-        for _, row in df.iterrows():
+
+        # 文字コードとヘッダーはジョブに入れる前に確認する (対応していなければ1行も取り込まない)
+        try:
+            sniff_csv(filepath)
+        except CsvFormatError as e:
+            _remove_upload(filepath)
+            app.logger.info('CSV import %s rejected: %s', file.filename, e)
+            if request.accept_mimetypes.best == 'application/json':
+                return jsonify({'error': str(e)}), 400
+            flash(str(e))
+            return redirect(url_for('index'))
+
+        if not app.config['IMPORT_ASYNC']:
             try:
-                pname = row['選手名']
-                player = Player.query.filter_by(name=pname).first()
-                if not player:
-                    player = Player(name=pname, gender=row.get('性別',''), entry_year=row.get('入部年度',2024))
-                    db.session.add(player)
-                    db.session.commit()
-                d_str = str(row['日付'])
-                try: dobj = datetime.strptime(d_str, '%Y/%m/%d').date()
-                except: dobj = datetime.now().date()
-                
-                s_vals = [float(row.get(f'S{i}',0)) for i in range(1,7)]
-                total = row.get('合計点')
-                if pd.isna(total): total = row.get('合計')
-                if pd.isna(total) or total==0: total = sum(s_vals)
-                else: total = float(total)
-
-                ns = Score(player_id=player.id, date=dobj, match_name=row.get('大会名',''),
-                           category=row.get('識別',''), event_name=row.get('種目',''),
-                           s1=s_vals[0], s2=s_vals[1], s3=s_vals[2], s4=s_vals[3], s5=s_vals[4], s6=s_vals[5], total=total)
-                db.session.add(ns)
-            except: continue
+                msg = import_report_message(run_import(filepath))
+            except CsvFormatError as e:
+                msg = str(e)
+            finally:
+                _remove_upload(filepath)
+            flash(msg)
+            app.logger.info('CSV import %s: %s', file.filename, msg)
+            return redirect(url_for('index'))
+
+        db.session.add(ImportJob(id=job_id, filename=file.filename, filepath=filepath))
         db.session.commit()
-        return redirect(url_for('index'))
+        submit_import_job(job_id)
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'job_id': job_id, 'status_url': url_for('import_job_status', job_id=job_id)}), 202
+        return redirect(url_for('index', job=job_id))
+
+@app.route('/import_jobs/<job_id>')
+def import_job_status(job_id):
+    job = ImportJob.query.get_or_404(job_id)
+    data = {
+        'id': job.id, 'filename': job.filename, 'status': job.status,
+        'rows_processed': job.rows_processed, 'inserted': job.inserted, 'updated': job.updated,
+        'unchanged': job.unchanged, 'skipped': job.skipped,
+        'rejected': job.rejected, 'errors': json.loads(job.errors)[:20] if job.errors else [],
+        'duplicates': json.loads(job.duplicates) if job.duplicates else [],
+        'message': job.message,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if job.status == 'running' and job_id in _import_progress:
+        data.update(_import_progress[job_id])
+    return jsonify(data)
 
 @app.route('/player/<int:player_id>')
 def player_detail(player_id):
     player = Player.query.get_or_404(player_id)
-    scores = Score.query.filter_by(player_id=player.id).order_by(Score.date).all()
-    
-    # 1. 本人の要約データ (Max, Avg)
-    temp_stats = {}
-    for s in scores:
-        if s.event_name not in temp_stats: temp_stats[s.event_name] = []
-        temp_stats[s.event_name].append(s.total)
     
+    # 1. 本人の要約データ (Max, Avg) ※集計テーブルから取得
+    S = PlayerEventStat
+    own_stats = db.session.query(
+        S.event_name, func.max(S.total_max), func.sum(S.total_sum) / func.sum(S.count), func.sum(S.count)
+    ).filter(S.player_id == player.id).group_by(S.event_name).all()
+    own_stats = {e: (mx, avg, c) for e, mx, avg, c in own_stats}
+
     summary_data = {}
-    for event, val_list in temp_stats.items():
-        if val_list:
-            summary_data[event] = {
-                'max': max(val_list),
-                'avg': round(sum(val_list) / len(val_list), 1),
-                'count': len(val_list),
-                'rank_best': '-',  # ベスト順位
-                'rank_avg': '-',   # ★追加: 平均順位
-                'total_players': '-'
-            }
-    
-    # --- A. ベストスコアの順位計算 ---
-    all_bests = db.session.query(Score.event_name, Score.player_id, func.max(Score.total)).group_by(Score.event_name, Score.player_id).all()
-    best_map = {}
-    for event, pid, val in all_bests:
-        if event not in best_map: best_map[event] = []
-        best_map[event].append(val)
+    for event in sort_events_filter(own_stats.keys()):
+        mx, avg, c = own_stats[event]
+        summary_data[event] = {
+            'max': mx,
+            'avg': round(avg, 1),
+            'count': c,
+            'rank_best': '-',  # ベスト順位
+            'rank_avg': '-',   # ★追加: 平均順位
+            'tie_best': 1,
+            'tie_avg': 1,
+            'total_players': '-'
+        }
     
-    for event in best_map:
-        best_map[event].sort(reverse=True)
-
-    # --- B. 平均点の順位計算 (★追加) ---
-    all_avgs = db.session.query(Score.event_name, Score.player_id, func.avg(Score.total)).group_by(Score.event_name, Score.player_id).all()
-    avg_map = {}
-    for event, pid, val in all_avgs:
-        if event not in avg_map: avg_map[event] = []
-        # 平均点は計算誤差で桁が多くなることがあるので丸める
-        avg_map[event].append(round(val, 1))
-    
-    for event in avg_map:
-        avg_map[event].sort(reverse=True)
-
-    # --- C. 本人の順位を埋め込む ---
+    # --- 順位 (全選手中。同点は同順位) ---
+    rank_index = get_rank_index()
     for event, data in summary_data.items():
-        # ベスト順位
-        if event in best_map:
-            try:
-                # indexは0始まりなので+1
-                data['rank_best'] = best_map[event].index(data['max']) + 1
-                data['total_players'] = len(best_map[event])
-            except ValueError: pass
-        
-        # 平均順位 (★追加)
-        if event in avg_map:
-            try:
-                data['rank_avg'] = avg_map[event].index(data['avg']) + 1
-                # 参加人数はベストと同じはずだが念のため
-                if data['total_players'] == '-':
-                    data['total_players'] = len(avg_map[event])
-            except ValueError: pass
-
-    # 2. グラフ用データ
-    unique_dates = sorted(list(set([s.date.strftime('%Y/%m/%d') for s in scores])))
-    event_map = {}
-    for s in scores:
-        d = s.date.strftime('%Y/%m/%d')
-        if s.event_name not in event_map: event_map[s.event_name] = {}
-        event_map[s.event_name][d] = s.total
-    
-    graph_datasets = []
-    
-    event_colors = {
-        'AR60':   'rgba(218, 165, 32, 1)',
-        'SB3x20': 'rgba(0, 100, 0, 1)',
-        'P60':    'rgba(184, 0, 163, 1)',
-        'AP60':   'rgba(13, 0, 255, 1)',
-        'BP':     'rgba(108, 92, 231, 1)'
-    }
-    fallback_colors = ['rgba(54, 162, 235, 1)', 'rgba(255, 99, 132, 1)', 'rgba(75, 192, 192, 1)']
+        best = rank_index.lookup(event, 'best', data['max'])
+        if best:
+            data['rank_best'], data['tie_best'], data['total_players'] = best['rank'], best['ties'], best['total']
+        avg = rank_index.lookup(event, 'avg', data['avg'])
+        if avg:
+            data['rank_avg'], data['tie_avg'] = avg['rank'], avg['ties']
+            if data['total_players'] == '-': data['total_players'] = avg['total']
 
-    for i, (event_name, date_score_map) in enumerate(event_map.items()):
-        data_list = []
-        for d in unique_dates:
-            data_list.append(date_score_map.get(d, None))
-        color = event_colors.get(event_name, fallback_colors[i % len(fallback_colors)])
-        graph_datasets.append({
-            'label': event_name, 'data': data_list,
-            'borderColor': color, 'backgroundColor': color.replace('1)', '0.1)'),
-            'tension': 0, 'spanGaps': True
-        })
+    # 2. グラフのタブ (データは /api/charts/player/<id> から遅延読み込み)
+    graph_events = list(summary_data.keys())
 
-    # 3. チーム目標
-    goals_query = TeamGoal.query.filter_by(gender=player.gender).all()
-    player_goals = {g.event_name: g.target_score for g in goals_query}
+    # 3. スコア履歴 (絞り込みはサーバー側で行い、1ページ分だけ読み込む)
+    q_match = request.args.get('match', '')
+    q_event = request.args.get('event', '')
+    scores, total_scores, next_cursor, prev_cursor = query_player_scores(
+        player.id, q_match, q_event, after=request.args.get('after', ''), before=request.args.get('before', ''))
+    first = {}  # 大会名 → (最初の日付, 最小の id)。アーカイブ済みの年度の分もまとめる
+    for session in score_sessions(player_years(player.id)):
+        for m, d, sid in session.query(Score.match_name, func.min(Score.date), func.min(Score.id)) \
+                .filter(Score.player_id == player.id).group_by(Score.match_name):
+            first[m] = (min(d, first[m][0]), min(sid, first[m][1])) if m in first else (d, sid)
+    match_options = sorted(first, key=first.get)
+
+    # 4. 1射ごとの分析 (明細がある成績だけ)
+    shot_analysis = player_shot_analysis(player.id)
 
     return render_template('player.html', 
                            player=player, scores=scores, summary_data=summary_data, 
-                           graph_labels=unique_dates, graph_datasets=graph_datasets, 
-                           player_goals=player_goals)
+                           graph_events=graph_events, total_scores=total_scores,
+                           next_cursor=next_cursor, prev_cursor=prev_cursor,
+                           match_options=match_options, q_match=q_match, q_event=q_event,
+                           shot_analysis=shot_analysis, archived_through=max(archived_years(), default=None))
 
 @app.route('/edit/<int:score_id>', methods=['GET', 'POST'])
 def edit_score(score_id):
+    import shots
     score = Score.query.get_or_404(score_id)
     if request.method == 'POST':
-        s = [float(request.form.get(f's{i}',0)) for i in range(1,7)]
-        score.s1, score.s2, score.s3, score.s4, score.s5, score.s6 = s
-        score.total = sum(s)
-        db.session.commit()
-        return redirect(url_for('player_detail', player_id=score.player_id))
-    return render_template('edit.html', score=score)
+        pid = score.player_id
+        try:
+            apply_score_batch(edits=[{'id': score_id, 'shots': request.form.get('shots'),
+                                      **{f: request.form.get(f, 0) for f in SERIES_FIELDS}}])
+        except ScoreBatchError as e:
+            flash(' | '.join(reason for _, reason in e.errors))
+            return redirect(url_for('edit_score', score_id=score_id))
+        return redirect(url_for('player_detail', player_id=pid))
+    blob = db.session.query(ScoreShots.shots).filter_by(score_id=score_id).scalar()
+    return render_template('edit.html', score=score, shots_text=shots.format_shots(blob) if blob else '')
 
 @app.route('/delete/<int:score_id>', methods=['POST'])
 def delete_score(score_id):
     score = Score.query.get_or_404(score_id)
     pid = score.player_id
-    db.session.delete(score)
-    db.session.commit()
+    apply_score_batch(deletes=[score_id])
     return redirect(url_for('player_detail', player_id=pid))
 
+@app.route('/scores/batch', methods=['POST'])
+def batch_scores():
+    """成績の一括編集・削除。
+    JSON: {"edits": [{"id": 1, "s1": 100.5, ...}], "deletes": [2, 3]} → {"updated", "unchanged", "deleted"}
+          (S1〜S6 の代わりに "shots": "10.4 10.5* ..." (60射) で明細を指定してもよい)
+    フォーム (大会結果ページ): score_id (複数), s1-<id>〜s6-<id>, delete (削除する id, 複数), next (戻り先)"""
+    if request.is_json:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get('edits', []), list) or not isinstance(body.get('deletes', []), list):
+            return jsonify({'errors': [['body', 'edits と deletes はリストで指定してください']]}), 400
+        try:
+            result = apply_score_batch(body.get('edits', []), body.get('deletes', []))
+        except ScoreBatchError as e:
+            return jsonify({'errors': e.errors}), 400
+        result['data_version'] = current_data_version()
+        return jsonify(result)
+
+    deletes = request.form.getlist('delete')
+    edits = [{'id': sid, **{f: request.form.get(f'{f}-{sid}') for f in SERIES_FIELDS}}
+             for sid in request.form.getlist('score_id') if sid not in deletes]
+    try:
+        flash(score_batch_message(apply_score_batch(edits, deletes)))
+    except ScoreBatchError as e:
+        flash(' | '.join(f'{target}: {reason}' for target, reason in e.errors[:10]))
+    next_url = request.form.get('next', '')
+    return redirect(next_url if next_url.startswith('/') and not next_url.startswith('//') else url_for('index'))
+
 @app.route('/ranking')
+@cached_view('ranking.html')
 def ranking():
     target_events = ['AR60', 'SB3x20', 'P60']
     today = datetime.now().date()
-    start_year = today.year - 1 if today.month < 4 else today.year
-    current_start = datetime(start_year, 4, 1).date()
+    start_year = academic_year(today)
 
-    def get_rank_data(start_date=None):
-        # 1. 集計クエリ (平均と最大を取得)
+    def get_rank_data(start_year=None):
+        # 1. 集計クエリ (平均と最大を集計テーブルから取得)
+        S = PlayerEventStat
         q = db.session.query(
-            Player.name, Player.gender, Player.entry_year, Player.id, Score.event_name, 
-            func.avg(Score.total), func.max(Score.total), func.count(Score.id)
+            Player.name, Player.gender, Player.entry_year, Player.id, S.event_name, 
+            func.sum(S.total_sum) / func.sum(S.count), func.max(S.total_max), func.sum(S.count)
         ).join(Player)
         
-        if start_date:
-            q = q.filter(Score.date >= start_date)
+        if start_year:
+            q = q.filter(S.academic_year >= start_year)
             
-        rows = q.group_by(Player.id, Score.event_name).all()
+        rows = q.group_by(Player.id, S.event_name).all()
 
         # 2. データの箱を用意
         # data[種目][性別]['avg'] = [平均順リスト]
         # data[種目][性別]['max'] = [最高順リスト]
         data = {e: {'男': {'avg': [], 'max': []}, '女': {'avg': [], 'max': []}} for e in target_events}
+        rank_index = get_rank_index(start_year)
         
         # 一旦リストにまとめる
         temp_list = {e: {'男': [], '女': []} for e in target_events}
@@ -382,7 +3044,9 @@ def ranking():
                     'year': y, 
                     'avg': round(avg, 1), 
                     'max': round(mx, 1), 
-                    'count': c
+                    'count': c,
+                    'rank_avg': rank_index.rank(e, 'avg', avg, g),
+                    'rank_max': rank_index.rank(e, 'best', mx, g)
                 }
                 temp_list[e][g].append(stat)
         
@@ -396,16 +3060,14 @@ def ranking():
                 
         return data
 
-    return render_template('ranking.html', 
-                           rankings_current=get_rank_data(current_start), 
-                           rankings_all=get_rank_data(None), 
-                           current_year=start_year)
+    return dict(rankings_current=get_rank_data(start_year), 
+                rankings_all=get_rank_data(None), 
+                current_year=start_year)
 
 @app.route('/matches')
 def matches():
     # 1. 大会名の一覧を取得 (重複なし)
-    results = db.session.query(Score.match_name).distinct().all()
-    unique_names = [r[0] for r in results]
+    unique_names = match_names()
 
     # 2. 指定された順番で並び替え
     custom_order = [
@@ -423,143 +3085,76 @@ def matches():
     return render_template('matches.html', match_names=sorted_names)
 
 @app.route('/match/<path:match_name>/years')
+@cached_view('match_years.html')
 def match_years(match_name):
-    scores = Score.query.filter_by(match_name=match_name).order_by(Score.date.desc()).all()
-    
-    # 1. テーブル表示用データ (既存ロジック)
+    # 1. 年度ごとの開催期間
     years_data = {}
-    is_sokeisen = '早慶戦' in match_name
-    
-    # 2. グラフ用データ集計箱 { 2024: {'AR60 男': 1850.5, ...}, 2023: ... }
-    history_data = {} 
-    
-    for s in scores:
-        ay = s.date.year if s.date.month >= 4 else s.date.year - 1
-        
-        # --- テーブル用 ---
-        if ay not in years_data:
-            years_data[ay] = {'start_date': s.date, 'end_date': s.date, 'regulars': {}}
-        if s.date < years_data[ay]['start_date']: years_data[ay]['start_date'] = s.date
-        if s.date > years_data[ay]['end_date']: years_data[ay]['end_date'] = s.date
-        
-        # --- グラフ & テーブル用 (Regular集計) ---
-        if s.category == 'Regular':
-            if is_sokeisen:
-                key = s.event_name # 例: AR60
-            else:
-                key = f"{s.event_name} {s.player.gender}" # 例: AR60 男
-            
-            # テーブル用リスト作成
-            if key not in years_data[ay]['regulars']:
-                years_data[ay]['regulars'][key] = []
-            if s.player.name not in years_data[ay]['regulars'][key]:
-                years_data[ay]['regulars'][key].append(s.player.name)
-            
-            # グラフ用合計点計算
-            if ay not in history_data: history_data[ay] = {}
-            if key not in history_data[ay]: history_data[ay][key] = 0.0
-            
-            history_data[ay][key] += s.total
-            history_data[ay][key] = round(history_data[ay][key], 1)
+    periods = db.session.query(Score.academic_year, func.min(Score.date), func.max(Score.date)) \
+        .filter(Score.match_name == match_name).group_by(Score.academic_year).all()
+    for ay, start_date, end_date in periods:
+        years_data[ay] = {'start_date': start_date, 'end_date': end_date, 'regulars': {}}
+
+    # 2. Regularメンバー (選手名も同じクエリで取得。新しい記録から順に並べる)
+    regulars = db.session.query(Score.academic_year, Score.event_name, Player.gender, Player.name).join(Player) \
+        .filter(Score.match_name == match_name, Score.category == 'Regular') \
+        .order_by(Score.date.desc(), Score.id).all()
+    for ay, event_name, gender, name in regulars:
+        names = years_data[ay]['regulars'].setdefault(team_key(match_name, event_name, gender), [])  # 例: AR60 / AR60 男
+        if name not in names: names.append(name)
+
+    # 3. アーカイブ済みの年度は大会ごとの集計から
+    for summary in SeasonMatchSummary.query.filter_by(match_name=match_name):
+        years_data[summary.academic_year] = {'start_date': summary.start_date, 'end_date': summary.end_date,
+                                             'regulars': dict(json.loads(summary.regulars))}
 
     # テーブル用: 年度の降順
     sorted_years_table = sorted(years_data.items(), key=lambda x: x[0], reverse=True)
     
-    # --- 3. グラフ用データセットの作成 ---
-    # 年度の昇順 (グラフは左から右へ時系列)
-    sorted_years_graph = sorted(history_data.keys())
-    
-    # 全てのキー(種目+性別)を抽出
-    all_keys = set()
-    for y in history_data:
-        for k in history_data[y]:
-            all_keys.add(k)
-    sorted_keys = sorted(list(all_keys)) # AR60 女, AR60 男... の順
-    
-    chart_datasets = []
-    
-    for key in sorted_keys:
-        # データ配列作成 (該当年になければ null)
-        data_list = []
-        for y in sorted_years_graph:
-            data_list.append(history_data[y].get(key, None))
-        
-        # 色設定
-        color = '#636e72'
-        if 'AR60' in key: color = 'rgba(218, 165, 32, 1)' # Gold
-        elif 'SB3x20' in key: color = 'rgba(0, 100, 0, 1)' # DarkGreen
-        elif 'P60' in key: color = 'rgba(184, 0, 163, 1)' # Purple
-        
-        # 線種設定 (女子は点線)
-        border_dash = []
-        if '女' in key:
-            border_dash = [5, 5] # 5px線, 5px空白 の繰り返し
-            
-        chart_datasets.append({
-            'label': key,
-            'data': data_list,
-            'borderColor': color,
-            'backgroundColor': color, # 点の色
-            'borderDash': border_dash, # ★ここで点線を指定
-            'fill': False,
-            'tension': 0, # 直線
-            'spanGaps': True
-        })
-
-    return render_template('match_years.html', 
-                           match_name=match_name, 
-                           years_data=sorted_years_table,
-                           chart_labels=sorted_years_graph, # グラフ横軸(年度)
-                           chart_datasets=chart_datasets)   # グラフデータ
+    return dict(match_name=match_name, 
+                years_data=sorted_years_table)
 
 @app.route('/match/<path:match_name>/<int:year>')
+@cached_view('match_result.html')
 def match_result(match_name, year):
-    start_date = datetime(year, 4, 1).date()
-    end_date = datetime(year + 1, 3, 31).date()
-    
-    scores = Score.query.filter(
-        Score.match_name == match_name,
-        Score.date >= start_date,
-        Score.date <= end_date
-    ).join(Player).all()
-    
-    # データを格納する箱
-    # 早慶戦以外は男女で分ける
-    team_results_male = {}   # 男子用
-    team_results_female = {} # 女子用
-    team_results_mixed = {}  # 早慶戦(混合)用
-    
-    individual_results = {}
-    
+    # アーカイブ済みの年度はその年度のファイルから同じように集計する (編集はできない)
+    archived = year in archived_years()
+    if archived:
+        with archive_session(year) as session:
+            data = match_result_data(session, match_name, year)
+    else:
+        data = match_result_data(db.session, match_name, year)
+    return dict(data, archived=archived,
+                edit_mode=request.args.get('edit') == '1' and not archived)  # 一括編集フォームを表示する
+
+def match_result_data(session, match_name, year):
     is_sokeisen = '早慶戦' in match_name
+    in_match = (Score.match_name == match_name, Score.academic_year == year)
 
+    # 個人戦: 種目は最初に登録された順、種目内は合計点の降順 (同点は登録順) でDBから受け取る
+    event_order = func.min(Score.id).over(partition_by=Score.event_name)
+    scores = session.query(Score).filter(*in_match).join(Player).options(db.contains_eager(Score.player)) \
+        .order_by(event_order, Score.total.desc(), Score.id).all()
+    scores = [_plain_score(s) for s in scores]
+
+    individual_results = {}
     for s in scores:
-        # 個人戦リストへ追加
-        if s.event_name not in individual_results:
-            individual_results[s.event_name] = []
-        individual_results[s.event_name].append(s)
-        
-        # 団体戦集計
-        if s.category == 'Regular':
-            if is_sokeisen:
-                # 早慶戦: 混合
-                key = s.event_name # "AR60" など
-                target_dict = team_results_mixed
-            else:
-                # 通常: 男女別
-                # キーは競技名だけにする (表示側で「男子」「女子」と分けるため)
-                key = s.event_name
-                if s.player.gender == '男':
-                    target_dict = team_results_male
-                else:
-                    target_dict = team_results_female
-            
-            if key not in target_dict:
-                target_dict[key] = {'total': 0.0, 'members': []}
-            
-            target_dict[key]['total'] += s.total
-            target_dict[key]['total'] = round(target_dict[key]['total'], 1)
-            target_dict[key]['members'].append(s)
+        individual_results.setdefault(s.event_name, []).append(s)
+
+    # 団体戦: 合計はSQLで集計する。早慶戦は混合、それ以外は男女別 (男子以外は女子の欄)
+    team_results_male = {}   # 男子用
+    team_results_female = {} # 女子用
+    team_results_mixed = {}  # 早慶戦(混合)用
+    gender_key = db.literal(None) if is_sokeisen else db.case((Player.gender == '男', '男'), else_='女')
+    totals = session.query(Score.event_name, gender_key, func.sum(Score.total)).join(Player) \
+        .filter(*in_match, Score.category == 'Regular').group_by(Score.event_name, gender_key).all()
+    for event_name, gender, total in totals:
+        target_dict = team_results_mixed if is_sokeisen else team_results_male if gender == '男' else team_results_female
+        target_dict[event_name] = {'total': round(total, 1), 'members': []}
+    # メンバーは登録順
+    for s in sorted(scores, key=lambda x: x.id):
+        if s.category != 'Regular': continue
+        target_dict = team_results_mixed if is_sokeisen else team_results_male if s.player.gender == '男' else team_results_female
+        target_dict[s.event_name]['members'].append(s)
 
     # 絞り込み処理
     if is_sokeisen:
@@ -574,39 +3169,204 @@ def match_result(match_name, year):
         team_results_female = {k: v for k, v in team_results_female.items() if k in target_keys}
         display_mode = 'separate'
 
-    # 個人戦ソート
-    for event in individual_results:
-        individual_results[event].sort(key=lambda x: x.total, reverse=True)
+    return dict(match_name=match_name, 
+                year=year,
+                team_results_male=team_results_male,     # 男子データ
+                team_results_female=team_results_female, # 女子データ
+                team_results_mixed=team_results_mixed,   # 混合データ
+                display_mode=display_mode,               # 表示モード
+                individual_results=individual_results)
+
+@app.route('/match/<path:match_name>/lineup')
+def match_lineup(match_name):
+    """団体メンバーの選考。例: ?event=AR60&gender=男&size=3&objective=goal&target=1850&exclude=12&exclude=34
+    (Accept: application/json なら JSON で返す)"""
+    args = request.args
+    try:
+        result = select_lineup(
+            match_name, args.get('event') or team_events(match_name)[0], args.get('gender') or '男',
+            year=int(args['year']) if args.get('year') else None,
+            size=int(args['size']) if args.get('size') else None,
+            objective=args.get('objective') or 'expected',
+            target=float(args['target']) if args.get('target') else None,
+            exclude={int(v) for v in args.getlist('exclude') if v})
+    except ValueError as e:
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'error': str(e)}), 400
+        return str(e), 400
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(result)
+    return render_template('lineup.html', events=team_events(match_name), **result)
+
+@app.route('/api/charts/monthly')
+def api_chart_monthly():
+    return json_chart_response(monthly_chart_data)
+
+@app.route('/api/charts/player/<int:player_id>')
+def api_chart_player(player_id):
+    player = Player.query.get_or_404(player_id)
+    return json_chart_response(lambda: player_chart_data(player))
+
+@app.route('/api/charts/match/<path:match_name>/years')
+def api_chart_match_years(match_name):
+    return json_chart_response(lambda: match_years_chart_data(match_name))
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not app.config['METRICS_ENABLED']: return 'metrics is disabled', 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache_stats')
+def cache_stats():
+    stats = result_cache.stats()
+    stats['data_version'] = current_data_version()
+    return jsonify(stats)
 
-    return render_template('match_result.html', 
-                           match_name=match_name, 
-                           year=year,
-                           team_results_male=team_results_male,     # 男子データ
-                           team_results_female=team_results_female, # 女子データ
-                           team_results_mixed=team_results_mixed,   # 混合データ
-                           display_mode=display_mode,               # 表示モード
-                           individual_results=individual_results)
+# --- エクスポート ---
+# 例: /export?event=AR60&date_from=2023-04-01&format=csv&encoding=cp932
+@app.route('/export')
+def export_scores():
+    fmt = request.args.get('format', 'csv')
+    encoding = request.args.get('encoding', 'utf-8').lower()
+    if fmt not in EXPORT_FORMATS: return f'format は {", ".join(EXPORT_FORMATS)} のいずれかです', 400
+    if fmt == 'csv' and encoding not in ('utf-8', 'cp932'): return 'encoding は utf-8 か cp932 です', 400
+    try:
+        stmt = export_statement(request.args)
+    except ValueError as e:
+        return str(e), 400
+    if fmt == 'csv':
+        body = export_csv(stmt, encoding)
+    else:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return 'Parquet / Arrow の出力には pyarrow が必要です (pip install pyarrow)', 501
+        body = export_arrow(stmt, fmt)
+
+    ext, mimetype = EXPORT_FORMATS[fmt]
+    if fmt == 'csv': mimetype += f'; charset={"Shift_JIS" if encoding == "cp932" else "utf-8"}'
+    resp = Response(stream_with_context(body), content_type=mimetype)
+    resp.headers['Content-Disposition'] = f"attachment; filename=scores_{datetime.now().strftime('%Y%m%d')}.{ext}"
+    return resp
 
 # --- バックアップ用ルート ---
+# /download_db            : 最新のスナップショット (gzip)。データが変わっていなければ前回のものを返す
+# /download_db?since=名前 : そのスナップショットからの差分 (gzip)
 @app.route('/download_db')
 def download_db():
-    # 1. まず「instance」フォルダの中を探す (最近のFlaskの標準的な場所)
-    db_path_in_instance = os.path.join(app.instance_path, 'shooting.db')
-    
-    if os.path.exists(db_path_in_instance):
-        return send_file(db_path_in_instance, as_attachment=True)
-    
-    # 2. なければ、main.py と同じ場所を探す
-    db_path_local = os.path.join(os.path.dirname(__file__), 'shooting.db')
-    
-    if os.path.exists(db_path_local):
-        return send_file(db_path_local, as_attachment=True)
+    try:
+        meta = create_incremental(request.args['since']) if request.args.get('since') else latest_snapshot()
+    except BackupError as e:
+        return f'エラー: {e}', 404
+    return send_file(os.path.join(_backup_dir(), meta['file']), as_attachment=True,
+                     download_name=f"shooting-{meta['name']}.db.gz", mimetype='application/gzip')
 
-    # 3. どちらにもない場合
-    return "エラー: データベースファイルが見つかりませんでした。(shooting.db)", 404
+@app.route('/backups', methods=['GET', 'POST'])
+def backups():
+    if request.method == 'POST':
+        return jsonify(create_snapshot()), 201
+    return jsonify(list_backups())
 
-with app.app_context():
+@app.route('/backups/<name>')
+def download_backup(name):
+    try:
+        meta = _find_backup(name)
+    except BackupError as e:
+        return jsonify({'error': str(e)}), 404
+    return send_file(os.path.join(_backup_dir(), meta['file']), as_attachment=True, mimetype='application/gzip')
+
+# 復元: file にバックアップ (.db / .db.gz / 差分) を添付するか、name に保存済みのバックアップ名を指定する
+@app.route('/restore', methods=['POST'])
+def restore_db():
+    upload = request.files.get('file')
+    try:
+        if upload and upload.filename:
+            path = os.path.join(_backup_dir(), f'.upload-{uuid.uuid4().hex}')
+            upload.save(path)
+            try:
+                result = restore_backup(path, upload.filename)
+            finally:
+                os.remove(path)
+        elif request.form.get('name'):
+            result = restore_backup(os.path.join(_backup_dir(), _find_backup(request.form['name'])['file']))
+        else:
+            return jsonify({'error': 'file か name を指定してください'}), 400
+    except BackupError as e:
+        return jsonify({'error': str(e)}), 400
+    app.logger.info('database restored: %s', result)
+    return jsonify(result)
+
+# ---------------------------------------------------------
+# 起動 (import 時はDBに触らず、スレッドも作らない)
+# ---------------------------------------------------------
+# スキーマの準備はデプロイ時に flask init-db で行う。ワーカーごとの準備 (止まった取り込みジョブの再投入) は
+# 最初のリクエストで行うので、gunicorn --preload でもフォーク前のマスターにDB接続やスレッドが残らない。
+def init_db():
+    """テーブル作成・マイグレーション・チーム目標の初期値・集計テーブルの作成と、静的ファイルの圧縮版の作成。
+    何度実行してもよい"""
     db.create_all()
+    migrate_db()
+    seed_team_goals()
+    # 既存DBに集計テーブルを追加した直後は中身が空なので作り直す
+    if not PlayerEventStat.query.first() and Score.query.first():
+        rebuild_stats()
+        db.session.commit()
+    load_assets()
+
+def schema_is_current():
+    """init_db() 済みで、マイグレーションもすべて適用済みか"""
+    current = db.session.execute(text('PRAGMA user_version')).scalar()
+    db.session.rollback()  # 書き込み用の接続では BEGIN IMMEDIATE を出しているので、create_all の前にロックを放す
+    return current >= MIGRATIONS[-1][0]
+
+@app.cli.command('init-db')
+def init_db_command():
+    """DBのスキーマを準備する (デプロイ時・更新時に実行する。ワーカーの起動前に1回)"""
+    init_db()
+    print(f"DB を準備しました (スキーマ v{MIGRATIONS[-1][0]})")
+
+def warm():
+    """重いライブラリの import とテンプレートのコンパイルを先に済ませる。gunicorn --preload のマスターで
+    フォークの前に呼ぶと (gunicorn.conf.py)、子プロセスは読み込み済みのものを共有して起動する。
+    DBには接続せず、スレッドも作らない"""
+    import numpy, pandas  # noqa: F401
+    import columnar, lineup, shots  # noqa: F401
+    for name in app.jinja_env.list_templates(filter_func=lambda n: n.endswith('.html')):
+        app.jinja_env.get_template(name)
+
+def _start_worker():
+    with app.app_context():
+        if not schema_is_current():
+            app.logger.warning('DB のスキーマが古いので準備します (デプロイ時に flask init-db を実行してください)')
+            init_db()
+        recover_import_jobs()
+
+_worker_started = False
+_worker_lock = threading.Lock()
+
+@app.before_request
+def _ensure_worker_started():
+    """ワーカーの最初のリクエストで1回だけ _start_worker() を行う。
+    GET のリクエスト中は読み込み専用の接続になるので、書き込みは取り込み用のスレッドで行い終わるまで待つ"""
+    global _worker_started
+    if _worker_started: return
+    with _worker_lock:
+        if _worker_started: return
+        import_pool().submit(_start_worker).result()
+        _worker_started = True
+
+def _reset_after_fork():
+    """フォークした子プロセスではスレッドプールとロックを作り直す (親のものは子で使えない)"""
+    global _import_pool, _import_pool_lock, _worker_started, _worker_lock
+    _import_pool, _import_pool_lock = None, threading.Lock()
+    _worker_started, _worker_lock = False, threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+with app.app_context():
+    init_instrumentation()  # フックの登録だけ (DBには接続しない)
 
 if __name__ == '__main__':
+    with app.app_context():
+        init_db()
     app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -0,0 +1,112 @@
+# ---------------------------------------------------------
+# 1射ごとの点数 (60射) の詰め込みと集計 (NumPy)
+# ---------------------------------------------------------
+# 成績1件の60射を int16 (リトルエンディアン) の配列として 120 バイトのBLOBに詰める。
+# 値は 0.1点単位の整数 (10.9点 → 109、整数採点の 10点 → 100) で、内10点の射は INNER_FLAG を立てる。
+# DBとのやり取り (score_shots テーブル) は main.py が行い、ここでは変換と集計だけを扱う。
+# 集計は複数の成績をまとめた (件数, 60) の配列に対して行い、1射ごとの Python オブジェクトは作らない。
+import re
+
+import numpy as np
+
+SERIES = 6
+SHOTS_PER_SERIES = 10
+SHOT_COUNT = SERIES * SHOTS_PER_SERIES
+DTYPE = np.dtype('<i2')
+INNER_FLAG = 0x4000    # 内10点の印
+VALUE_MASK = 0x3FFF
+MAX_TENTHS = 109       # 1射の上限 (10.9点)
+
+# 1射の書き方: 10.4 / 9 / 10.5* (内10点) / X (整数採点の内10点)
+_SHOT_RE = re.compile(r'^(?:(\d{1,2}(?:\.\d)?)(\*?)|([xX]))$')
+
+
+def parse_shots(text):
+    """空白かカンマ区切りの60射を int16 の配列にする。形式が不正なら ValueError"""
+    tokens = text.replace(',', ' ').split() if isinstance(text, str) else [str(t) for t in text]
+    if len(tokens) != SHOT_COUNT:
+        raise ValueError(f'{SHOT_COUNT}射の点数が必要です ({len(tokens)}射)')
+    out = np.empty(SHOT_COUNT, dtype=DTYPE)
+    for i, token in enumerate(tokens):
+        m = _SHOT_RE.match(token)
+        if m is None:
+            raise ValueError(f'{i + 1}射目の点数が不正です: {token}')
+        if m.group(3):
+            out[i] = 100 | INNER_FLAG
+            continue
+        tenths = int(round(float(m.group(1)) * 10))
+        if tenths > MAX_TENTHS:
+            raise ValueError(f'{i + 1}射目の点数が上限 ({MAX_TENTHS / 10:g}点) を超えています: {token}')
+        out[i] = tenths | (INNER_FLAG if m.group(2) else 0)
+    return out
+
+
+def pack(shots):
+    return np.asarray(shots, dtype=DTYPE).tobytes()
+
+
+def unpack(blobs):
+    """BLOB のリストを (件数, 60) の int16 配列にする (連結してから1回で変換する)"""
+    if not blobs:
+        return np.empty((0, SHOT_COUNT), dtype=DTYPE)
+    return np.frombuffer(b''.join(blobs), dtype=DTYPE).reshape(-1, SHOT_COUNT)
+
+
+def points(packed):
+    """点数 (float)。packed は (件数, 60) または (60,)"""
+    return (packed & VALUE_MASK) / 10.0
+
+
+def inner(packed):
+    return (packed & INNER_FLAG) != 0
+
+
+def series_totals(packed):
+    """シリーズごとの合計 (件数, 6)。0.1点単位の整数で足してから戻すので丸め誤差は出ない"""
+    tenths = (np.atleast_2d(packed) & VALUE_MASK).astype(np.int32)
+    return tenths.reshape(-1, SERIES, SHOTS_PER_SERIES).sum(axis=2) / 10.0
+
+
+def format_shots(blob, series_sep='\n'):
+    """BLOB を parse_shots() で読める文字列に戻す (整数採点の成績は小数点なしで書く)。
+    シリーズの間は series_sep で区切る (CSVに書くときは空白にする)"""
+    packed = unpack([blob])[0]
+    tenths = packed & VALUE_MASK
+    decimal = bool((tenths % 10).any())
+    marks = np.where(inner(packed), '*', '')
+    values = np.char.mod('%.1f', tenths / 10.0) if decimal else np.char.mod('%d', tenths // 10)
+    series = np.char.add(values, marks).reshape(SERIES, SHOTS_PER_SERIES)
+    return series_sep.join(' '.join(row) for row in series)
+
+
+def analyze(packed):
+    """成績ごとの指標。戻り値 (いずれも件数が先頭の次元):
+    series: シリーズの合計 (件数, 6) / std: シリーズ内の1射の標準偏差 (件数, 6)
+    inner_tens: シリーズごとの内10点の数 (件数, 6) / slope: シリーズが進むごとの点数の増減 (件数,)"""
+    pts = points(packed).reshape(-1, SERIES, SHOTS_PER_SERIES)
+    series = pts.sum(axis=2)
+    x = np.arange(SERIES) - (SERIES - 1) / 2
+    slope = (series - series.mean(axis=1, keepdims=True)) @ x / (x @ x)  # 最小二乗の傾き
+    return {
+        'series': series,
+        'std': pts.std(axis=2),
+        'inner_tens': inner(packed).reshape(-1, SERIES, SHOTS_PER_SERIES).sum(axis=2),
+        'slope': slope,
+    }
+
+
+def summarize(packed):
+    """複数の成績をまとめた指標 (選手ページの表示用)。シリーズごとの値は成績の平均"""
+    a = analyze(packed)
+    pts = points(packed)
+    return {
+        'count': len(packed),
+        'shot_mean': float(pts.mean()),
+        'shot_std': float(pts.std(axis=1).mean()),
+        'inner_tens': float(a['inner_tens'].sum(axis=1).mean()),
+        'series_mean': a['series'].mean(axis=0).tolist(),
+        'series_std': a['std'].mean(axis=0).tolist(),
+        'series_inner_tens': a['inner_tens'].mean(axis=0).tolist(),
+        'slope': float(a['slope'].mean()),
+        'declining': float((a['slope'] < 0).mean()),  # 後半ほど下がった成績の割合
+    }
@@ -34,6 +34,34 @@ function openTab(evt, tabName) {
     if (evt) evt.currentTarget.className += " active";
 }
 
+// 要素が画面に表示されたときに一度だけ callback を呼ぶ (グラフの遅延読み込み用)
+function whenVisible(el, callback) {
+    if (!('IntersectionObserver' in window)) {
+        callback();
+        return;
+    }
+    const observer = new IntersectionObserver(entries => {
+        if (entries.some(e => e.isIntersecting)) {
+            observer.disconnect();
+            callback();
+        }
+    });
+    observer.observe(el);
+}
+
+// グラフ用データの取得 (同じURLはページ内で一度だけ取得。再訪時はETagで再検証される)
+const chartDataRequests = {};
+
+function fetchChartData(url) {
+    if (!chartDataRequests[url]) {
+        chartDataRequests[url] = fetch(url, { credentials: 'same-origin' }).then(res => {
+            if (!res.ok) throw new Error('グラフデータの取得に失敗しました: ' + res.status);
+            return res.json();
+        });
+    }
+    return chartDataRequests[url];
+}
+
 
 // =========================================================
 // index.html (トップページ) 用
@@ -54,40 +82,72 @@ window.onclick = function (event) {
     }
 }
 
-function initIndexCharts(chartData) {
-    for (const [event, data] of Object.entries(chartData)) {
-        const ctx = document.getElementById(`chart-${event}`);
-        if (ctx) {
-            new Chart(ctx, {
-                type: 'line',
-                data: {
-                    labels: data.labels,
-                    datasets: [
-                        {
-                            label: '男子', data: data.male,
-                            borderColor: 'rgba(54, 162, 235, 1)', backgroundColor: 'rgba(54, 162, 235, 0.2)',
-                            tension: 0.1, fill: false, spanGaps: true
-                        },
-                        {
-                            label: '女子', data: data.female,
-                            borderColor: 'rgba(255, 99, 132, 1)', backgroundColor: 'rgba(255, 99, 132, 0.2)',
-                            tension: 0.1, fill: false, spanGaps: true
-                        }
-                    ]
+// CSV取り込みジョブの状態を定期的に確認し、終わったらページを読み直す
+function pollImportJob(el) {
+    if (!el) return;
+    fetch(el.dataset.url, { credentials: 'same-origin' }).then(res => res.json()).then(job => {
+        if (job.status === 'queued') {
+            el.textContent = '取り込み待ち...';
+        } else if (job.status === 'running') {
+            el.textContent = `取り込み中... ${job.rows_processed}行 (登録 ${job.inserted}件 / 更新 ${job.updated}件 / エラー ${job.rejected}件)`;
+        } else {
+            el.innerHTML = '';
+            (job.message || '').split(' | ').forEach(part => {
+                const div = document.createElement('div');
+                div.textContent = part;
+                el.appendChild(div);
+            });
+            if (job.status === 'done' && !sessionStorage.getItem('import-reloaded-' + job.id)) {
+                // 集計やグラフに反映させるため一度だけ読み直す
+                sessionStorage.setItem('import-reloaded-' + job.id, '1');
+                location.reload();
+            }
+            return;
+        }
+        setTimeout(() => pollImportJob(el), 1000);
+    }).catch(err => console.error(err));
+}
+
+function initIndexCharts(url) {
+    document.querySelectorAll('.mini-chart-container canvas[data-event]').forEach(ctx => {
+        const event = ctx.dataset.event;
+        whenVisible(ctx, () => {
+            fetchChartData(url).then(chartData => {
+                if (chartData[event]) createIndexChart(ctx, event, chartData[event]);
+            }).catch(err => console.error(err));
+        });
+    });
+}
+
+function createIndexChart(ctx, event, data) {
+    new Chart(ctx, {
+        type: 'line',
+        data: {
+            labels: data.labels,
+            datasets: [
+                {
+                    label: '男子', data: data.male,
+                    borderColor: 'rgba(54, 162, 235, 1)', backgroundColor: 'rgba(54, 162, 235, 0.2)',
+                    tension: 0.1, fill: false, spanGaps: true
                 },
-                options: {
-                    responsive: true, maintainAspectRatio: false,
-                    interaction: { mode: 'index', intersect: false },
-                    plugins: {
-                        legend: { position: 'bottom', labels: { boxWidth: 12, padding: 10 } },
-                        title: { display: true, text: event + ' 平均点推移', font: { size: 16, weight: 'bold' }, padding: { top: 10, bottom: 10 } },
-                        tooltip: { callbacks: { label: function (context) { return context.dataset.label + ': ' + context.parsed.y + '点'; } } }
-                    },
-                    scales: { y: { beginAtZero: false } }
+                {
+                    label: '女子', data: data.female,
+                    borderColor: 'rgba(255, 99, 132, 1)', backgroundColor: 'rgba(255, 99, 132, 0.2)',
+                    tension: 0.1, fill: false, spanGaps: true
                 }
-            });
+            ]
+        },
+        options: {
+            responsive: true, maintainAspectRatio: false,
+            interaction: { mode: 'index', intersect: false },
+            plugins: {
+                legend: { position: 'bottom', labels: { boxWidth: 12, padding: 10 } },
+                title: { display: true, text: event + ' 平均点推移', font: { size: 16, weight: 'bold' }, padding: { top: 10, bottom: 10 } },
+                tooltip: { callbacks: { label: function (context) { return context.dataset.label + ': ' + context.parsed.y + '点'; } } }
+            },
+            scales: { y: { beginAtZero: false } }
         }
-    }
+    });
 }
 
 
@@ -95,67 +155,84 @@ function initIndexCharts(chartData) {
 // player.html (選手詳細) 用
 // =========================================================
 
-function filterHistory() {
-    var matchFilter = document.getElementById("filterMatch").value;
-    var eventFilter = document.getElementById("filterEvent").value;
-    var rows = document.getElementsByClassName("history-row");
-    for (var i = 0; i < rows.length; i++) {
-        var row = rows[i];
-        var rowMatch = row.getAttribute("data-match");
-        var rowEvent = row.getAttribute("data-event");
-        if ((matchFilter === "" || rowMatch === matchFilter) && (eventFilter === "" || rowEvent === eventFilter)) {
-            row.style.display = "";
-        } else {
-            row.style.display = "none";
-        }
-    }
-}
-
 let playerChartInstances = [];
 
-function initPlayerCharts(labels, datasets, playerGoals, playerGender) {
+function initPlayerCharts(url) {
+    document.querySelectorAll('.individual-chart-container canvas[data-event]').forEach((ctx, index) => {
+        // 非表示のタブは開かれたときに読み込む
+        whenVisible(ctx, () => {
+            fetchChartData(url).then(data => {
+                const series = data.datasets.find(d => d.label === ctx.dataset.event);
+                if (series) createPlayerChart(ctx, index, series, data.goals, data.gender);
+            }).catch(err => console.error(err));
+        });
+    });
+}
+
+// series: 1種目分の系列 (labels / data(平均) / min / max / count)。
+// 同じ日や期間にまとめた点は最小〜最大を帯で表示する
+function createPlayerChart(ctx, index, series, playerGoals, playerGender) {
     const goalLabelText = (playerGender === '男' ? '男子目標' : (playerGender === '女' ? '女子目標' : 'チーム目標'));
+    const eventName = series.label;
+    const teamGoalScore = playerGoals[eventName];
+    const labels = series.labels;
+    const chartDatasets = [{
+        label: eventName, data: series.data,
+        borderColor: series.borderColor, backgroundColor: series.backgroundColor,
+        tension: 0, spanGaps: true
+    }];
+
+    if (series.count.some(c => c > 1)) {
+        chartDatasets.push(
+            { label: '最大', data: series.max, borderWidth: 0, pointRadius: 0, fill: '+1', backgroundColor: series.backgroundColor, isRange: true },
+            { label: '最小', data: series.min, borderWidth: 0, pointRadius: 0, fill: false, isRange: true }
+        );
+    }
 
-    datasets.forEach((dataset, index) => {
-        const ctx = document.getElementById(`chart-${index}`);
-        if (ctx) {
-            const eventName = dataset.label;
-            const teamGoalScore = playerGoals[eventName];
-            const chartDatasets = [dataset];
-
-            if (teamGoalScore !== undefined) {
-                const goalData = new Array(labels.length).fill(teamGoalScore);
-                chartDatasets.push({
-                    label: goalLabelText,
-                    data: goalData,
-                    borderColor: 'rgba(220, 53, 69, 0.8)',
-                    borderWidth: 2, borderDash: [10, 5], pointRadius: 0, fill: false, order: 1
-                });
-            }
+    if (teamGoalScore !== undefined) {
+        const goalData = new Array(labels.length).fill(teamGoalScore);
+        chartDatasets.push({
+            label: goalLabelText,
+            data: goalData,
+            borderColor: 'rgba(220, 53, 69, 0.8)',
+            borderWidth: 2, borderDash: [10, 5], pointRadius: 0, fill: false, order: 1
+        });
+    }
 
-            const chart = new Chart(ctx, {
-                type: 'line',
-                data: { labels: labels, datasets: chartDatasets },
-                options: {
-                    responsive: true, maintainAspectRatio: false,
-                    interaction: { mode: 'index', intersect: false },
-                    plugins: {
-                        legend: { display: true, position: 'bottom' },
-                        tooltip: { callbacks: { label: function (context) { return context.dataset.label + ': ' + context.parsed.y + '点'; } } }
-                    },
-                    scales: {
-                        y: { beginAtZero: false, title: { display: true, text: '点数' } },
-                        x: { title: { display: true, text: '日付' } }
+    const chart = new Chart(ctx, {
+        type: 'line',
+        data: { labels: labels, datasets: chartDatasets },
+        options: {
+            responsive: true, maintainAspectRatio: false,
+            interaction: { mode: 'index', intersect: false },
+            plugins: {
+                legend: { display: true, position: 'bottom', labels: { filter: (item, data) => !data.datasets[item.datasetIndex].isRange } },
+                tooltip: {
+                    filter: item => !item.dataset.isRange,
+                    callbacks: {
+                        label: function (context) {
+                            let text = context.dataset.label + ': ' + context.parsed.y + '点';
+                            const i = context.dataIndex;
+                            if (context.datasetIndex === 0 && series.count[i] > 1) {
+                                text += ` (${series.count[i]}件の平均, ${series.min[i]}〜${series.max[i]}点)`;
+                            }
+                            return text;
+                        }
                     }
                 }
-            });
-            playerChartInstances.push(chart);
+            },
+            scales: {
+                y: { beginAtZero: false, title: { display: true, text: '点数' } },
+                x: { title: { display: true, text: '日付' } }
+            }
         }
     });
+    playerChartInstances[index] = chart;
 }
 
 function updateTargetLine(chartIndex, targetValue) {
     const chart = playerChartInstances[chartIndex];
+    if (!chart) return;  // まだ読み込まれていない
     const val = parseFloat(targetValue);
     let targetDataset = chart.data.datasets.find(d => d.label === '個人目標');
 
@@ -183,16 +260,25 @@ function updateTargetLine(chartIndex, targetValue) {
 let trendChart = null;
 let globalMatchYearsDatasets = [];
 let globalMatchYearsLabels = [];
+let currentMatchYearsEvent = 'AR60';
 
-function initMatchYearsChart(labels, datasets) {
-    globalMatchYearsLabels = labels;
-    globalMatchYearsDatasets = datasets;
-
-    // 初期表示
-    updateMatchYearsChart('AR60');
+function initMatchYearsChart(url) {
+    const canvas = document.getElementById('teamTrendChart');
+    if (!canvas) return;
+    whenVisible(canvas, () => {
+        fetchChartData(url).then(data => {
+            if (!data.datasets || data.datasets.length === 0) return;
+            globalMatchYearsLabels = data.labels;
+            globalMatchYearsDatasets = data.datasets;
+
+            // 初期表示 (読み込み中にタブが押されていればその種目)
+            updateMatchYearsChart(currentMatchYearsEvent);
+        }).catch(err => console.error(err));
+    });
 }
 
 function updateMatchYearsChart(targetEvent) {
+    currentMatchYearsEvent = targetEvent;
     // タブの見た目更新
     const tabs = document.querySelectorAll('.graph-tab-btn');
     if (tabs.length > 0) {
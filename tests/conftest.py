@@ -0,0 +1,90 @@
+# ---------------------------------------------------------
+# テストの準備 (一時ディレクトリの SQLite に対して main をそのまま使う)
+# ---------------------------------------------------------
+# main は import 時に DATABASE_URL などを読むので、import より前に一時ディレクトリを指しておく。
+# テストごとにテーブルを作り直し、データバージョンを前のテストより先に進めて
+# バージョンをキーにしたキャッシュ (順位・アーカイブ一覧・選考の調子など) が残らないようにする。
+import csv
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_TMP = tempfile.mkdtemp(prefix='wrsc-test-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_TMP, 'test.db')
+os.environ['JINJA_CACHE_DIR'] = os.path.join(_TMP, 'jinja')
+os.environ.pop('COLUMNAR_SNAPSHOT', None)
+os.environ.pop('CACHE_REDIS_URL', None)
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+
+HEADER = ['日付', '大会名', '識別', '選手名', '性別', '入部年度', '種目', 'S1', 'S2', 'S3', 'S4', 'S5', 'S6', '合計']
+
+
+@pytest.fixture(scope='session', autouse=True)
+def _remove_tmp():
+    yield
+    shutil.rmtree(_TMP, ignore_errors=True)
+
+
+@pytest.fixture
+def app(tmp_path):
+    """空のDB (init_db 済み) を用意してアプリケーションコンテキストに入る"""
+    flask_app = main.app
+    flask_app.config.update(TESTING=True, IMPORT_ASYNC=False, CACHE_ENABLED=False, COLUMNAR_SNAPSHOT=False,
+                            UPLOAD_FOLDER=str(tmp_path / 'uploads'), ARCHIVE_DIR=str(tmp_path / 'archive'),
+                            BACKUP_DIR=str(tmp_path / 'backups'), IMPORT_CHUNK_SIZE=5000)
+    os.makedirs(flask_app.config['UPLOAD_FOLDER'], exist_ok=True)
+    main._archive_engines.clear()
+    with flask_app.app_context():
+        db = main.db
+        try:
+            version = main.current_data_version()
+        except Exception:  # 最初のテスト (テーブルがまだない)
+            db.session.rollback()
+            version = 0
+        db.session.remove()
+        db.drop_all()
+        db.session.execute(main.text('PRAGMA user_version = 0'))
+        db.session.commit()
+        main.init_db()
+        main.DataVersion.query.delete()
+        db.session.add(main.DataVersion(id=1, version=version + 1))
+        db.session.commit()
+        # init_db() 済みなので最初のリクエストでの準備 (_start_worker) は要らない。
+        # テストのスレッドがトランザクションを開いたまま別スレッドで書き込みロックを待つと止まるので飛ばす
+        main._worker_started = True
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def write_csv(tmp_path):
+    """rows (HEADER の列順のリスト) を CSV にしてパスを返す。header と encoding は変えられる"""
+    counter = [0]
+
+    def write(rows, header=HEADER, encoding='utf-8'):
+        counter[0] += 1
+        path = tmp_path / f'scores_{counter[0]}.csv'
+        with open(path, 'w', encoding=encoding, newline='') as f:
+            w = csv.writer(f)
+            w.writerow(header)
+            w.writerows(rows)
+        return str(path)
+    return write
+
+
+def score_row(date, name, event='AR60', series=(100.0,) * 6, match='春季関東大会', category='Individual',
+              gender='男', entry_year=2022, total=None):
+    """HEADER の列順の1行 (合計を省くと S1〜S6 の和)"""
+    total = round(sum(series), 1) if total is None else total
+    return [date, match, category, name, gender, entry_year, event, *series, total]
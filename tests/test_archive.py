@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+import main
+from conftest import score_row
+
+
+@pytest.fixture
+def seasons(app, write_csv):
+    """2020〜2022年度の成績 (年度ごとに2人 × AR60・SB3x20)"""
+    rows = []
+    for year in (2020, 2021, 2022):
+        for name, gender, base in (('山田 太郎', '男', 100.0), ('鈴木 花子', '女', 98.0)):
+            rows.append(score_row(f'{year}/05/03', name, gender=gender, category='Regular', series=(base,) * 6))
+            rows.append(score_row(f'{year}/05/03', name, gender=gender, event='SB3x20', series=(base - 5,) * 6))
+    path = write_csv(rows)
+    assert main.run_import(path)['inserted'] == 12
+    return path
+
+
+def _scores(session, **filters):
+    return [(s.id, s.date, s.match_name, s.event_name, s.category, s.total, s.s1, s.row_version)
+            for s in session.query(main.Score).filter_by(**filters).order_by(main.Score.id)]
+
+
+def _match_summary(data):
+    return ({e: [(s.id, s.player.name, s.total) for s in rows] for e, rows in data['individual_results'].items()},
+            {k: data[k] and {e: (v['total'], [m.id for m in v['members']]) for e, v in data[k].items()}
+             for k in ('team_results_male', 'team_results_female', 'team_results_mixed')})
+
+
+def test_archive_round_trip(seasons):
+    before = _scores(main.db.session, academic_year=2020)
+    yamada = main.Player.query.filter_by(name='山田 太郎').one().id
+    player_page = [s.id for s in main.query_player_scores(yamada)[0]]
+    match_before = _match_summary(main.match_result_data(main.db.session, '春季関東大会', 2020))
+
+    meta = main.archive_season(2020)
+    assert (meta['academic_year'], meta['scores']) == (2020, 4)
+    assert os.path.exists(os.path.join(main.app.config['ARCHIVE_DIR'], meta['filename']))
+    assert _scores(main.db.session, academic_year=2020) == []
+    assert main.Score.query.count() == 8
+    assert main.SeasonMatchSummary.query.filter_by(academic_year=2020).count() == 1
+
+    with main.archive_session(2020) as session:
+        assert _scores(session) == before
+        assert _match_summary(main.match_result_data(session, '春季関東大会', 2020)) == match_before
+    assert [s.id for s in main.query_player_scores(yamada)[0]] == player_page
+    assert main.archived_score_ids([before[0][0], before[-1][0] + 1]) == {before[0][0]}
+
+
+def test_reimport_of_archived_rows(seasons, write_csv):
+    main.archive_season(2020)
+    report = main.run_import(seasons)
+    assert (report['inserted'], report['unchanged'], report['rejected']) == (0, 12, [])
+
+    changed = write_csv([score_row('2020/05/03', '山田 太郎', category='Regular', series=(101.0,) * 6),
+                         score_row('2020/06/01', '山田 太郎')])
+    report = main.run_import(changed)
+    assert report['rejected'] == [(2, main.ARCHIVED_ROW_REASON), (3, main.ARCHIVED_ROW_REASON)]
+    assert main.Score.query.filter_by(academic_year=2020).count() == 0
+
+
+@pytest.mark.parametrize('year, message', [
+    (2021, '2020年度の成績が残っています'),
+    (2019, '2019年度の成績がありません'),
+    (main.academic_year(main.datetime.now().date()), 'まだ終わっていません'),
+])
+def test_archive_errors(seasons, year, message):
+    with pytest.raises(main.ArchiveError, match=message):
+        main.archive_season(year)
+    assert main.Score.query.count() == 12
+    assert not os.path.exists(main.app.config['ARCHIVE_DIR']) or os.listdir(main.app.config['ARCHIVE_DIR']) == []
+
+
+def test_archive_twice_is_rejected(seasons):
+    main.archive_season(2020)
+    with pytest.raises(main.ArchiveError, match='既にアーカイブ済み'):
+        main.archive_season(2020)
+
+
+def test_archived_scores_cannot_be_edited(seasons):
+    archived_id = main.Score.query.filter_by(academic_year=2020).first().id
+    main.archive_season(2020)
+    with pytest.raises(main.ScoreBatchError) as e:
+        main.apply_score_batch(deletes=[archived_id])
+    assert e.value.errors == [(f'id={archived_id}', 'アーカイブ済みの年度の成績は編集・削除できません')]
+
+
+def test_new_ids_follow_archived_ids(app, write_csv):
+    main.run_import(write_csv([score_row('2020/05/03', '山田 太郎'), score_row('2020/05/04', '山田 太郎')]))
+    last_id = main.db.session.query(main.func.max(main.Score.id)).scalar()
+    main.archive_season(2020)
+    assert main.Score.query.count() == 0
+    main.run_import(write_csv([score_row('2021/05/03', '山田 太郎')]))
+    assert main.Score.query.one().id == last_id + 1
+
+
+def test_archive_engine_is_safe_across_threads(seasons):
+    from concurrent.futures import ThreadPoolExecutor
+    main.archive_season(2020)
+    engine = main._archive_engine(main.archived_years()[2020].filename)
+    assert type(engine.pool).__name__ != 'SingletonThreadPool'  # メモリDB用のプールは接続を他のスレッドから閉じる
+
+    main.db.session.rollback()  # 各スレッドがデータバージョンを読めるようにロックを放す
+
+    def read(_):
+        with main.app.app_context(), main.archive_session(2020) as session:
+            return session.query(main.Score).count()
+    with ThreadPoolExecutor(12) as pool:
+        assert list(pool.map(read, range(60))) == [4] * 60
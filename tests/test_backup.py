@@ -0,0 +1,103 @@
+import gzip
+import os
+import sqlite3
+
+import pytest
+
+import main
+from conftest import score_row
+
+
+def _rows():
+    """成績と明細の内容 (row_version は復元で進むので比べない)"""
+    out = sorted((s.id, s.player.name, s.date, s.match_name, s.event_name, s.category, s.s1, s.total)
+                 for s in main.Score.query)
+    shots = sorted(main.db.session.query(main.ScoreShots.score_id, main.ScoreShots.shots))
+    main.db.session.rollback()
+    return out, shots
+
+
+def _stats():
+    out = sorted((s.player_id, s.event_name, s.academic_year, s.count, s.total_max) for s in main.PlayerEventStat.query)
+    main.db.session.rollback()
+    return out
+
+
+@pytest.fixture
+def data(app, write_csv):
+    main.run_import(write_csv([score_row(f'2024/05/0{d}', name, gender=gender)
+                               for d in range(1, 5) for name, gender in (('山田 太郎', '男'), ('鈴木 花子', '女'))]))
+    first = main.Score.query.order_by(main.Score.id).first().id
+    main.apply_score_batch([{'id': first, 'shots': ' '.join(['10.5*'] * 10 + ['10.0'] * 50)}])
+    main.db.session.rollback()
+    return first
+
+
+def _change(first, write_csv, day):
+    """編集・削除・追加をまとめて行う"""
+    main.apply_score_batch([{'id': first, **{f: 90 for f in main.SERIES_FIELDS}}], [first + 1])
+    main.run_import(write_csv([score_row(day, '佐藤 次郎')]))
+    main.db.session.rollback()
+
+
+def test_snapshot_is_a_gzipped_copy_of_the_db(app, data):
+    meta = main.create_snapshot()
+    path = os.path.join(app.config['BACKUP_DIR'], meta['file'])
+    with open(path, 'rb') as f:
+        assert f.read(2) == b'\x1f\x8b'
+    raw = path[:-3]
+    with gzip.open(path) as f_in, open(raw, 'wb') as f_out:
+        f_out.write(f_in.read())
+    conn = sqlite3.connect(raw)
+    try:
+        assert conn.execute('SELECT COUNT(*) FROM score').fetchone()[0] == meta['scores'] == 8
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == main.MIGRATIONS[-1][0]
+    finally:
+        conn.close()
+    assert [m['name'] for m in main.list_backups()] == [meta['name']]
+    assert main.latest_snapshot()['name'] == meta['name']  # データが変わっていなければ作り直さない
+
+
+def test_restore_snapshot_by_name(app, client, data, write_csv):
+    before, stats = _rows(), _stats()
+    meta = main.create_snapshot()
+    _change(data, write_csv, '2024/06/01')
+    assert _rows() != before
+
+    res = client.post('/restore', data={'name': meta['name']})
+    assert res.status_code == 200
+    body = res.get_json()
+    assert (body['incremental'], body['scores']) == (False, 8)
+    main.db.session.rollback()
+    assert _rows() == before
+    assert _stats() == stats  # 集計も作り直す
+    assert body['safety_snapshot'] in [m['name'] for m in main.list_backups()]  # 復元前の状態も残す
+
+
+def test_incremental_on_top_of_snapshot(app, client, data, write_csv):
+    base = main.create_snapshot()
+    _change(data, write_csv, '2024/06/01')
+    expected, stats = _rows(), _stats()
+    inc = main.create_incremental(base['name'])
+    assert (inc['base'], inc['changed_scores']) == (base['name'], 2)  # 編集した1件と追加した1件
+
+    _change(data + 2, write_csv, '2024/07/01')
+    assert _rows() != expected
+    with open(os.path.join(app.config['BACKUP_DIR'], inc['file']), 'rb') as f:  # 差分のファイルを添付して復元する
+        res = client.post('/restore', data={'file': (f, inc['file'])}, content_type='multipart/form-data')
+    assert res.status_code == 200
+    assert res.get_json()['incremental'] is True
+    main.db.session.rollback()
+    assert _rows() == expected
+    assert _stats() == stats
+
+
+def test_restore_rejects_bad_files(app, client, data, tmp_path):
+    path = tmp_path / 'broken.db'
+    path.write_bytes(b'not a database')
+    with pytest.raises(main.BackupError):
+        main.restore_backup(str(path))
+    assert client.post('/restore', data={'name': 'missing'}).status_code == 400
+    with pytest.raises(main.BackupError, match='スナップショットを指定'):
+        main.create_incremental(main.create_incremental(main.create_snapshot()['name'])['name'])
+    assert len(_rows()[0]) == 8
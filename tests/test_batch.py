@@ -0,0 +1,86 @@
+import pytest
+
+import main
+from conftest import score_row
+
+
+@pytest.fixture
+def scores(app, write_csv):
+    """山田 太郎の AR60 を3件取り込んで (id, ...) を返す"""
+    main.run_import(write_csv([score_row(f'2024/05/0{d}', '山田 太郎') for d in (1, 2, 3)]))
+    return [s.id for s in main.Score.query.order_by(main.Score.id)]
+
+
+def _snapshot():
+    return [(s.id, s.s1, s.s2, s.total, s.row_version) for s in main.Score.query.order_by(main.Score.id)]
+
+
+def test_edit_and_delete_are_applied_together(scores):
+    a, b, c = scores
+    version = main.current_data_version()
+    result = main.apply_score_batch([{'id': a, 's1': 101.5, 's2': 99, 's3': 100, 's4': 100, 's5': 100, 's6': 100},
+                                     {'id': b, 's1': 100, 's2': 100, 's3': 100, 's4': 100, 's5': 100, 's6': 100}],
+                                    [c])
+    assert result == {'updated': 1, 'unchanged': 1, 'deleted': 1}
+    assert main.current_data_version() == version + 1
+    edited = main.db.session.get(main.Score, a)
+    assert (edited.s1, edited.total, edited.row_version) == (101.5, pytest.approx(600.5), version + 1)
+    assert main.db.session.get(main.Score, c) is None
+    stat = main.PlayerEventStat.query.one()
+    assert (stat.count, stat.total_max) == (2, pytest.approx(600.5))
+
+
+def test_shots_replace_series(scores):
+    a = scores[0]
+    text = ' '.join(['10.5*'] * 10 + ['10.0'] * 50)
+    assert main.apply_score_batch([{'id': a, 'shots': text}])['updated'] == 1
+    score = main.db.session.get(main.Score, a)
+    assert (score.s1, score.s2, score.total) == (105.0, 100.0, pytest.approx(605.0))
+    assert main.db.session.get(main.ScoreShots, a) is not None
+    # 明細を指定せずに点数を変えると合わなくなった明細は消す
+    main.apply_score_batch([{'id': a, **{f: 100 for f in main.SERIES_FIELDS}}])
+    assert main.db.session.get(main.ScoreShots, a) is None
+
+
+@pytest.mark.parametrize('bad, message', [
+    ({'s1': 200}, 'S1 は 0〜110 の範囲で指定してください'),
+    ({'s3': 'abc'}, 'S3 が数値ではありません'),
+    ({'id': None}, 'id がありません'),
+    ({'id': 999999}, '成績が見つかりません'),
+    ({'shots': '10 10'}, '明細: 60射の点数が必要です (2射)'),
+])
+def test_invalid_edit_writes_nothing(scores, bad, message):
+    a, b, _ = scores
+    before, version = _snapshot(), main.current_data_version()
+    valid = {'id': a, **{f: 90 for f in main.SERIES_FIELDS}}
+    with pytest.raises(main.ScoreBatchError) as e:
+        main.apply_score_batch([valid, {'id': b, **bad}], [scores[2]])
+    assert message in [reason for _, reason in e.value.errors]
+    main.db.session.rollback()
+    assert _snapshot() == before
+    assert main.current_data_version() == version
+
+
+def test_edit_and_delete_of_same_score_is_rejected(scores):
+    a = scores[0]
+    before = _snapshot()
+    with pytest.raises(main.ScoreBatchError) as e:
+        main.apply_score_batch([{'id': a, 's1': 90}], [a])
+    assert e.value.errors == [(f'id={a}', '編集と削除の両方に指定されています')]
+    assert _snapshot() == before
+
+
+def test_json_route_returns_errors_with_400(client, scores):
+    a, b, _ = scores
+    before = _snapshot()
+    res = client.post('/scores/batch', json={'edits': [{'id': a, 's1': 95}, {'id': b, 's1': 200}], 'deletes': []})
+    assert res.status_code == 400
+    assert res.get_json()['errors'] == [[f'id={b}', 'S1 は 0〜110 の範囲で指定してください']]
+    main.db.session.rollback()
+    assert _snapshot() == before
+
+    res = client.post('/scores/batch', json={'edits': [{'id': a, 's1': 95}], 'deletes': [b]})
+    assert res.status_code == 200
+    body = res.get_json()
+    assert (body['updated'], body['deleted'], body['data_version']) == (1, 1, main.current_data_version())
+    assert client.post('/scores/batch', json={'edits': 'x'}).status_code == 400
@@ -0,0 +1,34 @@
+from datetime import date, datetime
+
+import main
+from conftest import score_row
+
+
+def _freeze(monkeypatch, day):
+    """main から見た今日を day にする"""
+    class FrozenDate(date):
+        @classmethod
+        def today(cls): return day
+
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None): return datetime.combine(day, datetime.min.time())
+    monkeypatch.setattr(main, 'date', FrozenDate)
+    monkeypatch.setattr(main, 'datetime', FrozenDatetime)
+
+
+def test_cached_ranking_switches_season_on_april_first(app, client, write_csv, monkeypatch):
+    main.run_import(write_csv([score_row('2024/05/03', '山田 太郎')]))
+    main.db.session.rollback()
+    app.config['CACHE_ENABLED'] = True
+    main.result_cache.clear()
+    try:
+        _freeze(monkeypatch, date(2025, 3, 31))
+        assert '2024年度' in client.get('/ranking').get_data(as_text=True)
+        assert '2024年度' in client.get('/ranking').get_data(as_text=True)  # キャッシュから
+        _freeze(monkeypatch, date(2025, 4, 1))
+        main.db.session.rollback()
+        body = client.get('/ranking').get_data(as_text=True)
+        assert '2025年度' in body and '2024年度' not in body  # 書き込みがなくても新しい年度で作り直す
+    finally:
+        main.result_cache.clear()
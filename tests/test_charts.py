@@ -0,0 +1,55 @@
+import gzip
+import json
+
+import pytest
+
+import main
+from conftest import score_row
+
+
+@pytest.fixture
+def charts(app, write_csv):
+    main.run_import(write_csv([score_row(f'2024/{m:02d}/01', name, gender=gender, event=event, series=(95.0 + m / 10,) * 6)
+                               for m in range(4, 13) for name, gender in (('山田 太郎', '男'), ('鈴木 花子', '女'))
+                               for event in ('AR60', 'SB3x20')]))
+    pid = main.Player.query.filter_by(name='山田 太郎').one().id
+    main.db.session.rollback()
+    return ['/api/charts/monthly', f'/api/charts/player/{pid}', '/api/charts/match/春季関東大会/years']
+
+
+def test_repeat_request_with_etag_returns_304(client, charts):
+    for url in charts:
+        res = client.get(url)
+        assert res.status_code == 200 and res.is_json
+        etag = res.headers['ETag']
+        assert res.headers['Cache-Control'] == 'no-cache'
+        again = client.get(url, headers={'If-None-Match': etag})
+        assert (again.status_code, again.data, again.headers['ETag']) == (304, b'', etag)
+
+
+def test_gzip_body_matches_plain_json(client, charts):
+    url = charts[0]
+    plain = client.get(url)
+    zipped = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in zipped.headers['Vary']
+    assert json.loads(gzip.decompress(zipped.data)) == plain.get_json()
+    assert zipped.headers['ETag'] != plain.headers['ETag']  # 圧縮した本文は別の ETag
+    assert client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': zipped.headers['ETag']}).status_code == 304
+
+
+def test_write_changes_the_etag(client, charts, write_csv):
+    etags = [client.get(url).headers['ETag'] for url in charts]
+    main.db.session.rollback()
+    main.run_import(write_csv([score_row('2024/12/15', '山田 太郎', series=(104.0,) * 6)]))
+    main.db.session.rollback()
+    for url, etag in zip(charts, etags):
+        res = client.get(url, headers={'If-None-Match': etag})
+        assert res.status_code == 200
+        assert res.headers['ETag'] != etag
+    player = client.get(charts[1]).get_json()
+    assert any(624.0 in ds['data'] or 624 in ds['data'] for ds in player['datasets'])  # 新しい成績が入る
+
+
+def test_unknown_player_chart_is_404(client, charts):
+    assert client.get('/api/charts/player/999999').status_code == 404
@@ -0,0 +1,94 @@
+import os
+import time
+
+import pytest
+
+import main
+from conftest import score_row
+
+
+def test_reimport_is_idempotent(app, write_csv):
+    path = write_csv([score_row('2024/05/03', '山田 太郎'), score_row('2024/05/03', '山田 太郎', event='SB3x20')])
+    assert main.run_import(path)['inserted'] == 2
+    version = main.current_data_version()
+    report = main.run_import(path)
+    assert (report['inserted'], report['updated'], report['unchanged']) == (0, 0, 2)
+    assert main.Score.query.count() == 2
+    assert main.current_data_version() == version  # 変更がなければキャッシュも残す
+
+
+def test_changed_scores_update_the_existing_row(app, write_csv):
+    main.run_import(write_csv([score_row('2024/05/03', '山田 太郎', series=(100.0,) * 6)]))
+    score_id = main.Score.query.one().id
+    report = main.run_import(write_csv([score_row('2024/05/03', '山田 太郎', series=(101.0,) * 6)]))
+    assert (report['inserted'], report['updated']) == (0, 1)
+    score = main.Score.query.one()
+    assert (score.id, score.total) == (score_id, pytest.approx(606.0))
+    assert main.PlayerEventStat.query.one().total_max == pytest.approx(606.0)
+
+
+def test_content_key_ignores_spacing_and_width(app, write_csv):
+    main.run_import(write_csv([score_row('2024/05/03', '山田 太郎', match='東京六大学（春）', category='Regular')]))
+    report = main.run_import(write_csv([score_row('2024/05/03', '山田 太郎', match='東京六大学 (春)', category='regular')]))
+    assert (report['inserted'], report['updated']) == (0, 1)  # 同じ成績の表記の修正として上書きする
+    assert main.Score.query.one().match_name == '東京六大学 (春)'
+
+
+def test_same_key_with_different_scores_is_reported_explicitly(app, write_csv):
+    path = write_csv([
+        score_row('2024/05/03', '山田 太郎', series=(100.0,) * 6),
+        score_row('2024/05/03', '鈴木 花子', gender='女'),
+        score_row('2024/05/03', '山田 太郎', series=(98.0,) * 6),
+        score_row('2024/05/03', '鈴木 花子', gender='女'),
+    ])
+    report = main.run_import(path)
+    assert report['inserted'] == 2
+    assert report['duplicates'] == [(4, 2, True), (5, 3, False)]
+    reasons = dict(report['rejected'])
+    assert '2行目と選手・日付・大会名・種目・識別が同じで点数が違う' in reasons[4]
+    assert reasons[5] == main.DUPLICATE_ROW_REASON
+    message = main.import_report_message(report)
+    assert '点数が違うのに選手・日付・大会名・種目・識別が前の行と同じため取り込まなかった行 1件: 4行目 (2行目と同じキー)' in message
+    assert 'ファイル内で同じ成績が重なっていた行 1件' in message
+    assert main.Score.query.filter_by(event_name='AR60').count() == 2
+    assert {s.total for s in main.Score.query} == {600.0}  # 最初の行を残す
+
+
+def test_duplicate_across_chunks_is_reported(app, write_csv):
+    app.config['IMPORT_CHUNK_SIZE'] = 2
+    path = write_csv([
+        score_row('2024/05/03', '山田 太郎', series=(100.0,) * 6),
+        score_row('2024/05/04', '山田 太郎'),
+        score_row('2024/05/03', '山田 太郎', series=(97.0,) * 6),
+    ])
+    report = main.run_import(path)
+    assert report['inserted'] == 2
+    assert report['duplicates'] == [(4, None, True)]
+    assert 'ファイル内の前の行と選手・日付・大会名・種目・識別が同じで点数が違う' in dict(report['rejected'])[4]
+
+
+def test_different_category_is_a_different_score(app, write_csv):
+    report = main.run_import(write_csv([
+        score_row('2024/05/03', '山田 太郎', category='Regular'),
+        score_row('2024/05/03', '山田 太郎', category='Individual', series=(99.0,) * 6),
+    ]))
+    assert (report['inserted'], report['duplicates']) == (2, [])
+
+
+def test_async_job_stores_duplicates(app, client, write_csv):
+    app.config['IMPORT_ASYNC'] = True
+    path = write_csv([score_row('2024/05/03', '山田 太郎'), score_row('2024/05/03', '山田 太郎', series=(90.0,) * 6)])
+    with open(path, 'rb') as f:
+        res = client.post('/upload', data={'file': (f, 'scores.csv')}, content_type='multipart/form-data',
+                          headers={'Accept': 'application/json'})
+    assert res.status_code == 202
+    job_id = res.get_json()['job_id']
+    for _ in range(200):
+        main.db.session.rollback()  # テストではリクエスト間で同じセッションが残るので、前回の読み込みのトランザクションを閉じる
+        job = client.get(f'/import_jobs/{job_id}').get_json()
+        if job['status'] in ('done', 'failed'): break
+        time.sleep(0.05)
+    assert job['status'] == 'done'
+    assert job['duplicates'] == [[3, 2, True]]
+    assert '3行目 (2行目と同じキー)' in job['message']
+    assert os.listdir(app.config['UPLOAD_FOLDER']) == []  # 終わったジョブのファイルは消す
@@ -0,0 +1,87 @@
+import csv
+import io
+import sys
+
+import pytest
+
+import main
+from conftest import HEADER, score_row
+
+
+@pytest.fixture
+def scores(app, write_csv):
+    """2人 × 7日の成績 (1件は明細つき)"""
+    rows = [score_row(f'2024/05/{d:02d}', name, gender=gender, event=event)
+            for d in range(1, 8) for name, gender, event in (('山田 太郎', '男', 'AR60'), ('鈴木 花子', '女', 'SB3x20'))]
+    main.run_import(write_csv(rows))
+    score = main.Score.query.order_by(main.Score.id).first()
+    main.apply_score_batch([{'id': score.id, 'shots': ' '.join(['10.5*'] * 10 + ['10.0'] * 50)}])
+    main.db.session.rollback()
+    return score.id
+
+
+def _export(client, query=''):
+    res = client.get('/export' + query)
+    assert res.status_code == 200
+    chunks = list(res.response)  # ストリーミングのまま受け取る
+    res.close()
+    return res, chunks
+
+
+def _db_rows(**filters):
+    return main.Score.query.filter_by(**filters).count()
+
+
+def test_csv_export_streams_every_row_in_batches(app, client, scores):
+    app.config['EXPORT_BATCH_SIZE'] = 4
+    res, chunks = _export(client)
+    assert res.is_streamed
+    assert res.headers['Content-Disposition'].endswith('.csv')
+    assert len(chunks) == 4  # 14件を4件ずつ (最初のチャンクにヘッダー)
+    rows = list(csv.reader(io.StringIO(b''.join(chunks).decode('utf-8'))))
+    assert rows[0] == main.EXPORT_COLUMNS and rows[0][:14] == HEADER
+    assert len(rows) - 1 == _db_rows() == 14
+    assert [r[0] for r in rows[1:]] == sorted(r[0] for r in rows[1:])  # 日付順
+    first = rows[1]
+    assert (first[3], first[7], first[13], len(first[14].split())) == ('山田 太郎', '105.0', '605.0', 60)
+
+
+def test_csv_export_round_trips_through_import(client, scores, tmp_path):
+    _, chunks = _export(client, '?encoding=cp932')
+    path = tmp_path / 'exported.csv'
+    path.write_bytes(b''.join(chunks))
+    report = main.run_import(str(path))
+    assert (report['inserted'], report['updated'], report['unchanged'], report['rejected']) == (0, 0, 14, [])
+
+
+def test_export_filters(client, scores):
+    _, chunks = _export(client, '?event=SB3x20&date_from=2024-05-03&date_to=2024/05/05')
+    rows = list(csv.reader(io.StringIO(b''.join(chunks).decode('utf-8'))))[1:]
+    assert [(r[0], r[3]) for r in rows] == [(f'2024/05/0{d}', '鈴木 花子') for d in (3, 4, 5)]
+    assert client.get('/export?date_from=yesterday').status_code == 400
+    assert client.get('/export?format=xlsx').status_code == 400
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow'])
+def test_arrow_exports_match_db(app, client, scores, fmt):
+    pa = pytest.importorskip('pyarrow')
+    app.config['EXPORT_BATCH_SIZE'] = 5
+    _, chunks = _export(client, f'?format={fmt}')
+    data = pa.BufferReader(b''.join(chunks))
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        f = pq.ParquetFile(data)
+        assert f.metadata.num_row_groups == 3  # バッチごとに1行グループ
+        table = f.read()
+    else:
+        table = pa.ipc.open_stream(data).read_all()
+    assert table.column_names == main.EXPORT_COLUMNS
+    assert table.num_rows == _db_rows() == 14
+    assert sum(table.column('合計').to_pylist()) == pytest.approx(sum(s.total for s in main.Score.query))
+
+
+def test_arrow_export_without_pyarrow(client, scores, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)  # import すると ImportError になる
+    res = client.get('/export?format=parquet')
+    assert res.status_code == 501
+    assert 'pyarrow' in res.get_data(as_text=True)
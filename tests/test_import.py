@@ -0,0 +1,84 @@
+import pytest
+
+import main
+from conftest import score_row
+
+
+def test_import_reports_inserted_skipped_and_rejected(app, write_csv):
+    path = write_csv([
+        score_row('2024/05/03', '山田 太郎'),
+        score_row('2024/05/03', '鈴木 花子', gender='女', series=(99.5,) * 6),
+        [''] * 14,
+        score_row('2024-05-03', '佐藤 次郎'),
+        score_row('2024/05/04', '佐藤 次郎', series=('abc', 100, 100, 100, 100, 100), total=600),
+    ])
+    report = main.run_import(path)
+    assert report['inserted'] == 2
+    assert report['skipped'] == 1
+    assert report['rejected'] == [(5, '日付の形式が不正です (YYYY/MM/DD)'), (6, 'S1〜S6に数値以外が含まれています')]
+    assert main.Score.query.count() == 2
+    hanako = main.Player.query.filter_by(name='鈴木 花子').one()
+    assert hanako.gender == '女'
+    assert hanako.scores[0].total == pytest.approx(597.0)
+    assert hanako.scores[0].academic_year == 2024
+
+
+def test_total_falls_back_to_series_sum(app, write_csv):
+    main.run_import(write_csv([score_row('2025/03/01', '山田 太郎', series=(101.1, 102.2, 99.9, 100.0, 98.8, 100.0), total='')]))
+    score = main.Score.query.one()
+    assert score.total == pytest.approx(602.0)
+    assert score.academic_year == 2024  # 3月は前の年度
+
+
+def test_import_keeps_stats_table_in_sync(app, write_csv):
+    main.run_import(write_csv([
+        score_row('2024/05/03', '山田 太郎', series=(100.0,) * 6),
+        score_row('2024/06/03', '山田 太郎', series=(102.0,) * 6),
+    ]))
+    stat = main.PlayerEventStat.query.one()
+    assert (stat.count, stat.total_max, stat.total_sum) == (2, pytest.approx(612.0), pytest.approx(1212.0))
+
+
+@pytest.mark.parametrize('encoding, expected', [('cp932', 'cp932'), ('utf-8', 'utf-8'), ('utf-8-sig', 'utf-8-sig')])
+def test_sniff_encoding(app, write_csv, encoding, expected):
+    path = write_csv([score_row('2024/05/03', '山田 太郎')], encoding=encoding)
+    found, layout = main.sniff_csv(path)
+    assert (found, layout['name']) == (expected, '標準')
+    assert main.run_import(path)['inserted'] == 1
+    assert main.Player.query.one().name == '山田 太郎'
+
+
+def test_sniff_tournament_sheet_layout(app, write_csv):
+    header = ['日付', '氏名', '大会名', '種目', '区分', 'S1', 'S2', 'S3', 'S4', 'S5', 'S6', '合計点', '性別', '入部年度']
+    path = write_csv([['2024/05/03', '鈴木 花子', '選抜', 'AR60', 'Indiv', 100, 100, 100, 100, 100, 100, 600, 'Female', 2023]],
+                     header=header)
+    assert main.sniff_csv(path)[1]['name'] == '大会シート'
+    assert main.run_import(path)['inserted'] == 1
+    score = main.Score.query.one()
+    assert (score.player.name, score.player.gender, score.category, score.match_name) == ('鈴木 花子', '女', 'Individual', '選抜')
+
+
+def test_sniff_rejects_unknown_header_without_importing(app, write_csv):
+    path = write_csv([['2024/05/03', '山田 太郎']], header=['date', 'name'])
+    with pytest.raises(main.CsvFormatError, match='対応していないCSVの形式です'):
+        main.run_import(path)
+    assert main.Score.query.count() == 0
+
+
+def test_encoding_error_in_later_chunk_rolls_back(app, write_csv, tmp_path):
+    path = write_csv([score_row('2024/05/03', f'選手{i}') for i in range(10)], encoding='utf-8')
+    with open(path, 'ab') as f:
+        f.write('2024/05/04,春季関東大会,Individual,'.encode('utf-8') + '山田'.encode('cp932') + b',\xe7,2022,AR60,1,1,1,1,1,1,6\n')
+    app.config['IMPORT_CHUNK_SIZE'] = 3
+    with pytest.raises(main.CsvFormatError):
+        main.run_import(path)
+    assert main.Score.query.count() == 0
+
+
+def test_upload_route_imports_synchronously(client, write_csv):
+    path = write_csv([score_row('2024/05/03', '山田 太郎')])
+    with open(path, 'rb') as f:
+        res = client.post('/upload', data={'file': (f, 'scores.csv')}, content_type='multipart/form-data')
+    assert res.status_code == 302
+    with client.application.app_context():
+        assert main.Score.query.count() == 1
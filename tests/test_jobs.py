@@ -0,0 +1,73 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+import main
+from conftest import score_row
+
+
+@pytest.fixture
+def add_job(app, write_csv):
+    """実行中のまま止まった取り込みジョブを作る"""
+    def add(token, pid=None):
+        job = main.ImportJob(id=os.urandom(8).hex(), filename='scores.csv', status='running',
+                             filepath=write_csv([score_row('2024/05/03', '山田 太郎')]),
+                             worker_pid=pid or os.getpid(), worker_token=token)
+        main.db.session.add(job)
+        main.db.session.commit()
+        return job.id
+    return add
+
+
+def _status(job_id):
+    main.db.session.rollback()
+    status = main.db.session.get(main.ImportJob, job_id).status
+    main.db.session.rollback()  # 書き込み用の接続のロックを放して取り込みのスレッドを待たせない
+    return status
+
+
+def _wait(job_id):
+    for _ in range(200):
+        if _status(job_id) in ('done', 'failed'): break
+        time.sleep(0.05)
+    return _status(job_id)
+
+
+def test_job_of_dead_worker_with_reused_pid_is_requeued(add_job):
+    # コンテナの再起動で前のワーカーと同じPIDになった場合
+    job_id = add_job(f'{socket.gethostname()}:{os.getpid()}:1')
+    main.recover_import_jobs()
+    assert _wait(job_id) == 'done'
+    job = main.db.session.get(main.ImportJob, job_id)
+    assert (job.inserted, job.worker_token) == (1, main.worker_token())
+
+
+def test_jobs_of_live_workers_are_kept(add_job):
+    proc = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+    try:
+        live = f'{socket.gethostname()}:{proc.pid}:{main._process_start_time(proc.pid)}'
+        kept = [add_job(main.worker_token()), add_job(live, proc.pid), add_job('other-host:1:1', 1)]
+        reused = add_job(f'{socket.gethostname()}:{proc.pid}:0', proc.pid)  # PIDは生きているが起動時刻が違う
+        main.recover_import_jobs()
+        assert _wait(reused) == 'done'
+        assert [_status(job_id) for job_id in kept] == ['running'] * 3
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_worker_token_changes_after_fork():
+    token = main.worker_token()
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(w, main.worker_token().encode())
+        os._exit(0)
+    os.close(w)
+    os.waitpid(pid, 0)
+    child = os.read(r, 200).decode()
+    assert child != token and child.split(':')[1] == str(pid)
@@ -0,0 +1,118 @@
+import math
+from datetime import date
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+import lineup
+import main
+from conftest import score_row
+
+
+def _brute_force(mean, std, size, target):
+    """全部の組み合わせを調べた (期待値が最大の組, 目標を超える確率が最大の組)"""
+    def probability(c):
+        sd = math.sqrt(sum(std[i] ** 2 for i in c))
+        return 0.5 * math.erfc((target - sum(mean[i] for i in c)) / sd / math.sqrt(2))
+    combos = list(combinations(range(len(mean)), size))
+    return max(combos, key=lambda c: sum(mean[i] for i in c)), max(combos, key=probability)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_select_team_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    mean, std = rng.uniform(560, 620, 8), rng.uniform(2, 15, 8)
+    target = float(np.sort(mean)[-3:].sum())
+    best_expected, best_goal = _brute_force(mean, std, 3, target)
+    assert tuple(lineup.select_team(mean, std, 3)[0]['members']) == best_expected
+    teams = lineup.select_team(mean, std, 3, target, 'goal')
+    assert tuple(teams[0]['members']) == best_goal
+    assert [t['probability'] for t in teams] == sorted((t['probability'] for t in teams), reverse=True)
+    assert len(teams) == 6  # 最適 + 次点5つ
+
+
+def test_select_team_limits_combinations():
+    rng = np.random.default_rng(0)
+    mean, std = rng.uniform(560, 620, 40), rng.uniform(2, 15, 40)
+    teams = lineup.select_team(mean, std, 4, max_combinations=500)
+    assert sorted(teams[0]['members']) == sorted(np.argsort(-mean)[:4].tolist())
+    assert lineup.select_team(mean[:2], std[:2], 3) == []
+    with pytest.raises(ValueError):
+        lineup.select_team(mean, std, 3, objective='goal')
+
+
+def test_compute_form_weights_recent_scores():
+    d = date(2024, 6, 1).toordinal()
+    form = lineup.compute_form([1, 1, 2, 3, 3], [d - 360, d, d, d - 30, d], [580.0, 600.0, 590.0, 590.0, 590.0], 180)
+    assert form.player_ids.tolist() == [1, 2, 3]
+    assert 595.0 < form.mean[0] < 600.0  # 1年前の成績の重みは 1/4
+    assert form.count.tolist() == [2, 1, 2]
+    assert form.last.tolist() == [d, d, d]
+    assert form.std[1] > 0  # 1件だけでも全体の分散を混ぜる
+    assert (form.std > 0).all()
+    assert len(lineup.compute_form([], [], [], 180)) == 0
+
+
+@pytest.fixture
+def roster(app, write_csv):
+    """2024年度の選考用: 男子4人・女子2人 (うち1人は卒業済み) の AR60"""
+    rows = []
+    for name, gender, entry, base in (('一郎', '男', 2023, 600.0), ('二郎', '男', 2022, 598.0), ('三郎', '男', 2024, 590.0),
+                                      ('四郎', '男', 2021, 585.0), ('卒業', '男', 2019, 620.0),
+                                      ('花子', '女', 2022, 595.0), ('桜', '女', 2023, 580.0)):
+        for day in ('2024/05/03', '2024/06/10'):
+            rows.append(score_row(day, name, gender=gender, entry_year=entry, series=(base / 6,) * 6, total=base))
+    main.run_import(write_csv(rows))
+    return {p.name: p.id for p in main.Player.query}
+
+
+def test_select_lineup_uses_enrolled_players_of_gender(roster):
+    result = main.select_lineup('春季関東大会', 'AR60', '男', year=2024, size=3)
+    assert [c['name'] for c in result['candidates']] == ['一郎', '二郎', '三郎', '四郎']  # 卒業した選手は入らない
+    assert [m['name'] for m in result['teams'][0]['members']] == ['一郎', '二郎', '三郎']
+    assert result['teams'][0]['expected'] == pytest.approx(1788.0)
+    assert result['target'] == main.DEFAULT_TEAM_GOALS['AR60']  # 省くとチーム目標
+
+    women = main.select_lineup('春季関東大会', 'AR60', '女', year=2024, size=3)
+    assert [c['name'] for c in women['candidates']] == ['花子', '桜']
+    assert women['teams'] == []
+
+
+def test_select_lineup_exclude_and_mixed(roster):
+    result = main.select_lineup('春季関東大会', 'AR60', '男', year=2024, exclude={roster['一郎'], roster['花子']})
+    assert result['excluded'] == [{'id': roster['一郎'], 'name': '一郎'}]  # 対象外の選手は無視する
+    assert [m['name'] for m in result['teams'][0]['members']] == ['二郎', '三郎', '四郎']
+
+    mixed = main.select_lineup('早慶戦', 'AR60', year=2024, size=3, objective='goal', target=1790)
+    assert (mixed['mixed'], mixed['gender']) == (True, None)
+    assert [m['name'] for m in mixed['teams'][0]['members']] == ['一郎', '二郎', '花子']
+    assert mixed['teams'][0]['probability'] > 0.5
+
+
+@pytest.mark.parametrize('kwargs, message', [
+    ({'event_name': 'P60'}, 'P60 はありません'),
+    ({'gender': 'X'}, '性別は'),
+    ({'objective': 'best'}, 'objective は'),
+    ({'size': 11}, '人数は'),
+])
+def test_select_lineup_rejects_bad_conditions(roster, kwargs, message):
+    args = dict(match_name='春季関東大会', event_name='AR60', year=2024) | kwargs
+    with pytest.raises(ValueError, match=message):
+        main.select_lineup(**args)
+
+
+def test_lineup_route_and_form_refresh(client, roster, write_csv):
+    url = '/match/春季関東大会/lineup?event=AR60&gender=男&year=2024&size=3'
+    res = client.get(url, headers={'Accept': 'application/json'})
+    assert res.status_code == 200
+    assert res.get_json()['candidates'][0]['name'] == '一郎'
+    res = client.get(url.replace('size=3', 'size=11'), headers={'Accept': 'application/json'})
+    assert (res.status_code, res.get_json()['error']) == (400, '人数は 1〜10 で指定してください')
+    assert client.get(url).status_code == 200
+
+    main.db.session.rollback()
+    main.run_import(write_csv([score_row(f'2024/07/0{d}', '四郎', entry_year=2021, series=(105.0,) * 6) for d in range(1, 5)]))
+    main.db.session.rollback()
+    res = client.get(url, headers={'Accept': 'application/json'})
+    assert res.get_json()['candidates'][0]['name'] == '四郎'  # スコア更新後は調子を計算し直す
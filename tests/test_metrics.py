@@ -0,0 +1,46 @@
+import pytest
+from sqlalchemy import event
+
+import main
+from conftest import score_row
+
+
+@pytest.fixture
+def instrumented(app, monkeypatch):
+    """METRICS=1 と同じ状態にする (SQLのフックを登録し、メトリクスは空から始める)"""
+    monkeypatch.setitem(app.config, 'METRICS_ENABLED', True)
+    monkeypatch.setattr(main, 'metrics', main.Metrics())
+    engines = list(main.db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', main._on_before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', main._on_after_cursor_execute)
+    yield main.metrics
+    for engine in engines:
+        event.remove(engine, 'before_cursor_execute', main._on_before_cursor_execute)
+        event.remove(engine, 'after_cursor_execute', main._on_after_cursor_execute)
+
+
+def _route_values(m, route):
+    return (m._values.get(('wrsc_db_queries_total', (('route', route),)), 0),
+            m._values.get(('wrsc_http_requests_total', (('method', 'GET'), ('route', route), ('status', 200))), 0))
+
+
+def test_streamed_export_counts_queries_after_the_response_starts(app, client, write_csv, instrumented):
+    main.run_import(write_csv([score_row(f'2024/05/{d:02d}', '山田 太郎') for d in range(1, 8)]))
+    main.db.session.rollback()
+    app.config['EXPORT_BATCH_SIZE'] = 2
+    res = client.get('/export')
+    assert _route_values(instrumented, '/export') == (0, 0)  # 本文を送り終わるまでは記録しない
+    assert res.get_data(as_text=True).count('\r\n') == 8
+    res.close()
+    queries, requests = _route_values(instrumented, '/export')
+    assert requests == 1
+    assert queries >= 1  # 本文を作る間に実行した SELECT
+    db_time = instrumented._histograms[('wrsc_http_request_db_seconds', (('method', 'GET'), ('route', '/export')))]
+    assert db_time['count'] == 1 and db_time['sum'] > 0
+
+
+def test_regular_response_is_recorded_in_after_request(client, instrumented):
+    client.get('/ranking')
+    queries, requests = _route_values(instrumented, '/ranking')
+    assert requests == 1 and queries > 0
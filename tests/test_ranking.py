@@ -0,0 +1,26 @@
+import main
+from conftest import score_row
+
+
+def test_rank_index_ties_share_a_rank_and_the_next_rank_skips():
+    rows = [('AR60', '男', best, best) for best in (600.0, 599.0, 598.0, 597.04, 596.96, 590.0)]
+    rows += [('AR60', '女', 599.5, 599.5), ('SB3x20', '男', 580.0, None)]
+    idx = main.RankIndex(rows)
+    assert [idx.rank('AR60', 'best', v, '男') for v in (600.0, 599.0, 598.0, 597.04, 596.96, 590.0)] == [1, 2, 3, 4, 4, 6]
+    assert idx.lookup('AR60', 'best', 597.0, '男') == {'rank': 4, 'tie_low': 4, 'tie_high': 5, 'ties': 2,
+                                                      'total': 6, 'percentile': 16.7}
+    assert idx.rank('AR60', 'best', 599.0) == 3  # 男女合わせた順位
+    assert idx.rank('AR60', 'best', 599.5, '女') == 1
+    assert idx.rank('AR60', 'best', 650.0, '男') == 1  # 記録にない値でも入る位置の順位
+    assert idx.rank('SB3x20', 'avg', 580.0, '男') is None
+    assert idx.rank('P60', 'best', 580.0, '男') is None
+
+
+def test_ranking_view_uses_tie_aware_ranks(app, write_csv):
+    totals = {'一郎': 600.0, '二郎': 599.0, '三郎': 598.0, '四郎': 597.0, '五郎': 597.0, '六郎': 590.0}
+    main.run_import(write_csv([score_row('2024/05/03', name, series=(t / 6,) * 6, total=t) for name, t in totals.items()]))
+    with app.test_request_context('/ranking'):
+        data = main.ranking.__wrapped__()['rankings_all']['AR60']['男']
+    assert [(p['name'], p['rank_max']) for p in data['max']] == [
+        ('一郎', 1), ('二郎', 2), ('三郎', 3), ('四郎', 4), ('五郎', 4), ('六郎', 6)]
+    assert [p['rank_avg'] for p in data['avg']] == [1, 2, 3, 4, 4, 6]
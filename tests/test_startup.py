@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def test_import_does_not_load_heavy_libraries_or_touch_disk(tmp_path):
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + str(tmp_path / 'app.db'), JINJA_CACHE_DIR=str(tmp_path / 'jinja'))
+    code = ('import sys, threading, main; '
+            'print(sorted(m for m in ("numpy", "pandas", "columnar", "lineup", "shots") if m in sys.modules), '
+            'threading.active_count())')
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True, capture_output=True, text=True)
+    assert out.stdout.split() == ['[]', '1']
+    assert not (tmp_path / 'jinja').exists()
+    assert not (tmp_path / 'app.db').exists()
+
+
+def test_warm_loads_libraries_and_compiles_templates(tmp_path):
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + str(tmp_path / 'app.db'), JINJA_CACHE_DIR=str(tmp_path / 'jinja'))
+    code = 'import sys, main; main.warm(); print("numpy" in sys.modules and "pandas" in sys.modules)'
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True, capture_output=True, text=True)
+    assert out.stdout.strip() == 'True'
+    assert len(os.listdir(tmp_path / 'jinja')) == len([n for n in os.listdir(os.path.join(ROOT, 'templates')) if n.endswith('.html')])
+    assert not (tmp_path / 'app.db').exists()  # DBには接続しない
@@ -0,0 +1,74 @@
+import pytest
+
+import main
+from conftest import score_row
+
+
+def _aggregate():
+    """Score から直接集計した (選手, 種目, 年度) → (件数, 合計, 最高, 2乗和)"""
+    S = main.Score
+    rows = main.db.session.query(S.player_id, S.event_name, S.academic_year, main.func.count(S.id), main.func.sum(S.total),
+                                 main.func.max(S.total), main.func.sum(S.total * S.total)) \
+        .group_by(S.player_id, S.event_name, S.academic_year).all()
+    return {r[:3]: (r[3], pytest.approx(r[4]), pytest.approx(r[5]), pytest.approx(r[6])) for r in rows}
+
+
+def _stats():
+    return {(s.player_id, s.event_name, s.academic_year): (s.count, s.total_sum, s.total_max, s.total_sum_sq)
+            for s in main.PlayerEventStat.query}
+
+
+def _assert_in_sync():
+    main.db.session.rollback()
+    assert _stats() == _aggregate()
+    main.db.session.rollback()
+
+
+def test_stats_follow_every_write_path(app, client, write_csv):
+    # 取り込み (登録): 2つの年度・2種目
+    main.run_import(write_csv([score_row('2024/05/03', '山田 太郎', series=(102.0,) * 6),
+                               score_row('2024/05/04', '山田 太郎', series=(100.0,) * 6),
+                               score_row('2025/03/01', '山田 太郎'),
+                               score_row('2024/05/03', '山田 太郎', event='SB3x20'),
+                               score_row('2024/05/03', '鈴木 花子', gender='女')]))
+    _assert_in_sync()
+    best = main.Score.query.filter_by(total=612.0).one().id
+
+    # 取り込み (上書き): 最高点の成績を下げる
+    main.run_import(write_csv([score_row('2024/05/03', '山田 太郎', series=(95.0,) * 6)]))
+    _assert_in_sync()
+    assert main.db.session.get(main.PlayerEventStat, (main.db.session.get(main.Score, best).player_id, 'AR60', 2024)).total_max == 600.0
+    main.db.session.rollback()
+
+    # 編集フォーム
+    res = client.post(f'/edit/{best}', data={**{f: '104' for f in main.SERIES_FIELDS}, 'shots': ''})
+    assert res.status_code == 302
+    _assert_in_sync()
+
+    # 削除
+    sb = main.Score.query.filter_by(event_name='SB3x20').one().id
+    main.db.session.rollback()
+    assert client.post(f'/delete/{sb}').status_code == 302
+    _assert_in_sync()
+    assert not main.PlayerEventStat.query.filter_by(event_name='SB3x20').count()  # 0件になった集計は消す
+
+    # 一括編集 (JSON)
+    ids = [s.id for s in main.Score.query.order_by(main.Score.id)]
+    main.db.session.rollback()
+    res = client.post('/scores/batch', json={'edits': [{'id': ids[0], **{f: 90 for f in main.SERIES_FIELDS}}],
+                                             'deletes': [ids[-1]]})
+    assert res.status_code == 200
+    _assert_in_sync()
+
+
+def test_rebuild_stats_matches_group_by(app, write_csv):
+    main.run_import(write_csv([score_row(f'2024/0{m}/01', name, gender=gender, event=event, series=(90.0 + m,) * 6)
+                               for m in range(4, 10) for name, gender in (('山田 太郎', '男'), ('鈴木 花子', '女'))
+                               for event in ('AR60', 'SB3x20')]))
+    main.PlayerEventStat.query.delete()
+    main.db.session.add(main.PlayerEventStat(player_id=999, event_name='AR60', academic_year=2000, count=1, total_sum=1.0))
+    main.db.session.commit()
+    main.rebuild_stats()
+    main.db.session.commit()
+    _assert_in_sync()
+    assert len(_stats()) == 4